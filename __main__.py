@@ -1,5 +1,10 @@
+import os
 import demo
 
 if __name__ == '__main__':
-    game = demo.Game()
-    game.run()
+    game = demo.Game(record=os.environ.get('EUSDAB_RECORD'))
+    try:
+        game.run()
+    finally:
+        if game.recorder is not None:
+            game.recorder.close()
@@ -0,0 +1,199 @@
+"""Players and bots as entities of an `ecs.Registry`, and the systems
+updating them.
+
+Actor kinds are compiled from the state machines of `player.Model` and
+`player.Bot`: the behaviour of every state (walk speed, jump force, clip)
+becomes arrays indexed by state id, so that systems update all the
+entities of a kind with a few array operations, the way
+`player.update_all` updates models one by one.
+"""
+import numpy as np
+import ecs
+import player
+from animation import AnimationFactory, _EPSILON
+from physics import _world
+from player import Controls, TICK, JumpState
+
+class Kind(object):
+    """Actor kind, compiled from the model class `model`."""
+    def __init__(self, tag, model):
+        machine = model.machine
+        machine.load()
+        states = machine.states
+        self.tag = tag
+        self.size = model.size
+        self.initial_states = np.array([machine.ids[name]
+            for name in model.initial_states], dtype=np.int16)
+        self.width = machine.width
+        self.table = np.array(machine.table, dtype=np.int16)
+        # clips are looked up when drawn, to be evicted when unused
+        self.keys = [state.key for state in states]
+        clips = [state.clip for state in states]
+        self.speed = np.array([getattr(state, 'speed', 0.)
+            for state in states])
+        self.jump = np.array([isinstance(state, JumpState)
+            for state in states])
+        self.force = np.array([state.force if isinstance(state, JumpState)
+            else 0. for state in states])
+        self.loop = np.array([state.loop for state in states])
+        self.fps = np.array([clip.fps for clip in clips])
+        self.frames = np.array([len(clip.frames) for clip in clips])
+        self.duration = self.frames / self.fps
+
+    def next(self, states, control, pred=True):
+        """States reached from `states` by `(control, pred)`."""
+        target = self.table[states.astype(np.intp) * self.width
+                + 2 * control + bool(pred)]
+        return np.where(target < 0, states, target)
+
+_kinds = {}
+
+def kinds():
+    """Player and bot kinds, compiled on first use (clips are loaded)."""
+    if not _kinds:
+        _kinds['player'] = Kind('player', player.Model)
+        _kinds['bot'] = Kind('bot', player.Bot)
+    return _kinds
+
+def create_registry():
+    registry = ecs.Registry()
+    for name in ('position', 'previous', 'velocity', 'acceleration',
+            'size'):
+        registry.register(name, np.float64, (2,))
+    registry.register('contact', np.bool_)
+    registry.register('state', np.int16)
+    registry.register('active', np.int16)
+    registry.register('time', np.float64)
+    for tag in ('player', 'bot'):
+        registry.register(tag)
+    return registry
+
+def spawn(registry, tag, n=1, x=0., y=0., rng=None):
+    """Spawn `n` actors of kind `tag` at (x, y) (values or arrays), in one
+    of their initial states picked with `rng` (a numpy RandomState)."""
+    kind = kinds()[tag]
+    rng = rng or np.random
+    initial = kind.initial_states[rng.randint(len(kind.initial_states),
+        size=n)]
+    position = np.column_stack((np.broadcast_to(x, n),
+        np.broadcast_to(y, n)))
+    return registry.spawn(n, position=position, previous=position,
+            velocity=0., acceleration=(_world.gravity.x, _world.gravity.y),
+            size=kind.size, contact=False, state=initial, active=initial,
+            time=0., **{tag: True})
+
+def control(registry, entities, control, pred=True):
+    """Send `(control, pred)` to `entities`, as `Model.control`."""
+    for archetype, rows in registry.groups(entities):
+        kind = _kind_of(archetype)
+        states = archetype.columns['state']
+        states[rows] = kind.next(states[rows], control, pred)
+
+def _kind_of(archetype):
+    for tag, kind in kinds().items():
+        if tag in archetype.components:
+            return kind
+    raise TypeError("Archetype without actor kind")
+
+def _actors(registry):
+    for kind in kinds().values():
+        for archetype in registry.query(kind.tag, 'state', 'active', 'time'):
+            yield kind, archetype
+
+def physics_system(registry, world=_world):
+    """Integrate the bodies and keep them inside the bounds of `world`, as
+    `physics.World.update` (without collisions)."""
+    left = world.position.x
+    right = world.position.x + world.size.x
+    bottom = world.position.y + world.size.y
+    gravity = (world.gravity.x, world.gravity.y)
+    for archetype in registry.query('position', 'previous', 'velocity',
+            'acceleration', 'size', 'contact'):
+        p, v = archetype.view('position'), archetype.view('velocity')
+        a, s = archetype.view('acceleration'), archetype.view('size')
+        contact = archetype.view('contact')
+        archetype.view('previous')[:] = p
+        contact[:] = False
+        v += a
+        p += v
+        px, vx = p[:, 0], v[:, 0]
+        under = px < left
+        px[under] = left
+        vx[under] = 0
+        over = ~under & (px + s[:, 0] > right)
+        px[over] = right - s[over, 0]
+        vx[over] = 0
+        floor = p[:, 1] + s[:, 1] > bottom
+        p[floor, 1] = bottom - s[floor, 1]
+        v[floor, 1] = 0
+        a[floor] = gravity
+        contact[floor] = True
+
+def state_system(registry):
+    """Run the behaviour of the active states, then the transitions, as
+    the `State.update_all` then `Model.update_transition` of models."""
+    for kind, archetype in _actors(registry):
+        state, active = archetype.view('state'), archetype.view('active')
+        time = archetype.view('time')
+        p, v = archetype.view('position'), archetype.view('velocity')
+        contact = archetype.view('contact')
+        finished = ~kind.loop[active] & (time * kind.fps[active] + _EPSILON
+                >= kind.frames[active] - 1)
+        state[finished] = kind.next(state[finished], Controls.END)
+        grounded = kind.jump[active] & contact
+        state[grounded] = kind.next(state[grounded], Controls.GROUND)
+        p[:, 0] += kind.speed[active]
+        changed = np.flatnonzero(state != active)
+        if len(changed):
+            active[changed] = state[changed]
+            time[changed] = 0.
+            jumping = changed[contact[changed]]
+            v[jumping, 1] -= kind.force[active[jumping]]
+
+def animation_system(registry, dt=TICK):
+    for kind, archetype in _actors(registry):
+        active, time = archetype.view('active'), archetype.view('time')
+        time += dt
+        duration = kind.duration[active]
+        wrap = kind.loop[active] & (time >= duration)
+        time[wrap] %= duration[wrap]
+
+def update(registry, world=_world, dt=TICK):
+    physics_system(registry, world)
+    state_system(registry)
+    animation_system(registry, dt)
+
+def frames(kind, archetype):
+    """Frame index of the current clip of every actor of `archetype`."""
+    active, time = archetype.view('active'), archetype.view('time')
+    frame = (time * kind.fps[active] + _EPSILON).astype(np.intp)
+    count = kind.frames[active]
+    return np.where(kind.loop[active], frame % count,
+            np.minimum(frame, count - 1))
+
+def render_system(registry, graphics):
+    """Draw the actors overlapping the view of `graphics`, at their
+    interpolated position. Return the number drawn."""
+    vx, vy, vw, vh = graphics.view
+    alpha = graphics.alpha
+    factory = AnimationFactory()
+    drawn = 0
+    for kind, archetype in _actors(registry):
+        p, previous = archetype.view('position'), archetype.view('previous')
+        at = previous + (p - previous) * alpha
+        w, h = kind.size
+        seen = np.flatnonzero((at[:, 0] < vx + vw) & (vx < at[:, 0] + w)
+                & (at[:, 1] < vy + vh) & (vy < at[:, 1] + h))
+        active = archetype.view('active')[seen].tolist()
+        indices = frames(kind, archetype)[seen].tolist()
+        clips = dict((state, factory.get_clip(kind.keys[state]))
+                for state in set(active))
+        for (x, y), state, index in zip(at[seen].tolist(), active, indices):
+            graphics.push_state()
+            graphics.translate(x, y)
+            graphics.draw(clips[state].frames[index])
+            graphics.pop_state()
+        drawn += len(seen)
+        graphics.drawn += len(seen)
+        graphics.culled += archetype.count - len(seen)
+    return drawn
@@ -1,65 +1,560 @@
+import json
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
 import app
-from config import Animations as config
+from atlas import Atlas, sources as atlas_sources
+from bundle import Bundle
+from config import Animations as config, Atlas as atlas_config, \
+        Bundle as bundle_config
 
-class Animation(app.Drawable):
-    def __init__(self, frames, loop=True):
+def read_fps(key):
+    """Frame rate of the clip `key`, from its sidecar manifest
+    `<clip>.json` if any."""
+    manifest = os.path.join(config['dir'], key + '.json')
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            return float(json.load(f).get('fps', config['fps']))
+    return float(config['fps'])
+
+def mirror_of(key):
+    """Key of the clip which would mirror the clip `key`, '_left' and
+    '_right' swapped, if any."""
+    for side, other in (('_left', '_right'), ('_right', '_left')):
+        if key.endswith(side):
+            return key[:-len(side)] + other
+    return None
+
+class Clip(object):
+    """Immutable sequence of frames played at `fps`, shared by every
+    player."""
+    __slots__ = ('frames', 'fps')
+
+    def __init__(self, frames, fps=config['fps']):
         assert len(frames) > 0
-        self.frames = frames
-        self.loop = loop
-        self.index = 0
+        self.frames = tuple(frames)
+        self.fps = float(fps)
+
+    @property
+    def duration(self):
+        return len(self.frames) / self.fps
+
+    def __len__(self):
+        return len(self.frames)
 
     def __iter__(self):
         return iter(self.frames)
 
+    def __getitem__(self, index):
+        return self.frames[index]
+
+# tolerance on frame boundaries, for time accumulated in float steps
+_EPSILON = 1e-6
+
+class AnimationPlayer(app.Drawable):
+    """Playhead over a shared `Clip`, one per animated entity.
+
+    Playback is time based: `advance` only accumulates elapsed time, and
+    the current frame is computed when it's needed (to draw it, mostly), so
+    frames are skipped rather than slowed down and entities which aren't
+    drawn cost no frame evaluation.
+    """
+    __slots__ = ('clip', 'loop', 'speed', 'time')
+
+    def __init__(self, clip, loop=True, speed=1.):
+        self.clip = clip if isinstance(clip, Clip) else Clip(clip)
+        self.loop = loop
+        self.speed = speed
+        self.time = 0.
+
+    @property
+    def frames(self):
+        return self.clip.frames
+
+    def __iter__(self):
+        return iter(self.clip)
+
+    def play(self, clip, loop=True):
+        """Switch to `clip`, from its first frame."""
+        self.clip = clip
+        self.loop = loop
+        self.reset()
+
     def render(self, graphics):
-        graphics.draw(self.frames[self.index])
+        graphics.draw(self.clip.frames[self.index])
 
-    def advance(self):
-        nbFrames = len(self.frames)
-        if nbFrames > 0 and self.loop:
-            self.index = (self.index + 1) % nbFrames
-        elif self.index < nbFrames - 1:
-            self.index += 1
+    def advance(self, dt=None):
+        """Move `dt` seconds (times `speed`) forward, one frame of the clip
+        by default."""
+        clip = self.clip
+        self.time += (1. / clip.fps if dt is None else dt) * self.speed
+        if self.loop and self.time >= clip.duration:
+            self.time %= clip.duration
+
+    @property
+    def index(self):
+        clip = self.clip
+        frame = int(self.time * clip.fps + _EPSILON)
+        if self.loop:
+            return frame % len(clip.frames)
+        return min(frame, len(clip.frames) - 1)
 
     def current_image(self):
-        return self.frames[self.index]
+        return self.clip.frames[self.index]
 
     def reset(self):
-        self.index = 0
+        self.time = 0.
 
     @property
     def finished(self):
-        return self.loop == False and self.index == len(self.frames) - 1
+        return self.loop == False and \
+                self.time * self.clip.fps + _EPSILON >= len(self.clip.frames) - 1
+
+# animations used to own their frames
+Animation = AnimationPlayer
+
+def texture_bytes(texture):
+    """Memory used by `texture`, 4 bytes a pixel."""
+    w, h = texture.size
+    return int(w) * int(h) * 4
+
+def _textures(clip):
+    """Distinct textures of the frames of `clip`, by id."""
+    return dict((id(frame.texture), frame.texture) for frame in clip.frames)
 
 class _AnimationFactory(object):
-    animations = {}
+    """Loads clips, and hands out players over them.
 
-    def all(self):
-        for key in os.listdir(config['dir']):
-            directory = os.path.join(config['dir'], key)
-            self.animations[key] = self.raw_get(key)
+    Loaded clips are kept in least recently used order, and the textures
+    they use are accounted for (once, when clips share them). When these
+    exceed `budget` bytes, the least recently used clips are evicted,
+    except the pinned ones (see `pin`), and loaded again on their next use.
+    """
+    clips = OrderedDict()
+    pending = {}
+    bundle = None
+    budget = config['budget']
+    # bytes of every clip, and clips using every texture (by id)
+    sizes = {}
+    users = {}
+    resident = 0
+    pins = {}
+    hits = misses = evictions = 0
 
-    def get(self, key, *args, **kwargs):
-        if key in self.animations:
-            return self.animations[key]
-        else:
-            return self.raw_get(key, *args, **kwargs)
+    def _open_bundle(self):
+        """The precompiled bundle, if it has been built."""
+        if self.bundle is None and os.path.exists(bundle_config['file']):
+            _AnimationFactory.bundle = Bundle(bundle_config['file'])
+        return self.bundle
 
-    def raw_get(self, key, *args, **kwargs):
+    def _files(self, key):
         directory = os.path.join(config['dir'], key)
         images = os.listdir(directory)
         images.sort()
-        frames = []
-        for image in images:
-            try:
-                image = app.Image(os.path.join(directory, image))
-                frames.append(image)
-            except IOError:
-                pass
-        anim = Animation(frames, *args, **kwargs)
-        self.animations[key] = anim
-        return anim
+        return [os.path.join(directory, image) for image in images]
+
+    def all(self):
+        bundle = self._open_bundle()
+        if bundle is not None:
+            for key in sorted(bundle.clips):
+                self.get_clip(key)
+            return
+        keys = sorted(key for key in os.listdir(config['dir'])
+                if os.path.isdir(os.path.join(config['dir'], key)))
+        if not config['atlas']:
+            for key in keys:
+                self.get_clip(key)
+            return
+        # a single atlas for every animation
+        files = dict((key, [f for f in self._files(key) if f.endswith('.png')])
+                for key in keys)
+        atlas = Atlas([f for key in keys for f in files[key]],
+                dedup=atlas_config['dedup'])
+        start = 0
+        for key in keys:
+            end = start + len(files[key])
+            self.add(key, Clip(atlas.frames[start:end], read_fps(key)))
+            start = end
+
+    def get(self, key, loop=True, speed=1.):
+        """New player over the clip `key`."""
+        return AnimationPlayer(self.get_clip(key), loop, speed)
+
+    def get_clip(self, key):
+        clip = self.clips.pop(key, None)
+        if clip is not None:
+            _AnimationFactory.hits += 1
+            self.clips[key] = clip
+            return clip
+        _AnimationFactory.misses += 1
+        if key in self.pending:
+            return self.pending[key].result(key)
+        else:
+            return self.raw_get(key)
+
+    def add(self, key, clip):
+        """Cache the loaded `clip` as `key`, evicting clips if the budget
+        is exceeded."""
+        if key in self.clips:
+            # loaded again (with its mirror), replaced rather than evicted
+            self._release(key)
+        size = 0
+        for texture_id, texture in _textures(clip).items():
+            users = self.users.setdefault(texture_id, set())
+            if not users:
+                size += texture_bytes(texture)
+            users.add(key)
+        self.clips[key] = clip
+        self.sizes[key] = size
+        _AnimationFactory.resident += size
+        self.trim(keep=key)
+        return clip
+
+    def fits(self, clip):
+        """Whether adding `clip` keeps within the budget, counting the
+        textures it doesn't share with loaded clips."""
+        if not self.budget:
+            return True
+        size = sum(texture_bytes(texture) for texture_id, texture
+                in _textures(clip).items() if not self.users.get(texture_id))
+        return self.resident + size <= self.budget
+
+    def evict(self, key):
+        """Forget the clip `key`, freeing the textures only it used."""
+        freed = self._release(key)
+        _AnimationFactory.evictions += 1
+        return freed
+
+    def _release(self, key):
+        clip = self.clips.pop(key)
+        del self.sizes[key]
+        freed = 0
+        for texture_id, texture in _textures(clip).items():
+            users = self.users[texture_id]
+            users.discard(key)
+            if not users:
+                del self.users[texture_id]
+                freed += texture_bytes(texture)
+        _AnimationFactory.resident -= freed
+        return freed
+
+    def sharing(self, key):
+        """Keys of the loaded clips using textures of the clip `key`, which
+        are only freed together, `key` included."""
+        keys = set()
+        for texture_id in _textures(self.clips[key]):
+            keys.update(self.users[texture_id])
+        return keys
+
+    def trim(self, keep=None):
+        """Evict the least recently used clips, with the clips sharing their
+        textures, until the budget is met. Clips sharing textures with a
+        pinned clip (or `keep`) stay."""
+        if not self.budget:
+            return
+        for key in list(self.clips):
+            if self.resident <= self.budget:
+                break
+            if key not in self.clips:
+                continue
+            sharing = self.sharing(key)
+            if keep in sharing or any(self.pins.get(k) for k in sharing):
+                continue
+            for k in sharing:
+                self.evict(k)
+
+    def clear(self):
+        """Forget every clip, pinned or not, the pins and the
+        statistics."""
+        self.clips.clear()
+        self.sizes.clear()
+        self.users.clear()
+        self.pins.clear()
+        _AnimationFactory.resident = 0
+        _AnimationFactory.hits = _AnimationFactory.misses = 0
+        _AnimationFactory.evictions = 0
+
+    def pin(self, key):
+        """Keep the clip `key` loaded until it's unpinned, pins being
+        counted."""
+        self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        count = self.pins.get(key, 0) - 1
+        if count > 0:
+            self.pins[key] = count
+        else:
+            self.pins.pop(key, None)
+            self.trim()
+
+    def stats(self):
+        return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'resident': self.resident,
+                'budget': self.budget,
+                'clips': len(self.clips),
+                'pinned': len(self.pins),
+                }
+
+    def fps(self, key):
+        bundle = self._open_bundle()
+        if bundle is not None and key in bundle:
+            return bundle.fps[key]
+        return read_fps(key)
+
+    def exists(self, key):
+        bundle = self._open_bundle()
+        if bundle is not None and key in bundle:
+            return True
+        return os.path.isdir(os.path.join(config['dir'], key))
+
+    def group(self, key):
+        """`key`, then the key of the clip mirroring it if there is one:
+        clips loaded together, sharing their textures."""
+        mirror = mirror_of(key)
+        if mirror is not None and self.exists(mirror):
+            return [key, mirror]
+        return [key]
+
+    def decode(self, key):
+        """Decode the images of the clip `key`, return (image, rect) pairs.
+
+        Nothing is uploaded to the GPU, so this may run in a worker thread.
+        """
+        return self.decode_group([key])[0]
+
+    def decode_group(self, keys):
+        """`decode` the clips `keys`, images being shared between them: one
+        per distinct image (or atlas page), with `config.Atlas['dedup']`."""
+        bundle = self._open_bundle()
+        if bundle is not None and all(key in bundle for key in keys):
+            return bundle.decode_clips(keys)
+        # files in the order of the keys, whatever the key asked for, so
+        # that atlases and sources are cached once per group
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        files = [[f for f in self._files(keys[i]) if f.endswith('.png')]
+                for i in order]
+        everything = [f for group in files for f in group]
+        dedup = atlas_config['dedup']
+        if config['atlas']:
+            atlas = Atlas(everything, dedup=dedup)
+            decoded = [(atlas.images[page], rect)
+                    for page, rect in atlas.layout]
+        else:
+            backend = app.backend()
+            if dedup:
+                origins = atlas_sources(everything)
+            else:
+                origins = [(i, False) for i in range(len(everything))]
+            images = {}
+            decoded = []
+            for i, mirrored in origins:
+                if i not in images:
+                    images[i] = backend.decode_image(everything[i])
+                rect = None
+                if mirrored:
+                    w, h = backend.image_size(everything[i])
+                    rect = (w, 0, -w, h)
+                decoded.append((images[i], rect))
+        clips = {}
+        for i, group in zip(order, files):
+            clips[i], decoded = decoded[:len(group)], decoded[len(group):]
+        return [clips[i] for i in range(len(keys))]
+
+    def raw_get(self, key):
+        """Load the clip `key` (and its mirror if not loaded and it fits in
+        the budget), ignoring the cache."""
+        keys = [k for k in self.group(key)
+                if k == key or (k not in self.clips and k not in self.pending)]
+        uploader = _Uploader(self.decode_group(keys))
+        uploader.upload()
+        return self.add_group(keys, uploader.clips(keys, self.fps))[0]
+
+    def add_group(self, keys, clips, wanted=()):
+        """Cache the `clips` of the group `keys`: the first one, then the
+        others (mirrors) if they are `wanted` or fit in the budget, the
+        first staying the most recently used. Return `clips`."""
+        key = keys[0]
+        self.add(key, clips[0])
+        for k, clip in zip(keys[1:], clips[1:]):
+            if k in wanted or self.fits(clip):
+                self.add(k, clip)
+                self.clips[key] = self.clips.pop(key)
+        return clips
+
+    def load_async(self, keys, workers=None):
+        """Start loading the clips `keys` in the background, see
+        `AnimationLoader`."""
+        return AnimationLoader(self, keys, workers)
+
+class _Uploader(object):
+    """Turns the decoded (image, rect) pairs of a group of clips into
+    frames, one texture per distinct image, possibly a few textures at a
+    time."""
+    def __init__(self, decoded):
+        self.groups = decoded
+        self.decoded = [pair for pairs in decoded for pair in pairs]
+        self.frames = []
+        self.textures = {}
+
+    def clips(self, keys, fps):
+        """Clips of the uploaded frames, one for each key of the group,
+        `fps(key)` being their frame rate."""
+        clips = []
+        start = 0
+        for key, pairs in zip(keys, self.groups):
+            end = start + len(pairs)
+            clips.append(Clip(self.frames[start:end], fps(key)))
+            start = end
+        return clips
+
+    @property
+    def done(self):
+        return len(self.frames) == len(self.decoded)
+
+    def upload(self, budget=None):
+        """Upload at most `budget` textures, return how many were."""
+        backend = app.backend()
+        uploaded = 0
+        while not self.done:
+            image, rect = self.decoded[len(self.frames)]
+            texture = self.textures.get(id(image))
+            if texture is None:
+                if budget is not None and uploaded == budget:
+                    break
+                texture = app.Texture(impl=backend.texture_from_image(image))
+                self.textures[id(image)] = texture
+                uploaded += 1
+            self.frames.append(app.Image(texture, rect))
+        return uploaded
+
+class LoadHandle(object):
+    """Clip loaded in the background, with its mirror if any (see
+    `_AnimationFactory.group`): decoded by a worker, then uploaded on the
+    main thread when the loader is pumped, textures being shared."""
+    def __init__(self, factory, keys, future, wanted=()):
+        self.factory = factory
+        self.key = keys[0]
+        self.keys = keys
+        self.wanted = set(wanted)
+        self.future = future
+        self.uploader = None
+        self.clips = None
+
+    @property
+    def clip(self):
+        return self.clips[0] if self.clips is not None else None
+
+    @property
+    def done(self):
+        return self.clips is not None
+
+    @property
+    def progress(self):
+        """Progress in [0, 1], decoding counts for one half."""
+        if self.clips is not None:
+            return 1.
+        elif self.uploader is None:
+            return .5 if self.future.done() else 0.
+        decoded = len(self.uploader.decoded)
+        return .5 + .5 * len(self.uploader.frames) / max(decoded, 1)
+
+    def pump(self, budget=None):
+        """Upload what's ready, at most `budget` textures."""
+        if self.clips is not None or not self.future.done():
+            return 0
+        if self.uploader is None:
+            self.uploader = _Uploader(self.future.result())
+        uploaded = self.uploader.upload(budget)
+        if self.uploader.done:
+            self.clips = self.factory.add_group(self.keys,
+                    self.uploader.clips(self.keys, self.factory.fps),
+                    self.wanted)
+            for key in self.keys:
+                self.factory.pending.pop(key, None)
+        return uploaded
+
+    def result(self, key=None):
+        """The clip `key` (the first one by default), waiting for it to be
+        decoded if needed."""
+        self.future.result()
+        self.pump()
+        return self.clips[self.keys.index(key) if key is not None else 0]
+
+class AnimationLoader(object):
+    """Loads clips with a pool of worker threads decoding images, textures
+    being uploaded on the main thread by `pump`, which should be called
+    once per frame (see `App.add_frame_hook`)."""
+    def __init__(self, factory, keys, workers=None, budget=8):
+        self.budget = budget
+        self._executor = ThreadPoolExecutor(workers or cpu_count())
+        self.handles = []
+        keys = list(keys)
+        for key in keys:
+            if key in factory.clips or key in factory.pending:
+                continue
+            # a clip and its mirror in one job
+            group = [k for k in factory.group(key) if k == key
+                    or (k not in factory.clips and k not in factory.pending)]
+            handle = LoadHandle(factory, group,
+                    self._executor.submit(factory.decode_group, group),
+                    [k for k in group if k in keys])
+            for k in group:
+                factory.pending[k] = handle
+            self.handles.append(handle)
+
+    def __getitem__(self, key):
+        for handle in self.handles:
+            if key in handle.keys:
+                return handle
+        raise KeyError(key)
+
+    @property
+    def progress(self):
+        if not self.handles:
+            return 1.
+        return sum(h.progress for h in self.handles) / len(self.handles)
+
+    @property
+    def done(self):
+        return all(h.done for h in self.handles)
+
+    def pump(self):
+        budget = self.budget
+        for handle in self.handles:
+            budget -= handle.pump(budget)
+            if budget <= 0:
+                break
+        if self.done:
+            self._executor.shutdown(wait=False)
+
+class LoadingState(app.BaseState):
+    """State of a `StatesApp` pumping a loader and drawing its progress,
+    until it switches to `next_state` once everything is loaded."""
+    def __init__(self, loader, next_state, size=(400, 20)):
+        super(LoadingState, self).__init__()
+        self.loader = loader
+        self.following = next_state
+        self.size = size
+
+    def update(self):
+        self.loader.pump()
+        if self.loader.done:
+            self.switch_state(self.following)
+
+    def render_to(self, window, alpha=1.):
+        w, h = self.size
+        x, y = (window.width - w) / 2, (window.height - h) / 2
+        progress = max(self.loader.progress * w, 1)
+        graphics = window.graphics
+        graphics.push_state()
+        graphics.translate(x, y)
+        graphics.draw(app.Rectangle((w, h), 'black'))
+        graphics.draw(app.Rectangle((progress, h), 'white'))
+        graphics.pop_state()
 
 _global_animation_factory = None
 def AnimationFactory():
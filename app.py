@@ -1,80 +1,68 @@
-from functools import wraps
-import sfml as _sf
-
-# Mapping to readable key
-_key_mapping = {
-        _sf.Keyboard.A        : 'a',
-        _sf.Keyboard.B        : 'b',
-        _sf.Keyboard.C        : 'c',
-        _sf.Keyboard.D        : 'd',
-        _sf.Keyboard.E        : 'e',
-        _sf.Keyboard.F        : 'f',
-        _sf.Keyboard.G        : 'g',
-        _sf.Keyboard.H        : 'h',
-        _sf.Keyboard.I        : 'i',
-        _sf.Keyboard.J        : 'j',
-        _sf.Keyboard.K        : 'k',
-        _sf.Keyboard.L        : 'l',
-        _sf.Keyboard.M        : 'm',
-        _sf.Keyboard.N        : 'n',
-        _sf.Keyboard.O        : 'o',
-        _sf.Keyboard.P        : 'p',
-        _sf.Keyboard.Q        : 'q',
-        _sf.Keyboard.R        : 'r',
-        _sf.Keyboard.S        : 's',
-        _sf.Keyboard.T        : 't',
-        _sf.Keyboard.U        : 'u',
-        _sf.Keyboard.V        : 'v',
-        _sf.Keyboard.W        : 'w',
-        _sf.Keyboard.X        : 'x',
-        _sf.Keyboard.Y        : 'y',
-        _sf.Keyboard.Z        : 'z',
-        _sf.Keyboard.UP       : 'up',
-        _sf.Keyboard.DOWN     : 'down',
-        _sf.Keyboard.LEFT     : 'left',
-        _sf.Keyboard.RIGHT    : 'right',
-        _sf.Keyboard.SPACE    : 'space',
-        _sf.Keyboard.RETURN   : 'enter',
-        _sf.Keyboard.ESCAPE   : 'escape',
-        _sf.Keyboard.L_ALT     : 'alt',
-        _sf.Keyboard.R_ALT     : 'alt',
-        _sf.Keyboard.L_CONTROL : 'ctrl',
-        _sf.Keyboard.R_CONTROL : 'ctrl',
-        _sf.Keyboard.L_SHIFT   : 'shift',
-        _sf.Keyboard.R_SHIFT   : 'shift',
-        }
-# inverse mapping to a list of *real* keys
-_inverse_key_mapping = {}
-for key, value in _key_mapping.iteritems():
-    _inverse_key_mapping.setdefault(value, []).append(key)
+import os
+import time
 
-def _real_keys(key):
-    assert key in _inverse_key_mapping
-    return iter(_inverse_key_mapping[key])
+_backends = {
+        'sfml': 'sfml_backend',
+        'null': 'null_backend',
+        }
+_backend = None
+_key_mapping = {}
+# bit of every readable key in input snapshots, and the other way around
+_key_bits = {}
+_bit_keys = {}
+# bit of every *real* key
+_code_bits = {}
+
+def _key_bit(key):
+    bit = _key_bits.get(key)
+    if bit is None:
+        bit = _key_bits[key] = 1 << len(_key_bits)
+        _bit_keys[bit] = key
+    return bit
+
+def use_backend(name):
+    """Select the backend, either 'sfml' (default) or 'null' (headless)."""
+    global _backend, _key_mapping
+    if name not in _backends:
+        raise ValueError("Invalid backend '%s'" % name)
+    _backend = __import__(_backends[name])
+    _key_mapping = _backend.key_mapping
+    _code_bits.clear()
+    for code, key in _key_mapping.items():
+        _code_bits[code] = _key_bit(key)
+    return _backend
+
+def backend():
+    if _backend is None:
+        use_backend(os.environ.get('EUSDAB_BACKEND', 'sfml'))
+    return _backend
+
+# high resolution clock, when available
+_clock = getattr(time, 'perf_counter', time.time)
 
 _color_mapping = {
-        'red'         :  _sf.Color.RED,
-        'blue'        :  _sf.Color.BLUE,
-        'cyan'        :  _sf.Color.CYAN,
-        'black'       :  _sf.Color.BLACK,
-        'white'       :  _sf.Color.WHITE,
-        'green'       :  _sf.Color.GREEN,
-        'yellow'      :  _sf.Color.YELLOW,
-        'magenta'     :  _sf.Color.MAGENTA,
-        'transparent' :  _sf.Color.TRANSPARENT,
+        'red'         :  (255, 0, 0),
+        'blue'        :  (0, 0, 255),
+        'cyan'        :  (0, 255, 255),
+        'black'       :  (0, 0, 0),
+        'white'       :  (255, 255, 255),
+        'green'       :  (0, 255, 0),
+        'yellow'      :  (255, 255, 0),
+        'magenta'     :  (255, 0, 255),
+        'transparent' :  (0, 0, 0, 0),
         }
 
 def _to_actual_color(color):
     if isinstance(color, str):
         if color not in _color_mapping:
             raise ValueError("Invalid color")
-        return _color_mapping[color]
+        color = _color_mapping[color]
     elif isinstance(color, int):
         b = (color >> (8 * 0)) & 0xff
         g = (color >> (8 * 1)) & 0xff
         r = (color >> (8 * 2)) & 0xff
         color = r, g, b
-    return _sf.Color(*color)
+    return backend().color(*color)
 
 class Listener(object):
     def update(self):
@@ -86,29 +74,124 @@ class Listener(object):
     def key_released(self, key):
         pass
 
+def _keys_of(mask):
+    while mask:
+        bit = mask & -mask
+        yield _bit_keys[bit]
+        mask ^= bit
+
+class Input(object):
+    """State of the keyboard, and of a joystick, taken once per frame.
+
+    A snapshot is a bitset of the readable keys held down, keys pressed
+    and released within the frame (as told by window events) counting as
+    held for that frame. Edges are the differences with the previous
+    snapshot, plus the keys released then pressed again within the frame.
+    Joystick buttons are read as the keys of `buttons` (or as 'joy<n>'),
+    and its stick as the arrow keys. Devices are only read while a window
+    has the focus, otherwise only events count.
+    """
+    def __init__(self):
+        self.state = 0
+        self.previous = 0
+        # held in both snapshots, but released and pressed in between
+        self.repressed = 0
+        self.joystick = None
+        self.buttons = {}
+        self.dead_zone = 50
+
+    def use_joystick(self, joystick=0, buttons=None, dead_zone=50):
+        self.joystick = joystick
+        self.buttons = dict(buttons or {})
+        self.dead_zone = dead_zone
+
+    def _read_joystick(self):
+        read = backend().read_joystick(self.joystick)
+        if read is None:
+            return 0
+        buttons, (x, y) = read
+        mask = 0
+        for button in buttons:
+            mask |= _key_bit(self.buttons.get(button, 'joy%d' % button))
+        dead_zone = self.dead_zone
+        if x < -dead_zone:
+            mask |= _key_bit('left')
+        elif x > dead_zone:
+            mask |= _key_bit('right')
+        if y < -dead_zone:
+            mask |= _key_bit('up')
+        elif y > dead_zone:
+            mask |= _key_bit('down')
+        return mask
+
+    def snapshot(self, taps=0, releases=0, focused=True):
+        """Take the state of the frame, `taps` and `releases` being the bits
+        of the keys pressed and released by events. Devices are read only
+        when `focused`."""
+        state = taps
+        if focused:
+            for code in backend().pressed_keys():
+                state |= _code_bits.get(code, 0)
+            if self.joystick is not None:
+                state |= self._read_joystick()
+        self.repressed = self.state & state & taps & releases
+        self.previous, self.state = self.state, state
+
+    @property
+    def pressed(self):
+        """Keys pressed since the previous snapshot."""
+        return _keys_of(self.state & ~self.previous | self.repressed)
+
+    @property
+    def released(self):
+        """Keys released since the previous snapshot."""
+        return _keys_of(self.previous & ~self.state | self.repressed)
+
+    def is_pressed(self, key):
+        return bool(self.state & _key_bits.get(key, 0))
+
+    def was_pressed(self, key):
+        bit = _key_bits.get(key, 0)
+        return bool(self.state & ~self.previous & bit
+                or self.repressed & bit)
+
+    def was_released(self, key):
+        bit = _key_bits.get(key, 0)
+        return bool(self.previous & ~self.state & bit
+                or self.repressed & bit)
+
 class Window(object):
     def __init__(self, size=(800, 600), title=__name__, fps=40, icon=None,
             closable=True, resizable=False, mouse=True, vsync=True,
-            fullscreen=False, enable_key_repeat=False):
-        style = 0
-        if closable: style |= _sf.Style.CLOSE
-        if resizable: style |= _sf.Style.RESIZE
-        if fullscreen: style |= _sf.Style.FULLSCREEN
-        self._impl = _sf.RenderWindow(_sf.VideoMode(*size), title, style)
-        self._impl.key_repeat_enabled = enable_key_repeat
-        self._impl.framerate_limit = fps
-        self._impl.vertical_synchronization = vsync
-        self._impl.mouse_cursor_visible = mouse
-        if icon is not None:
-            icon_image = _sf.Image.from_file(icon)
-            self._impl.icon = icon_image.pixels
+            fullscreen=False, enable_key_repeat=False, batch=True):
+        self._impl = backend().Window(size, title, fps, icon, closable,
+                resizable, mouse, vsync, fullscreen, enable_key_repeat)
+        self.size = size
+        self.fps = fps
+        self.vsync = vsync
+        self.batch = batch
+        # as told by focus events
+        self.focused = True
         self.graphics = Graphics(self)
 
+    @property
+    def limited(self):
+        """Whether displaying waits for the frame limiter or vsync."""
+        return bool(self.fps or self.vsync)
+
+    def set_realtime(self, realtime):
+        """Restore (or lift) the frame limiter and vertical sync."""
+        self._impl.set_framerate_limit(self.fps if realtime else 0)
+        self._impl.set_vsync(self.vsync if realtime else False)
+
+    def events(self):
+        return self._impl.events()
+
     def mouse_position(self):
-        return _sf.Mouse.get_position(self._impl)
+        return self._impl.mouse_position()
 
     def set_active(self, active):
-        self._impl.active = active
+        self._impl.set_active(active)
 
     def display(self):
         self._impl.display()
@@ -120,156 +203,554 @@ class Window(object):
         self._impl.close()
 
     def is_opened(self):
-        return self._impl.is_open
+        return self._impl.is_opened()
 
     def draw(self, drawable):
         drawable.render(self.graphics)
 
     @property
     def width(self):
-        return self._impl.width
+        return self._impl.get_width()
 
     @width.setter
     def set_width(self, w):
-        self._impl.width = w
+        self._impl.set_width(w)
 
     @property
     def height(self):
-        return self._impl.height
+        return self._impl.get_height()
 
     @height.setter
     def set_height(self, h):
-        self._impl.height = h
+        self._impl.set_height(h)
 
 class App(Listener):
-    def __init__(self):
+    # run without any window (servers), until `stop`
+    headless = False
+
+    def __init__(self, tick_rate=40, max_catchup=5):
         super(App, self).__init__()
         self.windows = []
-        self.key_events = []
+        # {(key, on_press): callbacks}, key None matching every key
+        self.key_bindings = {}
+        self.input = Input()
+        self.tick_rate = tick_rate
+        self.max_catchup = max_catchup
+        self.ticks = 0
+        self.frame_hooks = []
+        # drawn over every window, after render_to
+        self.overlays = []
+        # see profiler.Profiler.attach
+        self.profiler = None
+        self._stopped = False
+
+    @property
+    def tick_duration(self):
+        return 1. / self.tick_rate
 
     def bind_key_event(self, f, bind_key=None, on_press=True):
+        """Call `f` when `bind_key` (a key, a sequence of keys or None for
+        any key) is pressed, or released. Callbacks of a key are called
+        before the ones of any key."""
         if not callable(f):
             raise TypeError("Bind object '%s' should be callable" % f)
-        self.key_events.append((bool(on_press), bind_key, f))
+        if bind_key is None or isinstance(bind_key, str):
+            keys = (bind_key,)
+        elif isinstance(bind_key, (tuple, list)):
+            keys = bind_key
+        else:
+            raise TypeError("Invalid bind '%s'" % bind_key)
+        for key in keys:
+            self.key_bindings.setdefault((key, bool(on_press)), []).append(f)
 
     def key_event(self, bind_key=None, on_press=True):
-        @wraps(f)
-        def closure(f):
+        def decorator(f):
             self.bind_key_event(f, bind_key=bind_key, on_press=on_press)
             return f
-        return closure
+        return decorator
+
+    def add_frame_hook(self, f):
+        """Call `f` once per frame on the main thread, before updates."""
+        if not callable(f):
+            raise TypeError("Hook object '%s' should be callable" % f)
+        self.frame_hooks.append(f)
 
     def is_pressed(self, key):
-        if key in _inverse_key_mapping:
-            kb = _sf.Keyboard
-            return any(kb.is_key_pressed(k) for k in _real_keys(key))
-        return False
+        return self.input.is_pressed(key)
 
     def is_released(self, key):
-        if key in _inverse_key_mapping:
-            kb = _sf.Keyboard
-            return any(not kb.is_key_pressed(k) for k in _real_keys(key))
-        return False
+        return not self.input.is_pressed(key)
 
     def _key_events_bound_to(self, key, on_press):
-        def decide_if_callback(key, bind):
-            if bind is None:
-                return True
-            elif isinstance(bind, (tuple, list)):
-                return key in bind
-            elif isinstance(bind, str):
-                return key == bind
-            else:
-                raise TypeError("Invalid bind '%s'" % bind)
-        for p, bind, callback in self.key_events:
-            if p == on_press:
-                if decide_if_callback(key, bind):
-                    callback()
-
-    def run(self):
-        while self.windows:
-            closed = []
-            for window in self.windows:
-                for event in window._impl.events:
-                    if type(event) is _sf.CloseEvent:
-                        window.close()
-                    elif type(event) is _sf.KeyEvent:
-                        if event.code not in _key_mapping:
-                            continue
-                        key = event.code
-                        if event.pressed:
-                            action = _key_mapping[key]
-                            self._key_events_bound_to(action, True)
-                            self.key_pressed(action)
-                        else:
-                            action = _key_mapping[key]
-                            self._key_events_bound_to(action, False)
-                            self.key_released(action)
-                self.update()
-                window.clear()
-                self.render_to(window)
-                window.display()
-                if not window.is_opened():
-                    closed.append(window)
-            for window in closed:
-                self.windows.remove(window)
+        bindings = self.key_bindings
+        for callback in bindings.get((key, on_press), ()):
+            callback()
+        for callback in bindings.get((None, on_press), ()):
+            callback()
+
+    def _poll_events(self, window):
+        """Handle the events of `window`, return the bits of the keys it
+        pressed and released."""
+        taps = releases = 0
+        for kind, code in window.events():
+            if kind == 'closed':
+                window.close()
+            elif kind == 'key_pressed':
+                taps |= _code_bits.get(code, 0)
+            elif kind == 'key_released':
+                releases |= _code_bits.get(code, 0)
+            elif kind == 'focus_gained':
+                window.focused = True
+            elif kind == 'focus_lost':
+                window.focused = False
+        return taps, releases
+
+    def _dispatch_keys(self):
+        """Call the key callbacks of the edges of the input snapshot,
+        releases first (of keys pressed again)."""
+        for key in self.input.released:
+            self._key_events_bound_to(key, False)
+            self.key_released(key)
+        for key in self.input.pressed:
+            self._key_events_bound_to(key, True)
+            self.key_pressed(key)
+
+    def _tick(self):
+        self.update()
+        self.ticks += 1
+
+    def run(self, max_frames=None, realtime=True):
+        """Run the main loop until every window is closed.
+
+        The simulation is updated at a fixed `tick_rate`, independently of
+        the number of windows and of the rendering rate: elapsed time is
+        accumulated and consumed in ticks, at most `max_catchup` of them per
+        frame (the remaining lag is dropped). What is left of the lag is
+        passed to `render_to` as the interpolation factor `alpha` between
+        the last two ticks.
+
+        With `max_frames` the loop stops after that many frames, and with
+        `realtime` off the frame limiter and vsync are lifted and every
+        frame runs exactly one tick, as fast as possible. Return the number
+        of frames run.
+
+        With an enabled `profiler`, the phases of every frame are timed.
+
+        A `headless` app runs without windows until `stop` is called. In
+        realtime, the loop sleeps between ticks when no window waits for a
+        frame limiter or vsync.
+        """
+        for window in self.windows:
+            window.set_realtime(realtime)
+        try:
+            dt = self.tick_duration
+            lag = 0.
+            previous = _clock()
+            frames = 0
+            self._stopped = False
+            while (self.windows or self.headless) and not self._stopped \
+                    and (max_frames is None or frames < max_frames):
+                profiler = self.profiler
+                if profiler is not None and not profiler.enabled:
+                    profiler = None
+                if profiler is not None:
+                    t = frame_start = _clock()
+                taps = releases = 0
+                focused = False
+                for window in self.windows:
+                    pressed, released = self._poll_events(window)
+                    taps |= pressed
+                    releases |= released
+                    focused = focused or window.focused
+                self.input.snapshot(taps, releases, focused)
+                if profiler is not None:
+                    t = profiler.lap('events', t)
+                self._dispatch_keys()
+                if profiler is not None:
+                    t = profiler.lap('keys', t)
+                for hook in self.frame_hooks:
+                    hook()
+                if profiler is not None:
+                    t = profiler.lap('hooks', t)
+                if realtime:
+                    now = _clock()
+                    lag += now - previous
+                    previous = now
+                    steps = 0
+                    while lag >= dt:
+                        if steps == self.max_catchup:
+                            lag %= dt
+                            break
+                        self._tick()
+                        lag -= dt
+                        steps += 1
+                    alpha = lag / dt
+                else:
+                    self._tick()
+                    alpha = 1.
+                if profiler is not None:
+                    t = profiler.lap('update', t)
+                closed = []
+                for window in self.windows:
+                    window.clear()
+                    graphics = window.graphics
+                    graphics.alpha = alpha
+                    graphics.begin_frame()
+                    if window.batch:
+                        graphics.begin_batch()
+                    self.render_to(window, alpha)
+                    for overlay in self.overlays:
+                        window.draw(overlay)
+                    if window.batch:
+                        graphics.end_batch()
+                    if profiler is not None:
+                        t = profiler.lap('render', t)
+                    window.display()
+                    if profiler is not None:
+                        t = profiler.lap('display', t)
+                    if not window.is_opened():
+                        closed.append(window)
+                for window in closed:
+                    self.windows.remove(window)
+                if realtime and not any(window.limited
+                        for window in self.windows):
+                    time.sleep(max(0., dt - (_clock() - previous) - lag))
+                if profiler is not None:
+                    profiler.record('frame', frame_start, t)
+                    profiler.end_frame()
+                frames += 1
+            return frames
+        finally:
+            if not realtime:
+                for window in self.windows:
+                    window.set_realtime(True)
+
+    def stop(self):
+        """Leave `run` at the end of the frame."""
+        self._stopped = True
 
     def create_window(self, dtype=Window, *args, **kwargs):
         win = dtype(*args, **kwargs)
         self.windows.append(win)
         return win
 
-    def render_to(self, window):
+    def render_to(self, window, alpha=1.):
         pass
 
+def _intersects(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] \
+            and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+class Camera(object):
+    """View on the world: `position` is the world point shown at the top
+    left corner of the window, and `zoom` the number of pixels per world
+    unit. With `bounds` (x, y, w, h), the view is kept inside them."""
+    def __init__(self, x=0., y=0., zoom=1., bounds=None):
+        self.x, self.y = x, y
+        self.zoom = zoom
+        self.bounds = bounds
+
+    def pan(self, dx, dy):
+        self.x += dx
+        self.y += dy
+
+    def center_on(self, x, y, size):
+        """Center the view of a window of `size` on (x, y)."""
+        w, h = size[0] / self.zoom, size[1] / self.zoom
+        self.x, self.y = x - w / 2., y - h / 2.
+
+    def view(self, size):
+        """World rectangle (x, y, w, h) seen through a window of `size`."""
+        w, h = size[0] / float(self.zoom), size[1] / float(self.zoom)
+        x, y = self.x, self.y
+        if self.bounds is not None:
+            bx, by, bw, bh = self.bounds
+            x = bx if w >= bw else min(max(x, bx), bx + bw - w)
+            y = by if h >= bh else min(max(y, by), by + bh - h)
+        return x, y, w, h
+
+class SpatialIndex(object):
+    """Uniform grid of items by their rectangle (x, y, w, h), to find the
+    items overlapping a rectangle without visiting the others.
+
+    Items are binned in every cell their rectangle overlaps, so
+    `cell_size` should be about the size of the items. Moving an item only
+    rebins it when it crosses cells.
+    """
+    def __init__(self, cell_size=256):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        # item: (order, rect, cell range)
+        self.items = {}
+        self._next = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def _range(self, rect):
+        x, y, w, h = rect
+        c = self.cell_size
+        return (int(x // c), int(y // c),
+                int((x + w) // c), int((y + h) // c))
+
+    def _cells(self, cells):
+        x0, y0, x1, y1 = cells
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                yield cx, cy
+
+    def insert(self, item, rect):
+        cells = self._range(rect)
+        self.items[item] = (self._next, rect, cells)
+        self._next += 1
+        for key in self._cells(cells):
+            self.cells.setdefault(key, set()).add(item)
+
+    def remove(self, item):
+        _, _, cells = self.items.pop(item)
+        for key in self._cells(cells):
+            bucket = self.cells[key]
+            bucket.discard(item)
+            if not bucket:
+                del self.cells[key]
+
+    def move(self, item, rect):
+        order, _, cells = self.items[item]
+        moved = self._range(rect)
+        if moved != cells:
+            self.remove(item)
+            self.items[item] = (order, rect, moved)
+            for key in self._cells(moved):
+                self.cells.setdefault(key, set()).add(item)
+        else:
+            self.items[item] = (order, rect, cells)
+
+    def query(self, rect):
+        """Items overlapping `rect`, in insertion order."""
+        found = set()
+        cells = self.cells
+        for key in self._cells(self._range(rect)):
+            bucket = cells.get(key)
+            if bucket:
+                found.update(bucket)
+        items = self.items
+        found = [item for item in found if _intersects(items[item][1], rect)]
+        found.sort(key=lambda item: items[item][0])
+        return found
+
 class Graphics(object):
+    """Draws on a window, with a stack of transforms and a camera.
+
+    Between `begin_batch` and `end_batch`, images are collected in a sprite
+    batch and drawn with one call per texture (images sharing a texture are
+    drawn together, in the order of the first one); the batch is flushed
+    before any other drawable to keep the drawing order.
+    """
     def __init__(self, window):
         self.window = window
-        self.graphic_states = []
-        self.push_state()
+        # (x, y, scale) transforms, the last one is current
+        self.graphic_states = [(0., 0., 1.)]
+        self.camera = None
+        # drawables drawn and culled, since the beginning of the frame
+        self.drawn = 0
+        self.culled = 0
+        # interpolation factor between the last two simulation ticks
+        self.alpha = 1.
+        self.batch = None
+        self._batching = False
 
     def _draw(self, drawable):
-        assert isinstance(drawable, _sf.Drawable)
-        self.window._impl.draw(drawable, self.graphic_states[-1])
+        if self._batching:
+            self.batch.flush(self.window._impl)
+        x, y, scale = self.graphic_states[-1]
+        self.window._impl.draw(drawable, x, y, scale)
+
+    def draw_image(self, image):
+        if self._batching:
+            x, y, scale = self.graphic_states[-1]
+            self.batch.add(image.texture._impl, image.rect, x, y, scale)
+        else:
+            self._draw(image._impl)
+
+    def begin_frame(self):
+        """Reset the transforms to the camera's, and the counters."""
+        if self.camera is None:
+            self.graphic_states = [(0., 0., 1.)]
+        else:
+            x, y, _, _ = self.view
+            zoom = self.camera.zoom
+            self.graphic_states = [(-x * zoom, -y * zoom, zoom)]
+        self.drawn = self.culled = 0
+
+    @property
+    def view(self):
+        """World rectangle (x, y, w, h) seen by the camera."""
+        if self.camera is None:
+            return (0., 0.) + tuple(self.window.size)
+        return self.camera.view(self.window.size)
+
+    def begin_batch(self):
+        if self.batch is None:
+            self.batch = backend().SpriteBatch()
+        self._batching = True
+
+    def end_batch(self):
+        self.batch.flush(self.window._impl)
+        self._batching = False
 
     def translate(self, x, y):
-        state = self.graphic_states[-1]
-        state.transform.translate(_sf.Vector2(x, y))
+        dx, dy, scale = self.graphic_states[-1]
+        self.graphic_states[-1] = (dx + x * scale, dy + y * scale, scale)
+
+    def scale(self, k):
+        dx, dy, scale = self.graphic_states[-1]
+        self.graphic_states[-1] = (dx, dy, scale * k)
 
     def push_state(self):
-        state = _sf.RenderStates()
-        if len(self.graphic_states) > 0:
-            old_state = self.graphic_states[-1]
-            state.transform.combine(old_state.transform)
-        self.graphic_states.append(state)
+        self.graphic_states.append(self.graphic_states[-1])
 
     def pop_state(self):
         self.graphic_states.pop()
         if len(self.graphic_states) == 0:
-            self.push_state()
+            self.graphic_states.append((0., 0., 1.))
 
     def draw(self, drawable):
         drawable.render(self)
 
 class Drawable(object):
+    __slots__ = ()
+
     def render(self, graphics):
         msg = "'render' method should be defined in custom Drawables"
         raise NotImplementedError(msg)
 
+class Texture(object):
+    def __init__(self, filename=None, impl=None):
+        self._impl = backend().load_texture(filename) if impl is None \
+                else impl
+
+    size = property(lambda x: tuple(backend().texture_size(x._impl)))
+
 class Image(Drawable):
-    def __init__(self, filename):
+    """Drawable image, either a file or a rectangle (x, y, w, h) of a
+    shared `Texture`, mirrored horizontally when `w` is negative (`x` being
+    its right edge then)."""
+    def __init__(self, source, rect=None):
+        super(Drawable, self).__init__()
+        self.texture = source if isinstance(source, Texture) \
+                else Texture(source)
+        if rect is None:
+            rect = (0, 0) + self.texture.size
+        self.rect = rect
+        self._impl = backend().create_sprite(self.texture._impl, rect)
+
+    def render(self, graphics):
+        graphics.draw_image(self)
+
+    size = property(lambda x: (abs(x.rect[2]), x.rect[3]))
+
+class Rectangle(Drawable):
+    def __init__(self, size, color='white'):
         super(Drawable, self).__init__()
-        tx = _sf.Texture.from_file(filename)
-        self._impl = _sf.Sprite(tx)
+        self.size = size
+        self._impl = backend().create_rectangle(size, _to_actual_color(color))
 
     def render(self, graphics):
         graphics._draw(self._impl)
 
-    size = property(lambda x: x._impl.size)
+class RenderTexture(object):
+    """Offscreen render target, drawn on like a window."""
+    def __init__(self, size):
+        self._impl = backend().RenderTexture(size)
+        self.size = size
+        self.texture = Texture(impl=self._impl.texture)
+        self.graphics = Graphics(self)
+
+    def clear(self):
+        self._impl.clear()
+
+    def display(self):
+        self._impl.display()
+
+class Layer(Drawable):
+    """Group of drawables, drawn in the order they were added.
+
+    A static layer is rendered once into an offscreen texture which is then
+    drawn every frame, until it is invalidated: either entirely, or only a
+    rectangle (x, y, w, h) of it, in which case only the drawables whose
+    bounds intersect one of the dirty rectangles are redrawn, clipped.
+    Drawables added without bounds are considered to cover the whole layer.
+    """
+    def __init__(self, size, static=False):
+        super(Layer, self).__init__()
+        self.size = size
+        self.static = static
+        self.drawables = []
+        self.dirty_rects = []
+        self.redraws = 0
+        self._dirty = True
+        self._target = None
+        self._image = None
+
+    def add(self, drawable, bounds=None):
+        self.drawables.append((drawable, bounds))
+        self.invalidate(bounds)
+
+    def remove(self, drawable):
+        for i, (d, bounds) in enumerate(self.drawables):
+            if d is drawable:
+                del self.drawables[i]
+                self.invalidate(bounds)
+                return
+        raise ValueError("Drawable not in layer")
+
+    def invalidate(self, rect=None):
+        """Mark `rect` (everything by default) to be redrawn."""
+        if rect is None:
+            self._dirty = True
+        else:
+            self.dirty_rects.append(tuple(rect))
+
+    def _redraw(self, rect=None):
+        graphics = self._target.graphics
+        graphics.begin_batch()
+        for drawable, bounds in self.drawables:
+            if rect is None or bounds is None or _intersects(bounds, rect):
+                graphics.draw(drawable)
+        graphics.end_batch()
+
+    def render(self, graphics):
+        if not self.static:
+            for drawable, _ in self.drawables:
+                graphics.draw(drawable)
+            return
+        if self._target is None:
+            self._target = RenderTexture(self.size)
+            self._image = Image(self._target.texture)
+        if self._dirty:
+            self._target.clear()
+            self._redraw()
+            self._target.display()
+            self.redraws += 1
+        elif self.dirty_rects:
+            target = self._target._impl
+            for rect in self.dirty_rects:
+                target.clip(rect)
+                target.clear_rect(rect)
+                self._redraw(rect)
+            target.unclip()
+            target.display()
+            self.redraws += 1
+        self._dirty = False
+        del self.dirty_rects[:]
+        graphics.draw(self._image)
 
 class StatesApp(App):
-    def __init__(self):
-        super(StatesApp, self).__init__()
+    def __init__(self, *args, **kwargs):
+        super(StatesApp, self).__init__(*args, **kwargs)
         self.states = {}
         self.current = None
         try:
@@ -307,8 +788,8 @@ class StatesApp(App):
         if not self.current.alive:
             self.switch_state(self.current.next_state)
 
-    def render_to(self, window):
-        self.current.render_to(window)
+    def render_to(self, window, alpha=1.):
+        self.current.render_to(window, alpha)
 
 class BaseState(Listener):
     def __init__(self):
@@ -322,3 +803,4 @@ class BaseState(Listener):
 
     def enter(self): pass
     def leave(self): pass
+    def render_to(self, window, alpha=1.): pass
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import app
+from config import Atlas as config
+
+def pack(sizes, max_size, padding=1):
+    """Pack rectangles of `sizes` in pages of at most `max_size` squared.
+
+    Rectangles are placed by decreasing height on shelves, first fit.
+    Return the (page, x, y) of every rectangle and the size of every page.
+    """
+    placements = [None] * len(sizes)
+    pages = [] # [shelves, top, width], a shelf being [y, height, x]
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1],
+        -sizes[i][0]))
+    for i in order:
+        w, h = sizes[i][0] + padding, sizes[i][1] + padding
+        if w > max_size or h > max_size:
+            raise ValueError("Image of size %s larger than atlas"
+                    % (sizes[i],))
+        for index, page in enumerate(pages):
+            spot = _place(page, w, h, max_size)
+            if spot is not None:
+                break
+        else:
+            index, page = len(pages), [[], 0, 0]
+            pages.append(page)
+            spot = _place(page, w, h, max_size)
+        placements[i] = (index,) + spot
+    return placements, [(width, top) for _, top, width in pages]
+
+def _place(page, w, h, max_size):
+    shelves = page[0]
+    for shelf in shelves:
+        y, height, x = shelf
+        if h <= height and x + w <= max_size:
+            shelf[2] += w
+            page[2] = max(page[2], x + w)
+            return x, y
+    if page[1] + h <= max_size:
+        y = page[1]
+        shelves.append([y, h, w])
+        page[1] += h
+        page[2] = max(page[2], w)
+        return 0, y
+    return None
+
+def _hash(filenames):
+    digest = hashlib.sha1()
+    for filename in filenames:
+        digest.update(os.path.basename(filename).encode('utf-8'))
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _makedirs(directory):
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # made concurrently by another process
+            if not os.path.isdir(directory):
+                raise
+
+def _write_json(filename, data):
+    # written aside then renamed, so that concurrent processes or threads
+    # never read a partial file
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+            prefix=os.path.basename(filename) + '.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(temporary, filename)
+
+def _pixels_digest(pixels):
+    digest = hashlib.sha1(('%dx%d' % pixels.shape[:2]).encode('ascii'))
+    digest.update(np.ascontiguousarray(pixels).data)
+    return digest.digest()
+
+def sources(filenames, cache_dir=config['cache']):
+    """(index, mirrored) of the image of every file of `filenames`: the
+    index of the first file with the same pixels, or with the pixels of
+    its horizontal mirror image. Files with the same bytes are the same
+    image, the others are decoded by the backend to hash their pixels.
+    Backends keeping no pixels (the null one) only find files with the
+    same bytes. The result is cached in `cache_dir`."""
+    key = _hash(filenames)
+    cache = os.path.join(cache_dir, key + '.sources.json')
+    decode = app.backend().image_pixels
+    if not os.path.exists(cache) and filenames \
+            and decode(filenames[0]) is None:
+        cache = os.path.join(cache_dir, key + '.bytes.json')
+        decode = None
+    if os.path.exists(cache):
+        with open(cache) as f:
+            return [tuple(source) for source in json.load(f)]
+    by_bytes = {}
+    found = {}
+    result = []
+    for i, filename in enumerate(filenames):
+        with open(filename, 'rb') as f:
+            digest = hashlib.sha1(f.read()).digest()
+        if digest not in by_bytes:
+            if decode is None:
+                by_bytes[digest] = (i, False)
+            else:
+                pixels = decode(filename)
+                same = _pixels_digest(pixels)
+                if same not in found:
+                    found[same] = (i, False)
+                    found.setdefault(_pixels_digest(pixels[:, ::-1]),
+                            (i, True))
+                by_bytes[digest] = found[same]
+        result.append(by_bytes[digest])
+    _makedirs(cache_dir)
+    _write_json(cache, result)
+    return result
+
+class Atlas(object):
+    """Images packed in a few large textures.
+
+    `frames` are `app.Image` rectangles of the shared `pages` textures, in
+    the order of the source files. Packing results are cached on disk in
+    `cache_dir`, keyed by a hash of the source files and the packing
+    settings.
+
+    With `dedup`, images having the same pixels are packed once, and so
+    are images mirroring another one: their frames have a negative width,
+    to be drawn flipped (see `sources`).
+
+    Building an atlas only decodes images (`images`, one per page), which
+    may be done in a worker thread: textures are uploaded on first access
+    to `pages` or `frames`.
+    """
+    def __init__(self, filenames, cache_dir=config['cache'],
+            max_size=config['max_size'], padding=config['padding'],
+            dedup=config['dedup']):
+        self.dedup = dedup
+        # the layout depends on the packing settings as much as the images
+        key = '%s_%d_%d%s' % (_hash(filenames), max_size, padding,
+                '_dedup' if dedup else '')
+        layout_file = os.path.join(cache_dir, key + '.json')
+        layout = self._load_layout(layout_file, cache_dir)
+        self.cached = layout is not None
+        if layout is None:
+            layout = self._build(filenames, key, cache_dir, max_size, padding)
+        self.page_files = [os.path.join(cache_dir, page)
+                for page in layout['pages']]
+        self.layout = [(page, tuple(rect)) for page, rect in layout['frames']]
+        self.images = layout['images']
+        self._pages = None
+        self._frames = None
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            backend = app.backend()
+            self._pages = [app.Texture(impl=backend.texture_from_image(image))
+                    for image in self.images]
+        return self._pages
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            self._frames = [app.Image(self.pages[page], rect)
+                    for page, rect in self.layout]
+        return self._frames
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __len__(self):
+        return len(self.layout)
+
+    def _load_layout(self, layout_file, cache_dir):
+        if not os.path.exists(layout_file):
+            return None
+        with open(layout_file) as f:
+            layout = json.load(f)
+        files = [os.path.join(cache_dir, page) for page in layout['pages']]
+        if not all(os.path.exists(page) for page in files):
+            return None
+        layout['images'] = [app.backend().decode_image(page)
+                for page in files]
+        return layout
+
+    def _build(self, filenames, key, cache_dir, max_size, padding):
+        backend = app.backend()
+        if self.dedup:
+            origins = sources(filenames, cache_dir)
+        else:
+            origins = [(i, False) for i in range(len(filenames))]
+        unique = sorted(set(i for i, _ in origins))
+        sizes = [tuple(backend.image_size(filenames[i])) for i in unique]
+        placements, page_sizes = pack(sizes, max_size, padding)
+        blits = [[] for _ in page_sizes]
+        for i, (page, x, y) in zip(unique, placements):
+            blits[page].append((filenames[i], (x, y)))
+        images = [backend.compose_image(size, page_blits)
+                for size, page_blits in zip(page_sizes, blits)]
+        rects = dict((i, (page, (x, y) + size)) for i, (page, x, y), size
+                in zip(unique, placements, sizes))
+        frames = []
+        for i, mirrored in origins:
+            page, (x, y, w, h) = rects[i]
+            frames.append((page, (x + w, y, -w, h) if mirrored
+                else (x, y, w, h)))
+        layout = {
+                'pages': ['%s_%d.png' % (key, i) for i in range(len(images))],
+                'frames': frames,
+                }
+        _makedirs(cache_dir)
+        for image, page in zip(images, layout['pages']):
+            backend.save_image(image, os.path.join(cache_dir, page))
+        _write_json(os.path.join(cache_dir, key + '.json'), layout)
+        layout['images'] = images
+        return layout
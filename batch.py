@@ -0,0 +1,170 @@
+"""Batch runner of headless sessions, across a process pool.
+
+Every session is an independent simulation: players (`player.Model`) and
+bots (`player.Bot`) in their own collision enabled world, driven by
+scripted controllers and seeded by the session number. Workers step whole
+sessions and write their metrics to one shared array, one row per
+session, so that nothing is pickled but the session numbers.
+
+Run with `python batch.py [sessions [ticks [workers]]]`.
+"""
+from __future__ import print_function
+import multiprocessing
+import random
+import sys
+import time
+import numpy as np
+import app
+from config import Physics as physics_config
+
+# metrics of a session, columns of the shared array
+FIELDS = ('ticks', 'contacts', 'airborne', 'distance', 'checksum')
+
+class RandomController(object):
+    """Walks in a random direction (or stands) for a random while, and
+    jumps or attacks now and then."""
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.direction = None
+        self.until = 0
+
+    def __call__(self, model, tick):
+        from player import Controls
+        rng = self.rng
+        if tick >= self.until:
+            self.direction = rng.choice((Controls.LEFT, Controls.RIGHT, None))
+            self.until = tick + rng.randint(10, 80)
+        if self.direction is None:
+            model.control(Controls.LEFT, False)
+            model.control(Controls.RIGHT, False)
+        else:
+            model.control(self.direction)
+        chance = rng.random()
+        if chance < .02:
+            model.control(Controls.JUMP)
+        elif chance < .03:
+            model.control(Controls.ATTACK)
+
+class BounceController(object):
+    """Turns around at the edges of the world."""
+    def __call__(self, model, tick):
+        from player import Controls
+        physics = model.physics
+        world = physics.world
+        x = physics.position.x
+        if x <= world.position.x:
+            model.control(Controls.RIGHT)
+        elif x + model.size[0] >= world.position.x + world.size.x:
+            model.control(Controls.LEFT)
+
+class Session(object):
+    def __init__(self, seed, players=1, bots=3, cell_size=128):
+        import physics
+        import player
+        self.world = physics.World(size=(physics_config['size'][0] * 2,
+            physics_config['size'][1]))
+        self.world.enable_collisions(cell_size).bind_pair_event(self._hit)
+        player.rng.seed(seed)
+        rng = random.Random(seed)
+        self.models = []
+        self.controllers = []
+        for i in range(players + bots):
+            if i < players:
+                model = player.Model(self.world)
+                controller = RandomController(rng.random())
+            else:
+                model = player.Bot(self.world)
+                controller = BounceController()
+            model.physics.position.x = rng.uniform(0, self.world.size.x)
+            self.models.append(model)
+            self.controllers.append(controller)
+        self.players = players
+        self.ticks = 0
+        self.contacts = 0
+        self.airborne = 0
+        self.distance = 0.
+
+    def _hit(self, first, second):
+        self.contacts += 1
+
+    def step(self):
+        import player
+        for model, controller in zip(self.models, self.controllers):
+            controller(model, self.ticks)
+        player.update_all(self.models, self.world)
+        world, n = self.world, self.players
+        # players are the first bodies of the world
+        self.distance += float(np.abs(world.positions[:n]
+            - world.previous[:n]).sum())
+        self.airborne += int(n - world.contacts[:n].sum())
+        self.ticks += 1
+
+    def metrics(self):
+        import replay
+        checksum = 0
+        for model in self.models:
+            checksum = (checksum * 31 + replay.checksum(model)) & 0xffffffff
+        return (self.ticks, self.contacts, self.airborne, self.distance,
+                checksum)
+
+_shared = None
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+    app.use_backend('null')
+
+def _run_sessions(job):
+    first, count, ticks, players, bots = job
+    width = len(FIELDS)
+    for i in range(first, first + count):
+        session = Session(i, players, bots)
+        for _ in range(ticks):
+            session.step()
+        _shared[i * width:(i + 1) * width] = session.metrics()
+    return count
+
+def run(sessions, ticks, workers=None, players=1, bots=3, chunk=None):
+    """Run `sessions` sessions of `ticks` ticks on `workers` processes (one
+    per core by default). Return the metrics, a (sessions, len(FIELDS))
+    array, and the elapsed time."""
+    workers = workers or multiprocessing.cpu_count()
+    chunk = chunk or max(1, sessions // (4 * workers))
+    shared = multiprocessing.Array('d', sessions * len(FIELDS), lock=False)
+    jobs = [(first, min(chunk, sessions - first), ticks, players, bots)
+            for first in range(0, sessions, chunk)]
+    # animations loaded before forking are shared by the workers
+    app.use_backend('null')
+    import player
+    player.Model.machine.load()
+    player.Bot.machine.load()
+    start = time.time()
+    pool = multiprocessing.Pool(workers, _init_worker, (shared,))
+    try:
+        pool.map(_run_sessions, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    metrics = np.frombuffer(shared, dtype=np.float64).reshape(sessions,
+            len(FIELDS)).copy()
+    return metrics, elapsed
+
+def report(metrics, elapsed, workers):
+    sessions = len(metrics)
+    ticks = metrics[:, FIELDS.index('ticks')].sum()
+    lines = ['%d sessions, %d workers: %.0f session ticks in %.2fs,'
+            ' %.0f session ticks/s' % (sessions, workers, ticks, elapsed,
+                ticks / elapsed)]
+    for i, name in enumerate(FIELDS[1:-1], 1):
+        column = metrics[:, i]
+        lines.append('  %-10s mean %10.1f  min %10.1f  max %10.1f'
+                % (name, column.mean(), column.min(), column.max()))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    sessions, ticks, workers = (args + [64, 2000, 0][len(args):])[:3]
+    workers = workers or multiprocessing.cpu_count()
+    metrics, elapsed = run(sessions, ticks, workers)
+    print(report(metrics, elapsed, workers))
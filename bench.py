@@ -0,0 +1,664 @@
+"""Benchmarks, run with `python bench.py [name ...]`.
+
+Every benchmark runs on the headless backend unless stated otherwise.
+"""
+from __future__ import print_function
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import app
+
+def bench_headless(frames=5000):
+    """Raw simulation throughput of the demo game, in ticks per second."""
+    import demo
+    app.use_backend('null')
+    game = demo.Game()
+    start = time.time()
+    ran = game.run(max_frames=frames, realtime=False)
+    elapsed = time.time() - start
+    print('headless: %d ticks in %.3fs, %.0f ticks/s'
+            % (ran, elapsed, ran / elapsed))
+
+class _LegacyBody(object):
+    """Per-object physics body, as updated before `physics.World`."""
+    def __init__(self, world, size, x, y, vx, vy):
+        from geometry import Vector
+        self.world = world
+        self.position = Vector(x, y)
+        self.size = Vector(*size)
+        self.velocity = Vector(vx, vy)
+        self.acceleration = Vector(0, 0) + world.gravity
+        self.contact = False
+
+    def update(self):
+        w = self.world
+        self.contact = False
+        self.velocity += self.acceleration
+        self.position += self.velocity
+        if self.position.x < w.position.x:
+            self.position.x = w.position.x
+            self.velocity.x = 0
+        elif self.position.x + self.size.x > w.position.x + w.size.x:
+            self.position.x = w.position.x + w.size.x - self.size.x
+            self.velocity.x = 0
+        if self.position.y + self.size.y > w.position.y + w.size.y:
+            self.position.y = w.position.y + w.size.y - self.size.y
+            self.velocity.y = 0
+            self.acceleration.x, self.acceleration.y = w.gravity
+            self.contact = True
+
+def _random_bodies(n, seed=0):
+    import random
+    rng = random.Random(seed)
+    return [((rng.uniform(4, 32), rng.uniform(4, 32)),
+        rng.uniform(0, 600), rng.uniform(0, 400),
+        rng.uniform(-8, 8), rng.uniform(-8, 8)) for _ in range(n)]
+
+def _per_tick(f, ticks):
+    start = time.time()
+    for _ in range(ticks):
+        f()
+    return (time.time() - start) / ticks
+
+def bench_physics(sizes=(1000, 10000, 50000), ticks=20):
+    """Per tick cost of the per-object bodies against `physics.World`."""
+    import physics
+    for n in sizes:
+        bodies = _random_bodies(n)
+        world = physics.World(capacity=n)
+        for size, x, y, vx, vy in bodies:
+            physics.Component(size, x, y, vx, vy, world=world)
+        legacy = [_LegacyBody(world, *b) for b in bodies]
+        def update_legacy():
+            for body in legacy:
+                body.update()
+        t_legacy = _per_tick(update_legacy, max(1, ticks * 1000 // n))
+        t_world = _per_tick(world.update, ticks)
+        print('physics: %6d bodies, per-object %8.3fms/tick, '
+                'world %6.3fms/tick (x%.0f)' % (n, t_legacy * 1e3,
+                    t_world * 1e3, t_legacy / t_world))
+
+def bench_collisions(sizes=(1000, 5000, 20000, 50000), ticks=10):
+    """Per tick cost of broad and narrow phase at constant body density."""
+    import math
+    import random
+    import physics
+    for n in sizes:
+        side = 40 * math.sqrt(n)
+        rng = random.Random(n)
+        world = physics.World(offset=(0, side), size=(side, 0),
+                gravity=(0, 0), capacity=n)
+        for _ in range(n):
+            physics.Component((rng.uniform(4, 16), rng.uniform(4, 16)),
+                    rng.uniform(0, side), rng.uniform(0, side),
+                    rng.uniform(-2, 2), rng.uniform(-2, 2), world=world)
+        world.enable_collisions(cell_size=32)
+        t = _per_tick(world.update, ticks)
+        print('collisions: %6d bodies, %7.3fms/tick, %.2fus/body, '
+                '%d contacts' % (n, t * 1e3, t * 1e6 / n,
+                    len(world.collisions.contacts)))
+    # bodies dropped on each other, above the floor, must come to rest
+    for height in (2, 4):
+        world = physics.World(offset=(0, 0), size=(400, 200), gravity=(0, 2))
+        world.enable_collisions(cell_size=32)
+        stack = [physics.Component((20, 20), 100, 180 - 30 * i, world=world)
+                for i in range(height)]
+        for _ in range(200):
+            world.update()
+        ys = [body.position.y for body in stack]
+        overlap = max(ys[i + 1] + 20 - ys[i] for i in range(height - 1))
+        speed = max(abs(body.velocity.y) for body in stack)
+        print('collisions: stack of %d, %.1fpx overlap, speed %.1f, %s'
+                % (height, overlap, speed,
+                    'settled' if overlap <= 0 and speed == 0 else 'FAILED'))
+
+def _count_vectors(f):
+    """Number of `geometry.Vector` built while calling `f`."""
+    import geometry
+    counter = [0]
+    init = geometry.Vector.__init__
+    def counting_init(self, x, y):
+        counter[0] += 1
+        init(self, x, y)
+    geometry.Vector.__init__ = counting_init
+    try:
+        f()
+    finally:
+        geometry.Vector.__init__ = init
+    return counter[0]
+
+def bench_vector(n=10000, ticks=50):
+    """Vector allocations and time per tick of a motion integration, with
+    binary operators (the former `+=`), in-place operators and a
+    `geometry.VectorArray`."""
+    from geometry import Vector, VectorArray
+    bodies = _random_bodies(n)
+    def make():
+        return ([Vector(x, y) for _, x, y, _, _ in bodies],
+                [Vector(vx, vy) for _, _, _, vx, vy in bodies],
+                Vector(0, 2))
+    positions, velocities, gravity = make()
+    def binary():
+        for i in range(n):
+            velocities[i] = velocities[i] + gravity
+            positions[i] = positions[i] + velocities[i]
+    def inplace():
+        for p, v in zip(positions, velocities):
+            v += gravity
+            p += v
+    array_p = VectorArray([tuple(p) for p in positions])
+    array_v = VectorArray([tuple(v) for v in velocities])
+    def batch():
+        array_v.__iadd__(gravity)
+        array_p.__iadd__(array_v)
+    for name, f in (('binary', binary), ('in-place', inplace),
+            ('array', batch)):
+        allocs = _count_vectors(f)
+        t = _per_tick(f, ticks)
+        print('vector: %-8s %6d allocations/tick, %8.3fms/tick'
+                % (name, allocs, t * 1e3))
+
+def bench_bots(n=10000, ticks=20):
+    """Spawn and batch update cost of many `player.Bot`."""
+    import physics
+    import player
+    app.use_backend('null')
+    world = physics._world
+    start = time.time()
+    bots = [player.Bot() for _ in range(n)]
+    spawn = time.time() - start
+    t = _per_tick(lambda: player.update_all(bots, world), ticks)
+    print('bots: %d spawned in %.3fs (%.1fus each), update_all %.3fms/tick'
+            % (n, spawn, spawn * 1e6 / n, t * 1e3))
+
+def _startup(mode):
+    """Time to first frame of the demo, loading animations from `mode`."""
+    import config
+    start = time.time()
+    config.Animations['atlas'] = mode != 'directory'
+    if mode != 'bundle':
+        config.Bundle['file'] = os.devnull + '.missing'
+    import animation
+    import demo
+    import player
+    demo.Game().run(max_frames=1, realtime=False)
+    cold = time.time() - start
+    animation.AnimationFactory().clear()
+    animation._AnimationFactory.bundle = None
+    player.Model.machine.loaded = False
+    start = time.time()
+    demo.Game().run(max_frames=1, realtime=False)
+    return cold, time.time() - start
+
+def bench_startup():
+    """Cold (fresh process) and warm time to first frame, animations being
+    loaded by walking directories, from cached atlases, or from the
+    bundle. Uses EUSDAB_BACKEND, headless by default."""
+    import bundle
+    import config
+    env = dict(os.environ)
+    env.setdefault('EUSDAB_BACKEND', 'null')
+    fd, bundle_file = tempfile.mkstemp(suffix='.bundle')
+    os.close(fd)
+    try:
+        app.use_backend(env['EUSDAB_BACKEND'])
+        bundle.build(bundle_file)
+        env['EUSDAB_BUNDLE'] = bundle_file
+        for mode in ('directory', 'atlas', 'bundle'):
+            out = subprocess.check_output([sys.executable, __file__,
+                '_startup', mode], env=env)
+            cold, warm = map(float, out.split())
+            print('startup: %-9s cold %7.1fms, warm %7.1fms'
+                    % (mode, cold * 1e3, warm * 1e3))
+    finally:
+        os.remove(bundle_file)
+
+def bench_render(n=5000, frames=20):
+    """Draw calls and time per frame drawing many bots, one draw per sprite
+    against the sprite batch."""
+    import player
+    app.use_backend('null')
+    window = app.Window(size=(600, 480))
+    graphics = window.graphics
+    bots = [player.Bot() for _ in range(n)]
+    for batch in (False, True):
+        window._impl.draw_calls = 0
+        def frame():
+            if batch:
+                graphics.begin_batch()
+            for bot in bots:
+                graphics.draw(bot)
+            if batch:
+                graphics.end_batch()
+        t = _per_tick(frame, frames)
+        print('render: %d bots, batch %-5s %6d draws/frame, %7.3fms/frame'
+                % (n, batch, window._impl.draw_calls // frames, t * 1e3))
+
+def bench_culling(n=5000, frames=20, screens=20):
+    """Time per frame of bots spread over a world `screens` windows wide,
+    every bot drawn against only those in view of the camera."""
+    import physics
+    import player
+    app.use_backend('null')
+    size = (600, 480)
+    world = physics._world
+    world.size.x = size[0] * screens
+    window = app.Window(size=size)
+    graphics = window.graphics
+    graphics.camera = app.Camera(bounds=(0, 0, size[0] * screens, size[1]))
+    group = player.Group(world)
+    for _, x, _, _, _ in _random_bodies(n):
+        bot = player.Bot()
+        bot.physics.position.x = x * screens
+        group.add(bot)
+    for cull in (False, True):
+        def frame():
+            group.update()
+            graphics.camera.pan(7, 0)
+            graphics.begin_frame()
+            graphics.begin_batch()
+            if cull:
+                graphics.draw(group)
+            else:
+                for bot in group.models:
+                    graphics.draw(bot)
+            graphics.end_batch()
+        t = _per_tick(frame, frames)
+        print('culling: %d bots, %d screens, cull %-5s %5d drawn, %5d culled,'
+                ' %7.3fms/frame' % (n, screens, cull,
+                    graphics.drawn if cull else n, graphics.culled,
+                    t * 1e3))
+
+def bench_profiler(frames=5000):
+    """Headless demo throughput without profiler, with a disabled one and
+    with an enabled one."""
+    import demo
+    import profiler
+    app.use_backend('null')
+    for mode in ('none', 'disabled', 'enabled'):
+        game = demo.Game()
+        game.profiler = None if mode == 'none' \
+                else profiler.Profiler(enabled=mode == 'enabled')
+        start = time.time()
+        ran = game.run(max_frames=frames, realtime=False)
+        elapsed = time.time() - start
+        print('profiler: %-8s %6.2fus/frame' % (mode, elapsed * 1e6 / ran))
+    print(game.profiler.report())
+
+def _record_session(filename, ticks, seed=0):
+    """Record a scripted session of `ticks` ticks, walking and jumping
+    around."""
+    import demo
+    import null_backend
+    import random
+    app.use_backend('null')
+    rng = random.Random(seed)
+    game = demo.Game(seed=seed, record=filename)
+    def script():
+        if rng.random() < .05:
+            key = rng.choice(('left', 'right', 'up', 'a'))
+            if key in null_backend.pressed_keys():
+                null_backend.release(key)
+            else:
+                null_backend.press(key)
+    game.add_frame_hook(script)
+    game.run(max_frames=ticks, realtime=False)
+    game.recorder.close()
+    for key in list(null_backend.pressed_keys()):
+        null_backend.release(key)
+
+def bench_replay(ticks=20000):
+    """Size of a recorded session, and replay throughput with and without
+    checksum verification."""
+    import replay
+    filename = os.path.join(tempfile.mkdtemp(), 'session.rec')
+    _record_session(filename, ticks)
+    print('replay: %d ticks recorded, %d bytes (%.1f bytes/tick)'
+            % (ticks, os.path.getsize(filename),
+                float(os.path.getsize(filename)) / ticks))
+    for verify in (False, True):
+        n, elapsed = replay.run(filename, verify)
+        print('replay: verify %-5s %d ticks in %.3fs, %.0f ticks/s'
+                % (verify, n, elapsed, n / elapsed))
+
+def bench_snapshot(n=10000, ticks=8):
+    """Save and restore cost of the whole simulation, per entity, and
+    check that a rollback replays the same ticks."""
+    import physics
+    import player
+    import replay
+    import snapshot
+    app.use_backend('null')
+    world = physics._world
+    bots = [player.Bot() for _ in range(n)]
+    state = snapshot.Snapshot(world, bots)
+    save = _per_tick(state.save, 20)
+    restore = _per_tick(state.restore, 20)
+    print('snapshot: %d bodies, %d bytes, save %.3fus, restore %.3fus per'
+            ' entity' % (world.count, len(state.buffer),
+                save * 1e6 / world.count, restore * 1e6 / world.count))
+    def run():
+        for _ in range(ticks):
+            player.update_all(bots, world)
+        return [replay.checksum(bot) for bot in bots[::97]]
+    state.save()
+    first = run()
+    state.restore()
+    print('snapshot: rollback of %d ticks %s' % (ticks,
+        'replays identically' if run() == first else 'DIVERGES'))
+
+def bench_batch(sessions=32, ticks=500):
+    """Batch runner throughput, in session ticks per second, from one
+    worker up to one per core."""
+    import multiprocessing
+    import batch
+    workers = 1
+    while True:
+        metrics, elapsed = batch.run(sessions, ticks, workers)
+        print('batch: ' + batch.report(metrics, elapsed, workers)
+                .split('\n')[0])
+        if workers >= multiprocessing.cpu_count():
+            break
+        workers = min(2 * workers, multiprocessing.cpu_count())
+
+def bench_net(sizes=(100, 200), ticks=400, latency=.05, jitter=.01,
+        loss=.05):
+    """Server bandwidth and CPU per client, with clients and server in
+    this process on localhost, over lossy channels on a simulated clock."""
+    import random
+    import net
+    app.use_backend('null')
+    for n in sizes:
+        now = [0.]
+        clock = lambda: now[0]
+        server = net.Server(channel=net.Channel(latency=latency,
+            jitter=jitter, loss=loss, seed=0, clock=clock))
+        def controller(seed):
+            rng = random.Random(seed)
+            held = [0]
+            def buttons(tick):
+                if rng.random() < .05:
+                    held[0] = rng.choice((0, net.LEFT, net.RIGHT))
+                return held[0] | (net.JUMP if rng.random() < .02 else 0)
+            return buttons
+        clients = [net.Client(server.channel.address,
+            channel=net.Channel(latency=latency, jitter=jitter, loss=loss,
+                seed=i + 1, clock=clock), controller=controller(i),
+            window=False) for i in range(n)]
+        spent = 0.
+        for _ in range(ticks):
+            now[0] += server.tick_duration
+            for client in clients:
+                client._tick()
+            start = time.time()
+            server._tick()
+            spent += time.time() - start
+        seconds = ticks * server.tick_duration
+        state = dict((peer.entity, net.quantize(peer.model))
+                for peer in server.peers.values())
+        full = net._snapshot.size + len(net.encode_delta(state, {})[2])
+        sent = server.channel.bytes_sent
+        snapshots = float(server.channel.packets_sent)
+        print('net: %d clients, server %.0f B/s and %.1fus/tick per client,'
+                ' snapshots %.0f B (full %d B), %d/%d clients synced'
+                % (n, sent / seconds / n, spent * 1e6 / ticks / n,
+                    sent / snapshots, full,
+                    sum(c.latest is not None for c in clients), n))
+        for client in clients:
+            client.channel.close()
+        server.channel.close()
+
+def _platform_rows(width, height, seed=0):
+    """Rows of a level: random platforms 8 tiles long every 4 rows, above
+    a floor."""
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    for y in range(height):
+        if y == height - 1:
+            yield '#' * width
+        elif y % 4 == 3:
+            solid = (rng.rand(-(-width // 8)) < .3).repeat(8)[:width]
+            yield ''.join(np.where(solid, '#', '.').tolist())
+        else:
+            yield '.' * width
+
+def bench_hitbox(n=20000):
+    """Frame mask overlap tests, bitmasks against per pixel arrays, for
+    the hit areas of the attack and the frames of a bot at random
+    offsets."""
+    import random
+    import numpy as np
+    import hitbox
+    import player
+    app.use_backend('null')
+    attack = player.AttackState('vomit_right')
+    hits = [mask.difference(hitbox.masks(attack.key)[attack.rest])
+            for mask in hitbox.masks(attack.key)]
+    hits = [mask for mask in hits if mask]
+    targets = hitbox.masks('botB_left')
+    rng = random.Random(0)
+    cases = [(rng.choice(hits), rng.choice(targets), rng.randint(-120, 120),
+        rng.randint(-100, 100)) for _ in range(n)]
+    def pixels(mask):
+        solid = np.zeros((mask.h, mask.w), dtype=bool)
+        for i, row in enumerate(mask.rows):
+            solid[i] = [(row >> j) & 1 for j in range(mask.w)]
+        return solid
+    arrays = dict((id(mask), pixels(mask)) for mask in hits + targets)
+    def naive(a, b, dx, dy):
+        ax, ay, bx, by = a.x, a.y, b.x + dx, b.y + dy
+        x0, x1 = max(ax, bx), min(ax + a.w, bx + b.w)
+        y0, y1 = max(ay, by), min(ay + a.h, by + b.h)
+        if x0 >= x1 or y0 >= y1:
+            return False
+        return bool((arrays[id(a)][y0 - ay:y1 - ay, x0 - ax:x1 - ax]
+            & arrays[id(b)][y0 - by:y1 - by, x0 - bx:x1 - bx]).any())
+    start = time.time()
+    expected = [naive(a, b, dx, dy) for a, b, dx, dy in cases]
+    slow = time.time() - start
+    start = time.time()
+    found = [hitbox.overlap(a, 0, 0, b, dx, dy) for a, b, dx, dy in cases]
+    fast = time.time() - start
+    boxes = sum(1 for a, b, dx, dy in cases
+            if a.x < b.x + dx + b.w and b.x + dx < a.x + a.w
+            and a.y < b.y + dy + b.h and b.y + dy < a.y + a.h)
+    print('hitbox: %d tests, %d past the AABB reject, %d hits (%s):'
+            ' bitmasks %.2fus, pixel arrays %.2fus per test'
+            % (n, boxes, sum(found), 'same' if found == expected
+                else 'DIFFERENT', fast * 1e6 / n, slow * 1e6 / n))
+
+def bench_dedup():
+    """Memory saved, and load time changed, by packing identical and
+    mirrored frames once, over every clip of the animations directory."""
+    import animation
+    import atlas
+    import config
+    app.use_backend('null')
+    factory = animation.AnimationFactory()
+    directory = config.Animations['dir']
+    keys = sorted(key for key in os.listdir(directory)
+            if os.path.isdir(os.path.join(directory, key)))
+    files = [f for key in keys for f in factory._files(key)
+            if f.endswith('.png')]
+    start = time.time()
+    atlas.sources(files, tempfile.mkdtemp())
+    hashing = time.time() - start
+    saved = dict((name, config.Animations[name])
+            for name in ('atlas', 'budget'))
+    config.Animations['budget'] = factory.budget = 0
+    bundle, config.Bundle['file'] = config.Bundle['file'], \
+            os.devnull + '.missing'
+    dedup = config.Atlas['dedup']
+    try:
+        for mode in ('directory', 'atlas'):
+            config.Animations['atlas'] = mode == 'atlas'
+            results = []
+            for enabled in (False, True):
+                config.Atlas['dedup'] = enabled
+                factory.clear()
+                # once to cache atlases and sources, then timed
+                for key in keys:
+                    factory.get_clip(key)
+                factory.clear()
+                start = time.time()
+                for key in keys:
+                    factory.get_clip(key)
+                elapsed = time.time() - start
+                results.append((len(factory.users), factory.resident,
+                    elapsed))
+                print('dedup: %-9s dedup %-5s %d frames, %3d textures,'
+                        ' %5.1fMB, loaded in %.1fms' % (mode, enabled,
+                            len(files), len(factory.users),
+                            factory.resident / 1e6, elapsed * 1e3))
+            (_, before, slow), (_, after, fast) = results
+            print('dedup: %-9s saved %.1fMB (%.0f%%), load time %+.1fms'
+                    % (mode, (before - after) / 1e6,
+                        100. * (before - after) / before,
+                        (fast - slow) * 1e3))
+    finally:
+        config.Atlas['dedup'] = dedup
+        config.Bundle['file'] = bundle
+        config.Animations.update(saved)
+        factory.budget = saved['budget']
+        factory.clear()
+    print('dedup: finding the sources of %d frames took %.2fs (files with '
+            'the same bytes only, the null backend has no pixels)'
+            % (len(files), hashing))
+
+def bench_animations(budgets=(0, 32 << 20, 16 << 20), n=3, ticks=4000):
+    """Clip cache of the animation factory under texture budgets: players
+    switching states at random, hits, misses, evictions and resident
+    memory."""
+    import random
+    import animation
+    import physics
+    import player
+    from player import Controls
+    app.use_backend('null')
+    factory = animation.AnimationFactory()
+    for budget in budgets:
+        factory.budget = budget
+        factory.trim()
+        world = physics.World()
+        player.rng.seed(0)
+        rng = random.Random(0)
+        models = [player.Model(world) for _ in range(n)]
+        before = factory.stats()
+        peak = 0
+        start = time.time()
+        for _ in range(ticks):
+            for model in models:
+                if rng.random() < .05:
+                    model.control(rng.choice((Controls.LEFT, Controls.RIGHT,
+                        Controls.JUMP, Controls.ATTACK)), rng.random() < .7)
+            player.update_all(models, world)
+            peak = max(peak, factory.resident)
+        elapsed = time.time() - start
+        stats = factory.stats()
+        print('animations: budget %5.1fMB, %d players: %6d hits, %3d misses,'
+                ' %3d evictions, peak %5.1fMB resident, %.3fms/tick'
+                % (budget / 1e6, n, stats['hits'] - before['hits'],
+                    stats['misses'] - before['misses'],
+                    stats['evictions'] - before['evictions'], peak / 1e6,
+                    elapsed * 1e3 / ticks))
+        for model in models:
+            model.remove()
+
+def bench_tilemap(widths=(1000, 10000, 100000), height=64, n=500,
+        ticks=50):
+    """Streaming and collision cost of bodies in levels of increasing
+    width, chunks loaded around a point scrolling over the level."""
+    import physics
+    import tilemap
+    app.use_backend('null')
+    tile, chunk = 16, 16
+    for width in widths:
+        filename = os.path.join(tempfile.mkdtemp(), 'level.txt')
+        tilemap.write(filename, width, height, tile,
+                _platform_rows(width, height))
+        level = tilemap.Level(filename, chunk)
+        tiles = tilemap.TileMap(level, radius=2)
+        world = physics.World(offset=(0, height * tile),
+                size=(width * tile, -1))
+        world.tilemap = tiles
+        for size, x, y, vx, _ in _random_bodies(n):
+            world.add(None, size, x * 2, y * 2, vx, 0, 0, world.gravity.y)
+        tiles.stream([(600, height * tile / 2.)])
+        t = _per_tick(world.update, ticks)
+        rects, chunks = len(tiles.index()[2]), len(tiles.chunks)
+        start = time.time()
+        steps = 0
+        for x in range(0, min(width * tile, 200000), 64):
+            tiles.stream([(x, height * tile / 2.)])
+            steps += 1
+        scroll = time.time() - start
+        print('tilemap: %6d x %d tiles (%5.1fMB), %d bodies: %.3fms/tick'
+                ' against %d rects of %d chunks; scrolling %.1fus/step,'
+                ' %.0fus/chunk loaded' % (width, height,
+                    os.path.getsize(filename) / 1e6, n, t * 1e3, rects,
+                    chunks, scroll * 1e6 / steps,
+                    scroll * 1e6 / max(tiles.loads, 1)))
+        os.remove(filename)
+
+def bench_ecs(n=100000, ticks=20):
+    """Spawn, update and despawn cost of actors stored as entities, half
+    players and half bots, against `player.update_all` on bots."""
+    import numpy as np
+    import actors
+    import physics
+    import player
+    app.use_backend('null')
+    world = physics._world
+    registry = actors.create_registry()
+    rng = np.random.RandomState(0)
+    actors.kinds()
+    start = time.time()
+    entities = np.concatenate([actors.spawn(registry, tag, n // 2,
+        rng.uniform(0, world.size.x, n // 2), 0., rng)
+        for tag in ('player', 'bot')])
+    spawn = time.time() - start
+    t = _per_tick(lambda: actors.update(registry, world), ticks)
+    start = time.time()
+    registry.despawn(entities[::2])
+    registry.despawn(entities[1::2])
+    despawn = time.time() - start
+    bots = [player.Bot() for _ in range(n // 50)]
+    models = _per_tick(lambda: player.update_all(bots, world), ticks)
+    print('ecs: %d entities spawned in %.3fs (%.2fus each), update'
+            ' %.2fms/tick (%.3fus each), despawned in %.3fs;'
+            ' update_all %.2fus per model'
+            % (n, spawn, spawn * 1e6 / n, t * 1e3, t * 1e6 / n, despawn,
+                models * 1e6 / len(bots)))
+
+benchmarks = {
+        'hitbox': bench_hitbox,
+        'dedup': bench_dedup,
+        'animations': bench_animations,
+        'tilemap': bench_tilemap,
+        'ecs': bench_ecs,
+        'net': bench_net,
+        'batch': bench_batch,
+        'snapshot': bench_snapshot,
+        'replay': bench_replay,
+        'profiler': bench_profiler,
+        'culling': bench_culling,
+        'render': bench_render,
+        'startup': bench_startup,
+        'bots': bench_bots,
+        'vector': bench_vector,
+        'collisions': bench_collisions,
+        'headless': bench_headless,
+        'physics': bench_physics,
+        }
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['_startup']:
+        import config
+        config.Bundle['file'] = os.environ['EUSDAB_BUNDLE']
+        print('%r %r' % _startup(sys.argv[2]))
+        sys.exit()
+    names = sys.argv[1:] or sorted(benchmarks)
+    for name in names:
+        benchmarks[name]()
@@ -0,0 +1,185 @@
+"""Precompiled animation bundle: every clip of `images/animations` in one
+indexed file, memory-mapped at load time.
+
+Layout (little endian)::
+
+    header  magic 'EUSB', version (H), image count (H), clip count (H)
+    images  per image: codec (B), width (H), height (H), offset (I),
+            length (I) of its blob
+    clips   per clip: name length (B), name, frame rate (f), frame count
+            (H), offset (I) and length (I) of its masks, then per frame:
+            image index (H), x, y (2H), w (h), h (H) of the frame
+            rectangle, mirrored when w is negative
+    blobs   encoded images, then the masks of every clip (JSON, as
+            `hitbox.Mask.dump`), referenced by absolute offsets
+
+Images are either atlas pages (when the atlas cache has been written) or
+single frames, stored as PNG (compressed RGBA).
+
+Build with `python bundle.py [output]`.
+"""
+from __future__ import print_function
+import json
+import mmap
+import os
+import struct
+import sys
+import app
+from atlas import Atlas, sources as atlas_sources
+from config import Animations as config, Atlas as atlas_config, \
+        Bundle as bundle_config
+
+MAGIC = b'EUSB'
+VERSION = 4
+CODEC_PNG = 0
+
+_header = struct.Struct('<4sHHH')
+_image = struct.Struct('<BHHII')
+_clip = struct.Struct('<fHII')
+_frame = struct.Struct('<H2HhH')
+
+def _clip_files(key):
+    directory = os.path.join(config['dir'], key)
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.endswith('.png')]
+
+def build(filename=bundle_config['file'], directory=config['dir']):
+    """Write the bundle of every clip of `directory`, clips mirroring each
+    other sharing their images, with the collision masks of their frames."""
+    from animation import read_fps, mirror_of
+    import hitbox
+    backend = app.backend()
+    sources = [] # (filename, width, height)
+    indices = {} # index in sources, by filename
+    clips = [] # (name, [(image index, rect)])
+    def source(f):
+        if f not in indices:
+            indices[f] = len(sources)
+            sources.append((f,) + tuple(backend.image_size(f)))
+        return indices[f]
+    for key in sorted(os.listdir(directory)):
+        if not os.path.isdir(os.path.join(directory, key)):
+            continue
+        mirror = mirror_of(key)
+        keys = sorted([key, mirror] if mirror is not None
+                and os.path.isdir(os.path.join(directory, mirror)) else [key])
+        files = [_clip_files(k) for k in keys]
+        start = sum(len(f) for f in files[:keys.index(key)])
+        end = start + len(files[keys.index(key)])
+        files = [f for group in files for f in group]
+        atlas = Atlas(files, dedup=atlas_config['dedup']) \
+                if config['atlas'] else None
+        if atlas is not None and all(os.path.exists(f)
+                for f in atlas.page_files):
+            frames = [(source(atlas.page_files[page]), rect)
+                    for page, rect in atlas.layout[start:end]]
+        else:
+            if atlas_config['dedup']:
+                origins = atlas_sources(files)
+            else:
+                origins = [(i, False) for i in range(len(files))]
+            frames = []
+            for i, mirrored in origins[start:end]:
+                index = source(files[i])
+                w, h = sources[index][1:]
+                frames.append((index, (w, 0, -w, h) if mirrored
+                    else (0, 0, w, h)))
+        clips.append((key, frames))
+
+    names = [key.encode('utf-8') for key, _ in clips]
+    offset = _header.size + _image.size * len(sources) + sum(1 + len(name)
+            + _clip.size + _frame.size * len(frames)
+            for name, (_, frames) in zip(names, clips))
+    images, blobs = [], []
+    for source, width, height in sources:
+        with open(source, 'rb') as f:
+            blob = f.read()
+        images.append(_image.pack(CODEC_PNG, width, height, offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+    toc = []
+    for name, (key, frames) in zip(names, clips):
+        blob = json.dumps([mask.dump()
+            for mask in hitbox.build(key)]).encode('utf-8')
+        toc.append(struct.pack('<B', len(name)) + name
+                + _clip.pack(read_fps(key), len(frames), offset, len(blob)))
+        toc.extend(_frame.pack(index, *rect) for index, rect in frames)
+        blobs.append(blob)
+        offset += len(blob)
+    toc = b''.join(toc)
+    with open(filename, 'wb') as f:
+        f.write(_header.pack(MAGIC, VERSION, len(sources), len(clips)))
+        f.write(b''.join(images))
+        f.write(toc)
+        for blob in blobs:
+            f.write(blob)
+    return len(sources), len(clips)
+
+class Bundle(object):
+    """Memory-mapped bundle, images are decoded from slices of the map."""
+    def __init__(self, filename=bundle_config['file']):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, version, nb_images, nb_clips = _header.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise IOError("Invalid bundle '%s'" % filename)
+        pos = _header.size
+        self.images = []
+        for _ in range(nb_images):
+            self.images.append(_image.unpack_from(self._map, pos))
+            pos += _image.size
+        self.clips = {}
+        self.fps = {}
+        # (offset, length) of the masks of every clip
+        self._masks = {}
+        for _ in range(nb_clips):
+            length, = struct.unpack_from('<B', self._map, pos)
+            name = self._map[pos + 1:pos + 1 + length].decode('utf-8')
+            pos += 1 + length
+            fps, count, offset, length = _clip.unpack_from(self._map, pos)
+            pos += _clip.size
+            frames = []
+            for _ in range(count):
+                values = _frame.unpack_from(self._map, pos)
+                frames.append((values[0], values[1:]))
+                pos += _frame.size
+            self.clips[name] = frames
+            self.fps[name] = fps
+            self._masks[name] = (offset, length)
+
+    def __contains__(self, key):
+        return key in self.clips
+
+    def decode(self, key):
+        """Decoded images of the clip `key`, as (image, rect) pairs, images
+        being decoded from slices of the map."""
+        return self.decode_clips([key])[0]
+
+    def decode_clips(self, keys):
+        """`decode` the clips `keys`, decoding their shared images once."""
+        backend = app.backend()
+        decoded = {}
+        clips = []
+        for key in keys:
+            frames = []
+            for index, rect in self.clips[key]:
+                if index not in decoded:
+                    codec, width, height, offset, length = self.images[index]
+                    blob = self._view[offset:offset + length]
+                    decoded[index] = backend.decode_image_memory(blob)
+                frames.append((decoded[index], rect))
+            clips.append(frames)
+        return clips
+
+    def masks(self, key):
+        """Collision masks of the frames of the clip `key`."""
+        from hitbox import Mask
+        offset, length = self._masks[key]
+        data = self._map[offset:offset + length].decode('utf-8')
+        return [Mask.load(values) for values in json.loads(data)]
+
+if __name__ == '__main__':
+    output = sys.argv[1] if len(sys.argv) > 1 else bundle_config['file']
+    nb_images, nb_clips = build(output)
+    print('%s: %d clips, %d images' % (output, nb_clips, nb_images))
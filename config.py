@@ -5,6 +5,7 @@ _this_dir = os.path.dirname(__file__)
 Window = {
         'size': (600, 480),
         'title': 'Demo Fil Rouge',
+        'fps': 0, # rendering is only limited by vsync
         'control': 'joystick'
         }
 
@@ -18,10 +19,40 @@ Player = {
         'size': (186, 148)
         }
 
+Bot = {
+        'speeds': {
+            'walk': 2,
+            },
+        'size': (160, 141)
+        }
+
+# level size, independent of the window's: the camera scrolls over it
+World = {
+        'size': Window['size'],
+        }
+
+Level = {
+        'file': os.path.join(_this_dir, 'levels', 'demo.txt'),
+        'chunk_size': 8, # tiles
+        'radius': 1, # chunks kept loaded around the player
+        'color': 'white',
+        }
+
 Physics = {
-        'offset': (0, Window['size'][1]),
+        'offset': (0, World['size'][1]),
         'gravity': (0, 2),
-        'size': (Window['size'][0], -13)
+        'size': (World['size'][0], -13),
+        'tick_rate': 40,
+        'max_catchup': 5,
+        }
+
+Net = {
+        'address': ('127.0.0.1', 7777),
+        'snapshot_rate': 20, # per second, at most the tick rate
+        'history': 64, # snapshots kept as delta bases
+        'precision': 4, # quantization steps per pixel
+        'interpolation': .1, # seconds clients render behind the server
+        'timeout': 5., # seconds without input before a client is dropped
         }
 
 Images = {
@@ -30,11 +61,33 @@ Images = {
 
 Animations = {
         'dir': os.path.join(Images['dir'], 'animations'),
+        'atlas': True, # pack frames in texture atlases
+        'fps': 40, # unless set in the clip manifest, <clip>.json
+        'budget': 256 << 20, # bytes of textures kept loaded, 0 for no limit
+        }
+
+Hitbox = {
+        'alpha': 128, # pixels at least this opaque collide
+        'cache': os.path.join(_this_dir, '.cache', 'hitbox'),
+        }
+
+Bundle = {
+        'file': os.path.join(Images['dir'], 'animations.bundle'),
+        }
+
+Atlas = {
+        'cache': os.path.join(_this_dir, '.cache', 'atlas'),
+        'max_size': 2048,
+        'padding': 1,
+        # identical and mirrored images packed once
+        'dedup': True,
         }
 
 Joystick = {
         'id': 0,
+        'jump': 0,
         'vomit': 2,
+        'dead_zone': 50, # of the stick, in [0, 100]
         }
 
 Keyboard = {
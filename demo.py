@@ -1,38 +1,113 @@
 import os
+import random
 import app
+import physics
 import player
 import config
+import profiler
+import replay as _replay
+import tilemap
 
 class Game(app.App):
-    def __init__(self):
-        super(Game, self).__init__()
+    """The demo, either played (and recorded to `record`) or replaying the
+    `replay.Replay` `replay`, checking its checksums with `verify`."""
+    def __init__(self, seed=None, record=None, replay=None, verify=True):
+        super(Game, self).__init__(tick_rate=config.Physics['tick_rate'],
+                max_catchup=config.Physics['max_catchup'])
         window = self.create_window(title=config.Window['title'],
-                size=config.Window['size'])
-        self.model = player.Model()
-        self.back = app.Image(os.path.join(config.Images['dir'], 'fond.png'))
+                size=config.Window['size'], fps=config.Window['fps'])
+        window.graphics.camera = app.Camera(
+                bounds=(0, 0) + tuple(config.World['size']))
+        if replay is not None:
+            seed = replay.seed
+        elif seed is None:
+            seed = random.randrange(1 << 32)
+        self.seed = seed
+        player.rng.seed(seed)
+        self.world = physics.World()
+        self.model = player.Model(self.world)
+        self.tilemap = None
+        if config.Level['file']:
+            level = tilemap.Level(config.Level['file'],
+                    config.Level['chunk_size'])
+            self.tilemap = tilemap.TileMap(level, config.Level['radius'],
+                    config.Level['color'])
+            self.world.tilemap = self.tilemap
+        self.replay = replay
+        self.verify = verify
+        self._replayed = iter(replay) if replay is not None else None
+        self.recorder = _replay.Recorder(record, seed) if record else None
+        self.back = app.Layer(config.World['size'], static=True)
+        self.back.add(app.Image(os.path.join(config.Images['dir'], 'fond.png')))
         self._paused = False
+        if config.Window['control'] == 'joystick':
+            joystick = config.Joystick
+            self.input.use_joystick(joystick['id'], buttons={
+                joystick['jump']: config.Keyboard['jump'],
+                joystick['vomit']: config.Keyboard['vomit'],
+                }, dead_zone=joystick['dead_zone'])
+        # 'p' shows the frame profiler
+        profiler.default.attach(self)
+
+    def control(self, control, pred=True):
+        if self.recorder is not None:
+            self.recorder.control(control, pred)
+        self.model.control(control, pred)
 
     def key_pressed(self, key):
         super(Game, self).key_pressed(key)
+        if self.replay is not None:
+            return
         if key == 'space':
             self._paused = bool(1 - self._paused)
         if key == config.Keyboard['jump']:
-            self.model.control(player.Controls.JUMP)
+            self.control(player.Controls.JUMP)
         elif key == config.Keyboard['vomit']:
-            self.model.control(player.Controls.ATTACK)
+            self.control(player.Controls.ATTACK)
 
     def update(self):
-        if not self._paused:
+        if self.replay is not None:
+            self._update_replay()
+        elif not self._paused:
             if self.is_pressed('left'):
-                self.model.control(player.Controls.LEFT)
+                self.control(player.Controls.LEFT)
             elif self.is_pressed('right'):
-                self.model.control(player.Controls.RIGHT)
+                self.control(player.Controls.RIGHT)
             else:
-                self.model.control(player.Controls.RIGHT, False)
-                self.model.control(player.Controls.LEFT, False)
-            self.model.update()
-            # TODO: sleep 25 ms ?
+                self.control(player.Controls.RIGHT, False)
+                self.control(player.Controls.LEFT, False)
+            self.stream()
+            self.model.update(self.tick_duration)
+            if self.recorder is not None:
+                self.recorder.end_tick(_replay.checksum(self.model))
+
+    def stream(self):
+        """Load the level around the player."""
+        if self.tilemap is not None:
+            x, y = self.model.physics.position
+            w, h = self.model.size
+            self.tilemap.stream([(x + w / 2., y + h / 2.)])
+
+    def _update_replay(self):
+        tick = next(self._replayed, None)
+        if tick is None:
+            for window in self.windows:
+                window.close()
+            return
+        controls, crc = tick
+        for code in controls:
+            self.model.control(code >> 1, code & 1)
+        self.stream()
+        self.model.update(self.tick_duration)
+        if self.verify and _replay.checksum(self.model) != crc:
+            raise ValueError("Replay diverged at tick %d" % self.ticks)
 
-    def render_to(self, window):
+    def render_to(self, window, alpha=1.):
+        x, y = self.model.physics.interpolate(alpha)
+        w, h = self.model.size
+        window.graphics.camera.center_on(x + w / 2., y + h / 2., window.size)
+        window.graphics.begin_frame()
         window.draw(self.back)
+        if self.tilemap is not None:
+            window.draw(self.tilemap)
         window.draw(self.model)
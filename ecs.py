@@ -0,0 +1,184 @@
+"""Entity component system core.
+
+Entities are integer ids. Components are registered with a dtype and a
+shape, or as tags (no data). Entities having exactly the same components
+share an `Archetype`, which stores every component in a packed column (a
+numpy array, row i belonging to the entity `entities[i]`), so that
+systems process whole columns of the archetypes matching a `query`.
+"""
+import numpy as np
+
+class Archetype(object):
+    def __init__(self, components, schema, capacity=64):
+        self.components = frozenset(components)
+        self.columns = {}
+        for name in self.components:
+            dtype, shape = schema[name]
+            if dtype is not None:
+                self.columns[name] = np.zeros((capacity,) + shape, dtype)
+        self.entities = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def view(self, name):
+        """Column `name` of the entities of the archetype."""
+        return self.columns[name][:self.count]
+
+    def _reserve(self, n):
+        capacity = len(self.entities)
+        if self.count + n <= capacity:
+            return
+        while capacity < self.count + n:
+            capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.zeros((capacity,) + column.shape[1:], column.dtype)
+            grown[:self.count] = column[:self.count]
+            self.columns[name] = grown
+        grown = np.zeros(capacity, dtype=np.int64)
+        grown[:self.count] = self.entities[:self.count]
+        self.entities = grown
+
+    def append(self, entities, values):
+        """Add rows for `entities`, components taken from `values` (arrays
+        or values broadcast to every row), zero by default. Return the
+        rows."""
+        n = len(entities)
+        self._reserve(n)
+        start, end = self.count, self.count + n
+        self.entities[start:end] = entities
+        for name, column in self.columns.items():
+            value = values.get(name)
+            column[start:end] = 0 if value is None else value
+        self.count = end
+        return np.arange(start, end)
+
+    def remove(self, rows):
+        """Remove `rows`, filling the holes with the last rows. Return the
+        (entities, rows) moved."""
+        rows = np.unique(rows)
+        end = self.count - len(rows)
+        holes = rows[rows < end]
+        fillers = np.setdiff1d(np.arange(end, self.count), rows,
+                assume_unique=True)
+        for column in self.columns.values():
+            column[holes] = column[fillers]
+        self.entities[holes] = self.entities[fillers]
+        self.count = end
+        return self.entities[holes], holes
+
+class Registry(object):
+    def __init__(self, capacity=1024):
+        # name: (dtype, shape), dtype None for tags
+        self.schema = {}
+        self.archetypes = {}
+        self._archetypes = []
+        # archetype index and row of every entity id, -1 when dead
+        self._archetype_of = np.full(capacity, -1, dtype=np.int32)
+        self._row_of = np.zeros(capacity, dtype=np.int64)
+        self._next = 0
+        self._free = np.zeros(0, dtype=np.int64)
+
+    def register(self, name, dtype=None, shape=()):
+        """Declare the component `name`, a tag without `dtype`."""
+        if name in self.schema:
+            raise KeyError("Component '%s' already registered" % name)
+        self.schema[name] = (None if dtype is None else np.dtype(dtype),
+                tuple(shape))
+
+    def __len__(self):
+        return sum(archetype.count for archetype in self._archetypes)
+
+    def archetype(self, components):
+        key = frozenset(components)
+        archetype = self.archetypes.get(key)
+        if archetype is None:
+            for name in key:
+                if name not in self.schema:
+                    raise KeyError("Unknown component '%s'" % name)
+            archetype = self.archetypes[key] = Archetype(key, self.schema)
+            archetype.index = len(self._archetypes)
+            self._archetypes.append(archetype)
+        return archetype
+
+    def _ids(self, n):
+        reused, self._free = self._free[:n], self._free[n:]
+        fresh = np.arange(self._next, self._next + n - len(reused))
+        self._next += len(fresh)
+        if self._next > len(self._archetype_of):
+            capacity = max(self._next, 2 * len(self._archetype_of))
+            archetype_of = np.full(capacity, -1, dtype=np.int32)
+            archetype_of[:len(self._archetype_of)] = self._archetype_of
+            row_of = np.zeros(capacity, dtype=np.int64)
+            row_of[:len(self._row_of)] = self._row_of
+            self._archetype_of, self._row_of = archetype_of, row_of
+        return np.concatenate((reused, fresh)).astype(np.int64)
+
+    def spawn(self, n=1, **components):
+        """Create `n` entities with `components` (a value, or an array of
+        `n` values, per component; True for tags). Return their ids."""
+        archetype = self.archetype(components)
+        ids = self._ids(n)
+        rows = archetype.append(ids, components)
+        self._archetype_of[ids] = archetype.index
+        self._row_of[ids] = rows
+        return ids
+
+    def despawn(self, ids):
+        ids = np.unique(np.atleast_1d(np.asarray(ids, dtype=np.int64)))
+        for archetype, rows in list(self.groups(ids)):
+            moved, rows = archetype.remove(rows)
+            self._row_of[moved] = rows
+        self._archetype_of[ids] = -1
+        self._free = np.concatenate((self._free, ids))
+
+    def groups(self, ids):
+        """(archetype, rows) of the entities `ids`, by archetype."""
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        indices = self._archetype_of[ids]
+        if (indices < 0).any():
+            raise KeyError("Dead entities in %s" % ids[indices < 0])
+        for index in np.unique(indices).tolist():
+            yield (self._archetypes[index],
+                    self._row_of[ids[indices == index]])
+
+    def alive(self, entity):
+        return 0 <= entity < self._next and self._archetype_of[entity] >= 0
+
+    def location(self, entity):
+        """(archetype, row) of `entity`."""
+        index = self._archetype_of[entity]
+        if index < 0:
+            raise KeyError("Dead entity %d" % entity)
+        return self._archetypes[index], int(self._row_of[entity])
+
+    def get(self, entity, name):
+        """Component `name` of `entity` (a row view for vectors)."""
+        archetype, row = self.location(entity)
+        return archetype.columns[name][row]
+
+    def set(self, entity, name, value):
+        archetype, row = self.location(entity)
+        archetype.columns[name][row] = value
+
+    def change(self, entity, remove=(), **components):
+        """Move `entity` to the archetype without `remove` and with
+        `components`, keeping its other components."""
+        archetype, row = self.location(entity)
+        names = (archetype.components - set(remove)) | set(components)
+        values = dict((name, column[row].copy())
+                for name, column in archetype.columns.items()
+                if name in names)
+        values.update(components)
+        target = self.archetype(names)
+        moved, rows = archetype.remove([row])
+        self._row_of[moved] = rows
+        self._row_of[entity] = target.append([entity], values)[0]
+        self._archetype_of[entity] = target.index
+
+    def query(self, *names):
+        """Non empty archetypes having all the components `names`."""
+        wanted = set(names)
+        return [archetype for archetype in self._archetypes
+                if archetype.count and wanted <= archetype.components]
@@ -1,6 +1,10 @@
 import math
+import numbers
+import numpy as np
 
 class Vector(object):
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         self.x, self.y = x, y
 
@@ -13,19 +17,156 @@ class Vector(object):
     def __mul__(self, coef):
         return Vector(self.x*coef, self.y*coef)
 
+    __rmul__ = __mul__
+
+    def __iadd__(self, v):
+        self.x += v.x
+        self.y += v.y
+        return self
+
+    def __isub__(self, v):
+        self.x -= v.x
+        self.y -= v.y
+        return self
+
+    def __imul__(self, coef):
+        self.x *= coef
+        self.y *= coef
+        return self
+
     def __eq__(self, v):
-        return self.x, self.y == v.x, v.y
+        if not isinstance(v, Vector):
+            return NotImplemented
+        return self.x == v.x and self.y == v.y
 
-    def __hash__(self):
-        return hash((self.x, self.y))
+    def __ne__(self, v):
+        if not isinstance(v, Vector):
+            return NotImplemented
+        return not self == v
 
-    def __len__(self):
-        return math.sqrt(self.x**2, self.y**2)
+    # mutable (in-place operators), so not hashable
+    __hash__ = None
+
+    def magnitude(self):
+        return math.hypot(self.x, self.y)
+
+    def set(self, x, y):
+        self.x, self.y = x, y
 
     def __iter__(self):
         return iter((self.x, self.y))
 
+    def __repr__(self):
+        return 'Vector(%r, %r)' % (self.x, self.y)
+
 class AABB(object):
+    __slots__ = ('position', 'size')
+
     def __init__(self, x, y, size):
         self.position = Vector(x, y)
         self.size = Vector(*size)
+
+    def overlaps(self, other):
+        return (self.position.x < other.position.x + other.size.x
+                and other.position.x < self.position.x + self.size.x
+                and self.position.y < other.position.y + other.size.y
+                and other.position.y < self.position.y + self.size.y)
+
+class VectorArray(object):
+    """Array of vectors, stored as a (n, 2) float array in `data`.
+
+    Arithmetic applies to every vector at once, and in-place operators
+    don't allocate.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=float).reshape(-1, 2)
+
+    @classmethod
+    def zeros(cls, n):
+        return cls(np.zeros((n, 2)))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if isinstance(i, numbers.Integral):
+            return Vector(*self.data[i].tolist())
+        return VectorArray(self.data[i])
+
+    def __setitem__(self, i, v):
+        self.data[i] = tuple(v) if isinstance(v, Vector) else _data(v)
+
+    def __iter__(self):
+        return (Vector(x, y) for x, y in self.data.tolist())
+
+    def __add__(self, v):
+        return VectorArray(self.data + _data(v))
+
+    def __sub__(self, v):
+        return VectorArray(self.data - _data(v))
+
+    def __mul__(self, coef):
+        return VectorArray(self.data * _data(coef))
+
+    def __iadd__(self, v):
+        self.data += _data(v)
+        return self
+
+    def __isub__(self, v):
+        self.data -= _data(v)
+        return self
+
+    def __imul__(self, coef):
+        self.data *= _data(coef)
+        return self
+
+    @property
+    def x(self):
+        return self.data[:, 0]
+
+    @property
+    def y(self):
+        return self.data[:, 1]
+
+    def magnitudes(self):
+        return np.hypot(self.data[:, 0], self.data[:, 1])
+
+def _data(v):
+    """Operand as something NumPy broadcasts against a (n, 2) array."""
+    if isinstance(v, VectorArray):
+        return v.data
+    elif isinstance(v, Vector):
+        return v.x, v.y
+    return v
+
+class AABBArray(object):
+    """Array of AABBs, as `positions` and `sizes` vector arrays."""
+    __slots__ = ('positions', 'sizes')
+
+    def __init__(self, positions, sizes):
+        self.positions = positions if isinstance(positions, VectorArray) \
+                else VectorArray(positions)
+        self.sizes = sizes if isinstance(sizes, VectorArray) \
+                else VectorArray(sizes)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, i):
+        if isinstance(i, numbers.Integral):
+            (x, y), size = self.positions.data[i].tolist(), \
+                    self.sizes.data[i].tolist()
+            return AABB(x, y, size)
+        return AABBArray(self.positions.data[i], self.sizes.data[i])
+
+    def overlaps(self, other):
+        """Boolean mask of the AABBs overlapping `other`, either an AABB or
+        an AABBArray of the same length (compared element-wise)."""
+        if isinstance(other, AABB):
+            other = AABBArray(np.array([tuple(other.position)]),
+                    np.array([tuple(other.size)]))
+        p, s = self.positions.data, self.sizes.data
+        q, t = other.positions.data, other.sizes.data
+        return ((p < q + t) & (q < p + s)).all(axis=1)
@@ -0,0 +1,160 @@
+"""Collision masks of animation frames, from their alpha channel.
+
+The mask of a frame is the tight bounding box of its pixels opaque enough
+to collide (`config.Hitbox['alpha']`), and one Python integer per row of
+that box, bit i set when the pixel of column i is solid: testing two
+masks for overlap ANDs whole rows at once, after an AABB reject.
+
+Masks are computed once per clip and cached in `config.Hitbox['cache']`,
+rebuilt when its images change, and stored in the animation bundle. They
+are loaded on the first hit test of a clip, decoding its frames if they
+aren't cached yet: build them all offline with `python hitbox.py`.
+"""
+from __future__ import print_function
+import binascii
+import json
+import os
+import numpy as np
+import png
+from atlas import _hash, _makedirs, _write_json
+from bundle import Bundle, _clip_files
+from config import Animations as animations_config, Bundle as bundle_config, \
+        Hitbox as config
+
+class Mask(object):
+    """Solid pixels of a frame: box (x, y, w, h) in the frame, and `rows`,
+    bit i of a row being column x + i."""
+    __slots__ = ('x', 'y', 'w', 'h', 'rows')
+
+    def __init__(self, x, y, w, h, rows):
+        self.x, self.y, self.w, self.h = x, y, w, h
+        self.rows = rows
+
+    @classmethod
+    def from_alpha(cls, solid):
+        """Mask of the (height, width) bool array `solid`."""
+        ys, xs = np.nonzero(solid)
+        if not len(ys):
+            return cls(0, 0, 0, 0, [])
+        x, y = int(xs.min()), int(ys.min())
+        w, h = int(xs.max()) + 1 - x, int(ys.max()) + 1 - y
+        packed = np.packbits(solid[y:y + h, x:x + w], axis=1,
+                bitorder='little')
+        # bytes in reverse, most significant first, for hexlify
+        rows = [int(binascii.hexlify(row[::-1].tobytes()), 16)
+                for row in packed]
+        return cls(x, y, w, h, rows)
+
+    def __bool__(self):
+        return any(self.rows)
+
+    __nonzero__ = __bool__
+
+    def bounds(self, x, y):
+        """World rectangle (x, y, w, h) of the mask of a frame at (x, y)."""
+        return (x + self.x, y + self.y, self.w, self.h)
+
+    def difference(self, other):
+        """Pixels of this mask not in `other` (of a frame of the same
+        clip)."""
+        dx = other.x - self.x
+        rows = []
+        for i, row in enumerate(self.rows):
+            j = self.y + i - other.y
+            if 0 <= j < other.h:
+                theirs = other.rows[j]
+                theirs = theirs << dx if dx >= 0 else theirs >> -dx
+                row &= ~theirs
+            rows.append(row)
+        return Mask(self.x, self.y, self.w, self.h, rows).trimmed()
+
+    def trimmed(self):
+        """Same pixels, in their tight box."""
+        used = [i for i, row in enumerate(self.rows) if row]
+        if not used:
+            return Mask(0, 0, 0, 0, [])
+        rows = self.rows[used[0]:used[-1] + 1]
+        merged = 0
+        for row in rows:
+            merged |= row
+        # lowest and highest bits set
+        left = (merged & -merged).bit_length() - 1
+        right = merged.bit_length()
+        return Mask(self.x + left, self.y + used[0], right - left, len(rows),
+                [row >> left for row in rows])
+
+    def dump(self):
+        return [self.x, self.y, self.w, self.h,
+                ['%x' % row for row in self.rows]]
+
+    @classmethod
+    def load(cls, values):
+        x, y, w, h, rows = values
+        return cls(x, y, w, h, [int(row, 16) for row in rows])
+
+def overlap(a, ax, ay, b, bx, by):
+    """Whether mask `a` of a frame at (ax, ay) and mask `b` of a frame at
+    (bx, by) have a solid pixel in common."""
+    ax, ay = int(round(ax)) + a.x, int(round(ay)) + a.y
+    bx, by = int(round(bx)) + b.x, int(round(by)) + b.y
+    if not (ax < bx + b.w and bx < ax + a.w and ay < by + b.h
+            and by < ay + a.h):
+        return False
+    dx = bx - ax
+    top, bottom = max(ay, by), min(ay + a.h, by + b.h)
+    rows_a = a.rows[top - ay:bottom - ay]
+    rows_b = b.rows[top - by:bottom - by]
+    if dx >= 0:
+        for row_a, row_b in zip(rows_a, rows_b):
+            if row_a & (row_b << dx):
+                return True
+    else:
+        for row_a, row_b in zip(rows_a, rows_b):
+            if (row_a << -dx) & row_b:
+                return True
+    return False
+
+def build(key, alpha=None):
+    """Compute the masks of the frames of the clip `key` and store them,
+    unless they're up to date. Return them."""
+    alpha = config['alpha'] if alpha is None else alpha
+    filename = os.path.join(config['cache'], key + '.hitbox')
+    files = _clip_files(key)
+    source = _hash(files)
+    if os.path.exists(filename):
+        with open(filename) as f:
+            stored = json.load(f)
+        if stored['source'] == source and stored['alpha'] == alpha:
+            return [Mask.load(values) for values in stored['frames']]
+    masks = [Mask.from_alpha(png.read(f)[..., 3] >= alpha) for f in files]
+    _makedirs(config['cache'])
+    _write_json(filename, {'source': source, 'alpha': alpha,
+        'frames': [mask.dump() for mask in masks]})
+    return masks
+
+_masks = {}
+_bundle = None
+
+def masks(key):
+    """Masks of the frames of the clip `key`, loaded once: from the bundle
+    when the images aren't there."""
+    global _bundle
+    found = _masks.get(key)
+    if found is None:
+        if os.path.isdir(os.path.join(animations_config['dir'], key)):
+            found = build(key)
+        else:
+            if _bundle is None:
+                _bundle = Bundle(bundle_config['file'])
+            found = _bundle.masks(key)
+        _masks[key] = found
+    return found
+
+if __name__ == '__main__':
+    directory = animations_config['dir']
+    for key in sorted(os.listdir(directory)):
+        if os.path.isdir(os.path.join(directory, key)):
+            built = build(key)
+            print('%s: %d frames, %d solid pixels' % (key, len(built),
+                sum(bin(row).count('1') for mask in built
+                    for row in mask.rows)))
@@ -0,0 +1,425 @@
+"""Networked play: an authoritative headless server and its clients, over
+UDP.
+
+Clients send the buttons they hold every tick. The server simulates every
+player and, `snapshot_rate` times per second, sends each client the state
+of the entities (quantized position, state id and animation frame) as a
+delta against the last snapshot that client acknowledged. Clients render
+the entities `interpolation` seconds in the past, between the two
+snapshots around that time.
+
+Packets (little endian)::
+
+    input     type 1 (B), sequence number (I), acknowledged snapshot tick
+              (I), buttons (B)
+    snapshot  type 2 (B), tick (I), base tick (I, NO_BASE for none),
+              client entity (H), changed count (H), removed count (H),
+              then per changed entity: id (H), field mask (B) and the
+              fields of the mask, x and y (h, quantized), state and frame
+              (B), then the removed ids (H)
+
+Inputs older than the last one received from a client (reordered by the
+network) are dropped. Positions are sent as int16, so the world of the
+server must fit in their range at the configured precision.
+
+`Channel` can simulate latency, jitter and loss on what it sends, to test
+on localhost.
+"""
+import errno
+import heapq
+import random
+import socket
+import struct
+import app
+import physics
+import player
+import config as _config
+from config import Net as config
+
+INPUT = 1
+SNAPSHOT = 2
+NO_BASE = 0xffffffff
+
+# buttons
+LEFT = 1
+RIGHT = 2
+JUMP = 4
+ATTACK = 8
+
+_input = struct.Struct('<BIIB')
+_snapshot = struct.Struct('<BIIHHH')
+_entity = struct.Struct('<HB')
+_id = struct.Struct('<H')
+# entity fields: x, y, state id, frame
+_codes = 'hhBB'
+_fields = tuple(struct.Struct('<' + code) for code in _codes)
+# entity header and fields, by field mask
+_masks = [struct.Struct('<HB' + ''.join(code for i, code in enumerate(_codes)
+    if mask & 1 << i)) for mask in range(1 << len(_codes))]
+
+_wouldblock = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+def check_range(world, precision=config['precision']):
+    """Raise ValueError unless the positions of the bounds of `world` fit
+    in quantized positions."""
+    x, y = world.position
+    w, h = world.size
+    extent = max(abs(x), abs(x + w), abs(y), abs(y + h))
+    if extent * precision > 32767:
+        raise ValueError("World bounds up to %g pixels out of the range of"
+                " positions (%d pixels at precision %d)"
+                % (extent, 32767 // precision, precision))
+
+def quantize(model, precision=config['precision']):
+    """Entity state of `model`: x, y (in 1/`precision` pixels), active
+    state id and animation frame."""
+    x, y = model.physics.position
+    return (max(-32768, min(32767, int(round(x * precision)))),
+            max(-32768, min(32767, int(round(y * precision)))),
+            model.active_id, model.animation.index)
+
+def encode_delta(state, base):
+    """Changed and removed entities of `state` against `base`, both
+    {id: entity state} dicts. Return the counts and the encoded entities."""
+    parts = []
+    for entity, values in state.items():
+        old = base.get(entity)
+        if old == values:
+            continue
+        mask = 0
+        fields = []
+        for i, value in enumerate(values):
+            if old is None or old[i] != value:
+                mask |= 1 << i
+                fields.append(value)
+        parts.append(_masks[mask].pack(entity, mask, *fields))
+    changed = len(parts)
+    removed = [entity for entity in base if entity not in state]
+    parts.extend(_id.pack(entity) for entity in removed)
+    return changed, len(removed), b''.join(parts)
+
+def decode_delta(data, pos, changed, removed, base):
+    """State encoded at `pos` of `data` by `encode_delta`, against `base`."""
+    state = dict(base)
+    for _ in range(changed):
+        entity, mask = _entity.unpack_from(data, pos)
+        pos += _entity.size
+        values = list(state.get(entity, (0, 0, 0, 0)))
+        for i, field in enumerate(_fields):
+            if mask & 1 << i:
+                values[i], = field.unpack_from(data, pos)
+                pos += field.size
+        state[entity] = tuple(values)
+    for _ in range(removed):
+        entity, = _id.unpack_from(data, pos)
+        pos += _id.size
+        state.pop(entity, None)
+    return state
+
+class Channel(object):
+    """Non-blocking UDP socket. What is sent may be delayed by `latency`
+    plus or minus `jitter` seconds, and dropped with a probability of
+    `loss`; delayed packets are sent by `pump`."""
+    def __init__(self, address=('127.0.0.1', 0), latency=0., jitter=0.,
+            loss=0., seed=None, clock=app._clock):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self._queue = []
+        self._sequence = 0
+
+    def send(self, data, address):
+        self.packets_sent += 1
+        self.bytes_sent += len(data)
+        if self.loss and self.rng.random() < self.loss:
+            self.packets_dropped += 1
+            return
+        delay = self.latency
+        if self.jitter:
+            delay += self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            heapq.heappush(self._queue, (self.clock() + delay, self._sequence,
+                data, address))
+            self._sequence += 1
+        else:
+            self._sendto(data, address)
+
+    def pump(self):
+        queue, now = self._queue, self.clock()
+        while queue and queue[0][0] <= now:
+            _, _, data, address = heapq.heappop(queue)
+            self._sendto(data, address)
+
+    def _sendto(self, data, address):
+        try:
+            self.socket.sendto(data, address)
+        except socket.error:
+            # full buffers drop packets, as the network would
+            self.packets_dropped += 1
+
+    def receive(self):
+        """Packets received, as (data, address) pairs."""
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65535)
+            except socket.error as e:
+                if e.args[0] in _wouldblock:
+                    return
+                # ICMP errors of earlier sends, on some platforms
+                continue
+            self.bytes_received += len(data)
+            yield data, address
+
+    def close(self):
+        self.socket.close()
+
+class _Peer(object):
+    __slots__ = ('address', 'entity', 'model', 'buttons', 'sequence', 'ack',
+            'last_seen', 'bytes_sent')
+
+    def __init__(self, address, entity, model, tick):
+        self.address = address
+        self.entity = entity
+        self.model = model
+        self.buttons = 0
+        # of the last input applied
+        self.sequence = -1
+        self.ack = NO_BASE
+        self.last_seen = tick
+        self.bytes_sent = 0
+
+class Server(app.App):
+    """Authoritative simulation: one `player.Model` per client, created on
+    its first input and dropped after `timeout` seconds of silence."""
+    headless = True
+
+    def __init__(self, address=config['address'], channel=None, world=None):
+        super(Server, self).__init__(
+                tick_rate=_config.Physics['tick_rate'],
+                max_catchup=_config.Physics['max_catchup'])
+        self.channel = channel or Channel(address)
+        self.world = world or physics.World()
+        check_range(self.world)
+        self.peers = {}
+        # tick: {entity: entity state}, of the snapshots kept as bases
+        self.history = {}
+        self.snapshot_every = max(1, int(round(float(self.tick_rate)
+            / config['snapshot_rate'])))
+        self.timeout = int(config['timeout'] * self.tick_rate)
+        self._next_entity = 0
+
+    def update(self):
+        self.channel.pump()
+        for data, address in self.channel.receive():
+            self._receive(data, address)
+        models = []
+        for peer in list(self.peers.values()):
+            if self.ticks - peer.last_seen > self.timeout:
+                self._disconnect(peer)
+            else:
+                models.append(peer.model)
+        if models:
+            player.update_all(models, self.world, self.tick_duration)
+        if self.ticks % self.snapshot_every == 0:
+            self._send_snapshots()
+
+    def _receive(self, data, address):
+        if len(data) != _input.size:
+            return
+        kind, sequence, ack, buttons = _input.unpack(data)
+        if kind != INPUT:
+            return
+        peer = self.peers.get(address)
+        if peer is None:
+            peer = self._connect(address)
+        elif sequence <= peer.sequence:
+            return
+        peer.sequence = sequence
+        if ack != NO_BASE and (peer.ack == NO_BASE or ack > peer.ack):
+            peer.ack = ack
+        peer.last_seen = self.ticks
+        self._apply(peer.model, peer.buttons, buttons)
+        peer.buttons = buttons
+
+    def _apply(self, model, previous, buttons):
+        """Send the controls of `buttons` to `model`, as demo.Game does for
+        the keyboard."""
+        if buttons & LEFT:
+            model.control(player.Controls.LEFT)
+        elif buttons & RIGHT:
+            model.control(player.Controls.RIGHT)
+        else:
+            model.control(player.Controls.RIGHT, False)
+            model.control(player.Controls.LEFT, False)
+        pressed = buttons & ~previous
+        if pressed & JUMP:
+            model.control(player.Controls.JUMP)
+        elif pressed & ATTACK:
+            model.control(player.Controls.ATTACK)
+
+    def _connect(self, address):
+        entity = self._next_entity
+        self._next_entity = (entity + 1) & 0xffff
+        peer = _Peer(address, entity, player.Model(self.world), self.ticks)
+        self.peers[address] = peer
+        return peer
+
+    def _disconnect(self, peer):
+        del self.peers[peer.address]
+        peer.model.remove()
+
+    def _send_snapshots(self):
+        tick = self.ticks
+        state = dict((peer.entity, quantize(peer.model))
+                for peer in self.peers.values())
+        history = self.history
+        history[tick] = state
+        history.pop(tick - config['history'] * self.snapshot_every, None)
+        # clients acknowledging the same base get the same entities
+        encoded = {}
+        for peer in self.peers.values():
+            base = peer.ack if peer.ack in history else NO_BASE
+            delta = encoded.get(base)
+            if delta is None:
+                delta = encoded[base] = encode_delta(state,
+                        history.get(base, {}))
+            changed, removed, entities = delta
+            packet = _snapshot.pack(SNAPSHOT, tick, base, peer.entity,
+                    changed, removed) + entities
+            self.channel.send(packet, peer.address)
+            peer.bytes_sent += len(packet)
+
+class Client(app.App):
+    """Sends the buttons held every tick (from the keyboard, or from
+    `controller(tick)`), and draws the entities of the server snapshots."""
+    def __init__(self, server=config['address'], channel=None,
+            controller=None, window=True):
+        super(Client, self).__init__(
+                tick_rate=_config.Physics['tick_rate'],
+                max_catchup=_config.Physics['max_catchup'])
+        self.server = tuple(server)
+        self.channel = channel or Channel()
+        self.controller = controller
+        # tick: {entity: entity state}, of the snapshots usable as bases
+        self.snapshots = {}
+        # (tick, state) of the snapshots to interpolate, by tick
+        self.timeline = []
+        self.entity = None
+        self.latest = None
+        self.server_tick = 0
+        self.sequence = 0
+        self.delay = config['interpolation'] * self.tick_rate
+        if window:
+            player.Model.machine.load()
+            self.create_window(title=_config.Window['title'],
+                    size=_config.Window['size'], fps=_config.Window['fps'])
+
+    def buttons(self):
+        if self.controller is not None:
+            return self.controller(self.ticks)
+        buttons = 0
+        if self.is_pressed('left'):
+            buttons |= LEFT
+        elif self.is_pressed('right'):
+            buttons |= RIGHT
+        if self.is_pressed(_config.Keyboard['jump']):
+            buttons |= JUMP
+        if self.is_pressed(_config.Keyboard['vomit']):
+            buttons |= ATTACK
+        return buttons
+
+    def update(self):
+        self.channel.pump()
+        for data, address in self.channel.receive():
+            if address == self.server:
+                self._receive(data)
+        self.server_tick += 1
+        ack = NO_BASE if self.latest is None else self.latest
+        self.channel.send(_input.pack(INPUT, self.sequence, ack,
+            self.buttons()), self.server)
+        self.sequence += 1
+        # keep a single snapshot before the rendered time
+        timeline, render_tick = self.timeline, self.server_tick - self.delay
+        while len(timeline) > 2 and timeline[1][0] <= render_tick:
+            del timeline[0]
+
+    def _receive(self, data):
+        if len(data) < _snapshot.size:
+            return
+        kind, tick, base_tick, entity, changed, removed = \
+                _snapshot.unpack_from(data)
+        if kind != SNAPSHOT or (self.latest is not None
+                and tick <= self.latest):
+            return
+        if base_tick == NO_BASE:
+            base = {}
+        else:
+            base = self.snapshots.get(base_tick)
+            if base is None:
+                return
+        state = decode_delta(data, _snapshot.size, changed, removed, base)
+        # later snapshots are based on this base or a later one
+        for old in [t for t in self.snapshots if t < base_tick]:
+            del self.snapshots[old]
+        self.snapshots[tick] = state
+        self.timeline.append((tick, state))
+        self.latest = tick
+        self.entity = entity
+        self.server_tick = max(self.server_tick, tick)
+
+    def interpolate(self, tick):
+        """Entities at server `tick`, as {entity: (x, y, state id, frame)},
+        positions in pixels. Entities are held at their first and last
+        known state out of the received range."""
+        timeline = self.timeline
+        if not timeline:
+            return {}
+        a = b = timeline[0]
+        for snapshot in timeline[1:]:
+            if snapshot[0] > tick:
+                b = snapshot
+                break
+            a = b = snapshot
+        f = 0. if b[0] == a[0] else (tick - a[0]) / float(b[0] - a[0])
+        f = max(0., min(1., f))
+        precision = float(config['precision'])
+        entities = {}
+        for entity, (x, y, state_id, frame) in b[1].items():
+            old = a[1].get(entity)
+            if old is not None:
+                x = old[0] + (x - old[0]) * f
+                y = old[1] + (y - old[1]) * f
+                state_id, frame = (old[2], old[3]) if f < .5 \
+                        else (state_id, frame)
+            entities[entity] = (x / precision, y / precision, state_id,
+                    frame)
+        return entities
+
+    def render_to(self, window, alpha=1.):
+        graphics = window.graphics
+        states = player.Model.machine.states
+        tick = self.server_tick - 1 + alpha - self.delay
+        for x, y, state_id, frame in self.interpolate(tick).values():
+            frames = states[state_id].clip.frames
+            graphics.push_state()
+            graphics.translate(x, y)
+            graphics.draw(frames[frame % len(frames)])
+            graphics.pop_state()
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['server']:
+        app.use_backend('null')
+        Server().run()
+    else:
+        Client().run()
@@ -0,0 +1,215 @@
+"""Headless backend: no display, no decoding, no drawing.
+
+Key codes are the readable key names themselves, and the keyboard state is
+driven with `press` and `release` (joysticks with `set_joystick`) so that
+games can be scripted.
+"""
+import struct
+import time
+
+_keys = tuple('abcdefghijklmnopqrstuvwxyz') + ('up', 'down', 'left', 'right',
+        'space', 'enter', 'escape', 'alt', 'ctrl', 'shift')
+
+# of the screen vsync would wait for
+REFRESH_RATE = 60
+
+# Mapping to readable key
+key_mapping = dict((key, key) for key in _keys)
+
+_pressed = set()
+# id: (pressed buttons, (x, y) stick position in [-100, 100])
+joysticks = {}
+
+def press(key):
+    _pressed.add(key)
+
+def release(key):
+    _pressed.discard(key)
+
+def set_joystick(joystick, buttons=(), axes=(0, 0)):
+    joysticks[joystick] = (tuple(buttons), tuple(axes))
+
+def is_key_pressed(code):
+    return code in _pressed
+
+def pressed_keys():
+    return _pressed
+
+def read_joystick(joystick):
+    return joysticks.get(joystick)
+
+def color(r, g, b, a=255):
+    return r, g, b, a
+
+class Window(object):
+    def __init__(self, size, title, fps, icon, closable, resizable, mouse,
+            vsync, fullscreen, enable_key_repeat):
+        self.width, self.height = size
+        self.title = title
+        self.framerate_limit = fps
+        self.vsync = vsync
+        self.pending_events = []
+        self.draw_calls = 0
+        self._opened = True
+        self._last_display = None
+
+    def push_event(self, kind, code=None):
+        self.pending_events.append((kind, code))
+
+    def events(self):
+        events, self.pending_events = self.pending_events, []
+        return iter(events)
+
+    def set_framerate_limit(self, fps):
+        self.framerate_limit = fps
+
+    def set_vsync(self, vsync):
+        self.vsync = vsync
+
+    def mouse_position(self):
+        return 0, 0
+
+    def set_active(self, active):
+        pass
+
+    def display(self):
+        # mimic the frame limiter, or vsync, so that realtime runs keep
+        # their pace
+        limit = self.framerate_limit or (REFRESH_RATE if self.vsync else 0)
+        if limit:
+            now = time.time()
+            if self._last_display is not None:
+                delay = 1. / limit - (now - self._last_display)
+                if delay > 0:
+                    time.sleep(delay)
+                    now += delay
+            self._last_display = now
+
+    def clear(self):
+        pass
+
+    def close(self):
+        self._opened = False
+
+    def is_opened(self):
+        return self._opened
+
+    def draw(self, drawable, x, y, scale=1.):
+        self.draw_calls += 1
+
+    def get_width(self):
+        return self.width
+
+    def set_width(self, w):
+        self.width = w
+
+    def get_height(self):
+        return self.height
+
+    def set_height(self, h):
+        self.height = h
+
+class RenderTexture(object):
+    def __init__(self, size):
+        self.size = size
+        self.texture = Texture(size)
+        self.draw_calls = 0
+
+    def draw(self, drawable, x, y, scale=1.):
+        self.draw_calls += 1
+
+    def clear(self):
+        pass
+
+    def clear_rect(self, rect):
+        pass
+
+    def clip(self, rect):
+        pass
+
+    def unclip(self):
+        pass
+
+    def display(self):
+        pass
+
+class SpriteBatch(object):
+    """Counts quads, one draw call per texture on `flush`."""
+    def __init__(self):
+        self.textures = set()
+        self.quads = 0
+
+    def add(self, texture, rect, x, y, scale=1.):
+        self.textures.add(id(texture))
+        self.quads += 1
+
+    def flush(self, window):
+        window.draw_calls += len(self.textures)
+        self.textures.clear()
+        self.quads = 0
+
+class Texture(object):
+    """Stand-in for a texture, only knows its size."""
+    __slots__ = ('size',)
+
+    def __init__(self, size):
+        self.size = size
+
+class Sprite(object):
+    """Stand-in for a sprite, a rectangle of a texture."""
+    __slots__ = ('texture', 'rect')
+
+    def __init__(self, texture, rect):
+        self.texture = texture
+        self.rect = rect
+
+class Rectangle(object):
+    """Stand-in for a filled rectangle."""
+    __slots__ = ('size', 'color')
+
+    def __init__(self, size, color):
+        self.size = size
+        self.color = color
+
+def create_rectangle(size, color):
+    return Rectangle(size, color)
+
+def _png_size(header):
+    if header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        raise IOError("Not a PNG image")
+    return struct.unpack('>II', header[16:24])
+
+def image_size(filename):
+    with open(filename, 'rb') as f:
+        return _png_size(f.read(24))
+
+def load_texture(filename):
+    return Texture(image_size(filename))
+
+def decode_image(filename):
+    return Texture(image_size(filename))
+
+def decode_image_memory(data):
+    return Texture(_png_size(bytes(data[:24])))
+
+def image_pixels(filename):
+    # images aren't decoded, nor compared
+    return None
+
+def texture_size(texture):
+    return texture.size
+
+def create_sprite(texture, rect=None):
+    if rect is None:
+        rect = (0, 0) + tuple(texture.size)
+    return Sprite(texture, rect)
+
+def compose_image(size, blits):
+    return Texture(size)
+
+def texture_from_image(image):
+    return image
+
+def save_image(image, filename):
+    # nothing to save, atlases are not cached
+    pass
@@ -1,43 +1,436 @@
-from geometry import Vector, AABB
+import numpy as np
+from geometry import Vector, AABB, AABBArray
 from config import Physics as config
 
-class _World(AABB):
-    """_world object."""
-    def __init__(self):
+class _VectorView(object):
+    """Vector-like view on a component's row of one of the world arrays."""
+    __slots__ = ('_owner', '_field')
+
+    def __init__(self, owner, field):
+        self._owner, self._field = owner, field
+
+    def _row(self):
+        owner = self._owner
+        return getattr(owner.world, self._field)[owner.index]
+
+    def _get_x(self):
+        return self._row()[0]
+
+    def _set_x(self, x):
+        self._row()[0] = x
+
+    def _get_y(self):
+        return self._row()[1]
+
+    def _set_y(self, y):
+        self._row()[1] = y
+
+    x = property(_get_x, _set_x)
+    y = property(_get_y, _set_y)
+
+    def __iadd__(self, v):
+        row = self._row()
+        row[0] += v.x
+        row[1] += v.y
+        return self
+
+    def __isub__(self, v):
+        row = self._row()
+        row[0] -= v.x
+        row[1] -= v.y
+        return self
+
+    def __iter__(self):
+        return iter(self._row().tolist())
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self._field, self.x, self.y)
+
+class World(AABB):
+    """Physics world, holding the state of every body in contiguous arrays.
+
+    Bodies are rows of the `positions`, `velocities`, `accelerations`,
+    `sizes`, `previous` and `contacts` arrays; only the first `count` rows
+    are in use, and `update` integrates all of them in one vectorized step.
+    """
+    def __init__(self, offset=config['offset'], size=config['size'],
+            gravity=config['gravity'], capacity=64):
         """Set config values for world AABB."""
-        AABB.__init__(self, config['offset'][0],
-                config['offset'][1], config['size'])
-        self.gravity = Vector(*config['gravity'])
-
-    def resolve(self, c):
-        if c.position.x < self.position.x:
-            c.position.x = self.position.x
-            c.velocity.x = 0
-        elif c.position.x + c.size.x > self.position.x + self.size.x:
-            c.position.x = self.position.x + self.size.x - c.size.x
-            c.velocity.x = 0
-        if c.position.y + c.size.y > self.position.y + self.size.y:
-            c.position.y = self.position.y + self.size.y - c.size.y
-            c.velocity.y = 0
-            c.acceleration.x, c.acceleration.y = self.gravity
-            c.contact = True
-_world = _World()
+        AABB.__init__(self, offset[0], offset[1], size)
+        self.gravity = Vector(*gravity)
+        self.count = 0
+        self.components = []
+        self.by_id = {}
+        self.collisions = None
+        self.tilemap = None
+        self._next_id = 0
+        self.positions = np.zeros((capacity, 2))
+        self.previous = np.zeros((capacity, 2))
+        self.velocities = np.zeros((capacity, 2))
+        self.accelerations = np.zeros((capacity, 2))
+        self.sizes = np.zeros((capacity, 2))
+        self.contacts = np.zeros(capacity, dtype=bool)
+        # stable body ids, indices change when bodies are removed
+        self.ids = np.zeros(capacity, dtype=np.int64)
+
+    _fields = ('positions', 'previous', 'velocities', 'accelerations',
+            'sizes', 'contacts', 'ids')
+
+    def enable_collisions(self, cell_size=64):
+        """Collide bodies against each other on `update`."""
+        self.collisions = Collisions(self, cell_size)
+        return self.collisions
+
+    def _grow(self):
+        capacity = 2 * len(self.positions)
+        for field in self._fields:
+            old = getattr(self, field)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, field, new)
+
+    def add(self, component, size, x=0, y=0, vx=0, vy=0, ax=0, ay=0):
+        """Add a body, return its index."""
+        if self.count == len(self.positions):
+            self._grow()
+        i = self.count
+        self.positions[i] = self.previous[i] = x, y
+        self.velocities[i] = vx, vy
+        self.accelerations[i] = ax, ay
+        self.sizes[i] = size
+        self.contacts[i] = False
+        self.ids[i] = self._next_id
+        self.by_id[self._next_id] = component
+        self._next_id += 1
+        self.components.append(component)
+        self.count += 1
+        return i
+
+    def remove(self, component):
+        """Remove a body, the last body takes its index."""
+        i, last = component.index, self.count - 1
+        if self.collisions is not None:
+            self.collisions.discard(int(self.ids[i]))
+        del self.by_id[int(self.ids[i])]
+        if i != last:
+            for field in self._fields:
+                array = getattr(self, field)
+                array[i] = array[last]
+            moved = self.components[last]
+            moved.index = i
+            self.components[i] = moved
+        self.components.pop()
+        self.count -= 1
+        component.index = None
+
+    def update(self):
+        """Integrate every body, collide them with the tilemap if any,
+        resolve them against the world, then collide them with each other
+        if enabled (bodies resting on the ground staying put)."""
+        n = self.count
+        self.previous[:n] = self.positions[:n]
+        self.contacts[:n] = False
+        self.velocities[:n] += self.accelerations[:n]
+        self.positions[:n] += self.velocities[:n]
+        if self.tilemap is not None:
+            self.tilemap.collide(self)
+        self.resolve()
+        if self.collisions is not None:
+            self.collisions.update()
+
+    def resolve(self):
+        """Clamp every body inside the world bounds."""
+        n = self.count
+        p, v = self.positions[:n], self.velocities[:n]
+        s = self.sizes[:n]
+        left = self.position.x
+        right = self.position.x + self.size.x
+        bottom = self.position.y + self.size.y
+        px, vx = p[:, 0], v[:, 0]
+        under = px < left
+        px[under] = left
+        vx[under] = 0
+        over = ~under & (px + s[:, 0] > right)
+        px[over] = right - s[over, 0]
+        vx[over] = 0
+        floor = p[:, 1] + s[:, 1] > bottom
+        p[floor, 1] = bottom - s[floor, 1]
+        v[floor, 1] = 0
+        self.accelerations[:n][floor] = self.gravity.x, self.gravity.y
+        self.contacts[:n][floor] = True
+
+    def update_body(self, i):
+        """Integrate a single body, collide it with the tilemap if any, then
+        resolve it against the world, with scalar arithmetic."""
+        px, py = self.positions[i].tolist()
+        vx, vy = self.velocities[i].tolist()
+        ax, ay = self.accelerations[i].tolist()
+        sx, sy = self.sizes[i].tolist()
+        self.previous[i] = px, py
+        contact = False
+        vx += ax
+        vy += ay
+        px += vx
+        py += vy
+        if self.tilemap is not None:
+            self.positions[i] = px, py
+            self.velocities[i] = vx, vy
+            self.contacts[i] = False
+            self.tilemap.collide_body(self, i)
+            px, py = self.positions[i].tolist()
+            vx, vy = self.velocities[i].tolist()
+            ax, ay = self.accelerations[i].tolist()
+            contact = bool(self.contacts[i])
+        if px < self.position.x:
+            px = self.position.x
+            vx = 0
+        elif px + sx > self.position.x + self.size.x:
+            px = self.position.x + self.size.x - sx
+            vx = 0
+        if py + sy > self.position.y + self.size.y:
+            py = self.position.y + self.size.y - sy
+            vy = 0
+            ax, ay = self.gravity
+            contact = True
+        self.positions[i] = px, py
+        self.velocities[i] = vx, vy
+        self.accelerations[i] = ax, ay
+        self.contacts[i] = contact
+_world = World()
+
+def cell_key(cx, cy):
+    """Integer key of the grid cell (cx, cy), int64 arrays or ints."""
+    return (cx << 32) + (cy + (1 << 31))
+
+def grid_cells(p, s, cell_size):
+    """(body index, cell key) arrays, of every cell of a grid of
+    `cell_size` the AABB of positions `p` and sizes `s` overlaps."""
+    lo = np.floor(p / cell_size).astype(np.int64)
+    hi = np.floor((p + s) / cell_size).astype(np.int64)
+    span = hi - lo + 1
+    counts = span[:, 0] * span[:, 1]
+    bodies = np.repeat(np.arange(len(p)), counts)
+    local = np.arange(len(bodies)) - np.repeat(np.cumsum(counts) - counts,
+            counts)
+    nx = span[bodies, 0]
+    return bodies, cell_key(lo[bodies, 0] + local % nx,
+            lo[bodies, 1] + local // nx)
+
+class SpatialHash(object):
+    """Uniform grid broad-phase over the bodies of a `World`.
+
+    Every body is binned in each cell its AABB overlaps, so `cell_size`
+    should be about the size of the bodies: the cost is linear in the number
+    of bodies as long as cells stay sparsely populated.
+    """
+    def __init__(self, world, cell_size=64):
+        self.world = world
+        self.cell_size = float(cell_size)
+
+    def _cells(self):
+        """Return (cell key, body index) of every occupied cell, by key."""
+        n = self.world.count
+        bodies, keys = grid_cells(self.world.positions[:n],
+                self.world.sizes[:n], self.cell_size)
+        order = np.argsort(keys, kind='stable')
+        return keys[order], bodies[order]
+
+    def pairs(self):
+        """Candidate pairs as two index arrays (a < b), sharing a cell."""
+        keys, bodies = self._cells()
+        found_a, found_b = [], []
+        k = 1
+        while k < len(keys):
+            same = keys[k:] == keys[:-k]
+            if not same.any():
+                break
+            found_a.append(bodies[:-k][same])
+            found_b.append(bodies[k:][same])
+            k += 1
+        if not found_a:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        a, b = np.concatenate(found_a), np.concatenate(found_b)
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        codes = np.unique(lo * self.world.count + hi)
+        return codes // self.world.count, codes % self.world.count
+
+class Collisions(object):
+    """Collisions between the bodies of a `World`.
+
+    Candidate pairs from the `SpatialHash` broad-phase are tested for AABB
+    overlap, then pushed apart along the axis of least penetration and
+    their closing velocity removed, the upper body of a vertical separation
+    being in contact (standing on the other). A body that can't move that
+    way, standing on the ground or against a wall, is left in place and the
+    other one takes the whole push: `iterations` passes settle stacks that
+    many bodies high. Pair callbacks are called with both components when a
+    pair starts or stops overlapping, or when one of them is removed.
+    """
+    def __init__(self, world, cell_size=64, resolve=True, iterations=4):
+        self.world = world
+        self.broadphase = SpatialHash(world, cell_size)
+        self.resolve = resolve
+        self.iterations = iterations
+        self.pair_events = []
+        self.contacts = np.zeros(0, dtype=np.int64)
+
+    def bind_pair_event(self, f, on_enter=True):
+        if not callable(f):
+            raise TypeError("Bind object '%s' should be callable" % f)
+        self.pair_events.append((bool(on_enter), f))
+
+    def overlapping(self, candidates=None):
+        """Overlapping pairs as two index arrays, among the `candidates`
+        pairs if given."""
+        a, b = self.broadphase.pairs() if candidates is None else candidates
+        p, s = self.world.positions, self.world.sizes
+        overlap = AABBArray(p[a], s[a]).overlaps(AABBArray(p[b], s[b]))
+        return a[overlap], b[overlap]
+
+    def update(self):
+        candidates = self.broadphase.pairs()
+        a, b = self.overlapping(candidates)
+        if self.resolve and len(a):
+            self._separate(a, b, candidates)
+        ids = self.world.ids
+        lo, hi = np.minimum(ids[a], ids[b]), np.maximum(ids[a], ids[b])
+        contacts = np.unique((lo << 32) + hi)
+        if self.pair_events:
+            entered = np.setdiff1d(contacts, self.contacts, assume_unique=True)
+            exited = np.setdiff1d(self.contacts, contacts, assume_unique=True)
+            self._notify(entered, True)
+            self._notify(exited, False)
+        self.contacts = contacts
+
+    def _separate(self, a, b, candidates):
+        """Push the overlapping pairs (a, b) apart, in passes over the
+        `candidates` pairs of the bodies pushed: separating a pair may bring
+        neighbours into contact."""
+        world = self.world
+        p, v, s = world.positions, world.velocities, world.sizes
+        candidates_a, candidates_b = candidates
+        pairs_a, pairs_b = a, b
+        for i in range(self.iterations):
+            center_a = p[pairs_a] + s[pairs_a] / 2
+            center_b = p[pairs_b] + s[pairs_b] / 2
+            depth = (s[pairs_a] + s[pairs_b]) / 2 - np.abs(center_b - center_a)
+            inside = (depth > 0).all(axis=1)
+            if not inside.any():
+                break
+            a, b, depth = pairs_a[inside], pairs_b[inside], depth[inside]
+            center_a, center_b = center_a[inside], center_b[inside]
+            axis = (depth[:, 1] < depth[:, 0]).astype(np.int64)
+            rows = np.arange(len(a))
+            # way a is pushed, b going the other way
+            direction = np.where(center_a[rows, axis] < center_b[rows, axis],
+                    -1., 1.)
+            blocked_a = self._blocked(a, axis, direction)
+            blocked_b = self._blocked(b, axis, -direction)
+            vertical = axis == 1
+            upper = np.where(direction < 0, a, b)
+            lower = np.where(direction < 0, b, a)
+            # a body on top of another may end up standing on it: its pairs
+            # with bodies above wait for the next pass, but for the last
+            if i < self.iterations - 1:
+                resting = np.zeros(world.count, dtype=bool)
+                resting[upper[vertical]] = True
+                ready = ~(vertical & resting[lower]
+                        & ~world.contacts[lower])
+                a, b, depth, axis, direction = (a[ready], b[ready],
+                        depth[ready], axis[ready], direction[ready])
+                blocked_a, blocked_b = blocked_a[ready], blocked_b[ready]
+                vertical, upper = vertical[ready], upper[ready]
+                rows = np.arange(len(a))
+            share_a = np.where(blocked_a == blocked_b, .5,
+                    np.where(blocked_a, 0., 1.))
+            share_b = 1 - share_a
+            push = direction * depth[rows, axis]
+            np.add.at(p, (a, axis), push * share_a)
+            np.add.at(p, (b, axis), -push * share_b)
+            closing = v[a, axis] - v[b, axis]
+            closing[closing * direction >= 0] = 0
+            np.add.at(v, (a, axis), -closing * share_a)
+            np.add.at(v, (b, axis), closing * share_b)
+            upper = upper[vertical]
+            world.contacts[upper] = True
+            world.accelerations[upper] = world.gravity.x, world.gravity.y
+            # only pairs with a body pushed, now or in a later pass, can
+            # overlap again
+            moved = np.zeros(world.count, dtype=bool)
+            moved[pairs_a[inside]] = moved[pairs_b[inside]] = True
+            near = moved[candidates_a] | moved[candidates_b]
+            pairs_a, pairs_b = candidates_a[near], candidates_b[near]
+
+    def _blocked(self, i, axis, direction):
+        """Whether the bodies `i` can't be pushed along `axis` in
+        `direction`: down when standing on something, or into a wall."""
+        world = self.world
+        p, s = world.positions[i], world.sizes[i]
+        vertical = axis == 1
+        left = world.position.x
+        right = world.position.x + world.size.x
+        return np.where(vertical, (direction > 0) & world.contacts[i],
+                np.where(direction < 0, p[:, 0] <= left,
+                    p[:, 0] + s[:, 0] >= right))
+
+    def discard(self, body_id):
+        """End the contacts of the body `body_id`, about to be removed."""
+        codes = self.contacts
+        mine = ((codes >> 32) == body_id) | ((codes & 0xffffffff) == body_id)
+        if mine.any():
+            self.contacts = codes[~mine]
+            self._notify(codes[mine], False)
+
+    def _notify(self, codes, on_enter):
+        if not len(codes) or not self.pair_events:
+            return
+        by_id = self.world.by_id
+        for code in codes.tolist():
+            first, second = by_id[code >> 32], by_id[code & 0xffffffff]
+            for p, callback in self.pair_events:
+                if p == on_enter:
+                    callback(first, second)
+
+def _vector_property(field):
+    def getter(self):
+        return _VectorView(self, field)
+    def setter(self, v):
+        getattr(self.world, field)[self.index] = tuple(v)
+    return property(getter, setter)
 
 class Component(AABB):
-    def __init__(self, size, x=0, y=0, vx=0, vy=0, ax=0, ay=0):
+    """Handle on a body of a `World`."""
+    def __init__(self, size, x=0, y=0, vx=0, vy=0, ax=0, ay=0, world=None):
         """Build the component."""
-        AABB.__init__(self, x, y, size)
-        self.velocity = Vector(vx, vy)
-        self.acceleration = Vector(ax, ay)
-        self.acceleration += _world.gravity
-        self.contact = False
+        self.world = _world if world is None else world
+        ax += self.world.gravity.x
+        ay += self.world.gravity.y
+        self.index = self.world.add(self, size, x, y, vx, vy, ax, ay)
+
+    position = _vector_property('positions')
+    previous = _vector_property('previous')
+    velocity = _vector_property('velocities')
+    acceleration = _vector_property('accelerations')
+    size = _vector_property('sizes')
 
     def update(self):
         """update the component (motion)."""
-        self.contact = False
-        self.velocity += self.acceleration
-        self.position += self.velocity
-        _world.resolve(self)
+        self.world.update_body(self.index)
+
+    def interpolate(self, alpha):
+        """Position between the last two updates, `alpha` in [0, 1]."""
+        x0, y0 = self.world.previous[self.index].tolist()
+        x1, y1 = self.world.positions[self.index].tolist()
+        return x0 + (x1 - x0) * alpha, y0 + (y1 - y0) * alpha
+
+    def _get_contact(self):
+        return bool(self.world.contacts[self.index])
+
+    def _set_contact(self, contact):
+        self.world.contacts[self.index] = contact
+
+    contact = property(_get_contact, _set_contact)
 
     @property
     def ground(self):
@@ -1,9 +1,18 @@
 import random
 import app
-from physics import Component as PhysicsComponent
-from animation import Animation, AnimationFactory
+import hitbox as _hitbox
+import config as _config
+from physics import Component as PhysicsComponent, _world
+from animation import AnimationPlayer, AnimationFactory
+from statemachine import StateMachine
 from config import Player as config
 
+# duration of a simulation tick
+TICK = 1. / _config.Physics['tick_rate']
+
+# source of every random choice of the simulation, seeded for replays
+rng = random.Random()
+
 # Player controls
 class Controls:
     END = 0
@@ -12,160 +21,332 @@ class Controls:
     RIGHT = 3
     GROUND = 4
     ATTACK = 5
+    COUNT = 6
 
 class State(object):
-    def __init__(self, model):
-        self.model = model
+    """State behaviour, shared by every model in that state."""
+    def load(self): pass
+    def update(self, model): pass
+    def on_start(self, model): pass
+    def on_end(self, model): pass
+    def hitbox(self, model): return None
 
-    def update(self): pass
-    def on_start(self): pass
-    def on_end(self): pass
+    def update_all(self, models):
+        for model in models:
+            self.update(model)
 
 class AnimatedState(State):
-    def __init__(self, model, animation):
-        super(AnimatedState, self).__init__(model)
-        self.animation = animation
+    """State playing a clip, pinned in the animation factory while models
+    are in that state."""
+    def __init__(self, animation, loop=True):
+        super(AnimatedState, self).__init__()
+        self.key = animation
+        self.loop = loop
+
+    @property
+    def clip(self):
+        """The clip, loaded again if it was evicted."""
+        return AnimationFactory().get_clip(self.key)
+
+    def load(self):
+        """Load the clip; the collision masks of its frames are only loaded
+        on the first hit test."""
+        AnimationFactory().get_clip(self.key)
+
+    def play(self, model):
+        """Pin the clip, and play it from the start."""
+        AnimationFactory().pin(self.key)
+        if model.animation is None:
+            model.animation = AnimationPlayer(self.clip, self.loop)
+        else:
+            model.animation.play(self.clip, self.loop)
+
+    def on_start(self, model):
+        self.play(model)
+
+    def on_end(self, model):
+        AnimationFactory().unpin(self.key)
+
+    def mask(self, model):
+        """Collision mask of the frame `model` shows."""
+        return _hitbox.masks(self.key)[model.animation.index]
+
+    def on_finished(self, model):
+        model.control(Controls.END)
 
-    def on_start(self):
-        self.model.animation = self.animation
-        self.animation.reset()
+    def update(self, model):
+        super(AnimatedState, self).update(model)
+        if model.animation.finished:
+            self.on_finished(model)
 
-    def on_finished(self):
-        self.model.control(Controls.END)
+class AttackState(AnimatedState):
+    """One-shot attack, hitting with the pixels each frame adds to the
+    frame `rest` (the pose the attack starts from)."""
+    def __init__(self, animation, loop=False, rest=0):
+        super(AttackState, self).__init__(animation, loop)
+        self.rest = rest
+        self.hitboxes = None
 
-    def update(self):
-        super(AnimatedState, self).update()
-        if self.animation.finished:
-            self.on_finished()
+    def hitbox(self, model):
+        """Mask of the hit area of the frame `model` shows, None between
+        hits."""
+        if self.hitboxes is None:
+            masks = _hitbox.masks(self.key)
+            self.hitboxes = [mask.difference(masks[self.rest])
+                    for mask in masks]
+        hit = self.hitboxes[model.animation.index]
+        return hit if hit else None
 
 class MoveState(AnimatedState):
-    def __init__(self, model, animation, speed):
-        super(MoveState, self).__init__(model, animation)
+    def __init__(self, animation, speed, loop=True):
+        super(MoveState, self).__init__(animation, loop)
         self.speed = speed
 
-    def update(self):
-        super(MoveState, self).update()
-        self.model.physics.position.x += self.speed
+    def update(self, model):
+        super(MoveState, self).update(model)
+        model.physics.position.x += self.speed
+
+    def update_all(self, models):
+        for model in models:
+            AnimatedState.update(self, model)
+        world = models[0].physics.world
+        world.positions[[m.physics.index for m in models], 0] += self.speed
 
 class JumpState(AnimatedState):
-    def __init__(self, model, animation, force):
-        super(JumpState, self).__init__(model, animation)
+    def __init__(self, animation, force, loop=False):
+        super(JumpState, self).__init__(animation, loop)
         self.force = force
 
-    def update(self):
-        super(JumpState, self).update()
-        if self.model.physics.ground:
-            self.on_ground()
+    def update(self, model):
+        super(JumpState, self).update(model)
+        if model.physics.ground:
+            self.on_ground(model)
 
-    def on_start(self):
-        super(JumpState, self).on_start()
-        if self.model.physics.ground:
-            self.model.physics.velocity.y -= self.force
+    def on_start(self, model):
+        super(JumpState, self).on_start(model)
+        if model.physics.ground:
+            model.physics.velocity.y -= self.force
 
-    def on_ground(self):
-        self.model.control(Controls.GROUND)
+    def on_ground(self, model):
+        model.control(Controls.GROUND)
 
 class JumpMoveState(JumpState):
-    def __init__(self, model, animation, speed, force):
-        super(JumpMoveState, self).__init__(model, animation, force)
+    def __init__(self, animation, speed, force, loop=False):
+        super(JumpMoveState, self).__init__(animation, force, loop)
         self.speed = speed
 
-    def update(self):
-        super(JumpMoveState, self).update()
-        self.model.physics.position.x += self.speed
+    def update(self, model):
+        super(JumpMoveState, self).update(model)
+        model.physics.position.x += self.speed
 
 class Model(app.Drawable):
-    def __init__(self):
-        self.physics = PhysicsComponent(config['size'])
-        fact = AnimationFactory()
-        self.states = {
-                'idle_left': AnimatedState(self, fact.get('idle_left')),
-                'idle_right': AnimatedState(self, fact.get('idle_right')),
-                'walk_left': MoveState(self, fact.get('walk_left'), -config['speeds']['walk']),
-                'walk_right': MoveState(self, fact.get('walk_right'), config['speeds']['walk']),
-                'idle_jump_left': JumpState(self, fact.get('jump_left', loop=False), config['accelerations']['jump']),
-                'idle_jump_right': JumpState(self, fact.get('jump_right', loop=False), config['accelerations']['jump']),
-                'jump_left': JumpMoveState(self, fact.get('jump_left', loop=False), -config['speeds']['walk'], config['accelerations']['jump']),
-                'jump_right': JumpMoveState(self, fact.get('jump_right', loop=False), config['speeds']['walk'], config['accelerations']['jump']),
-                'attack_left': AnimatedState(self, fact.get('vomit_left', loop=False)),
-                'attack_right': AnimatedState(self, fact.get('vomit_right', loop=False)),
-                }
-        self.transitions = {
-                'idle_left': {
-                    (Controls.LEFT, True): 'walk_left',
-                    (Controls.RIGHT, True): 'walk_right',
-                    (Controls.JUMP, True): 'idle_jump_left',
-                    (Controls.ATTACK, True): 'attack_left'
-                    },
-                'idle_right': {
-                    (Controls.LEFT, True): 'walk_left',
-                    (Controls.RIGHT, True): 'walk_right',
-                    (Controls.JUMP, True): 'idle_jump_right',
-                    (Controls.ATTACK, True): 'attack_right'
-                    },
-                'walk_left': {
-                    (Controls.LEFT, False): 'idle_left',
-                    (Controls.RIGHT, True): 'walk_right',
-                    (Controls.JUMP, True): 'jump_left',
-                    (Controls.ATTACK, True): 'attack_left'
-                    },
-                'walk_right': {
-                    (Controls.LEFT, True): 'walk_left',
-                    (Controls.RIGHT, False): 'idle_right',
-                    (Controls.JUMP, True): 'jump_right',
-                    (Controls.ATTACK, True): 'attack_right'
-                    },
-                'idle_jump_left': {
-                    (Controls.GROUND, True): 'idle_left',
-                    (Controls.LEFT, True): 'jump_left',
-                    (Controls.RIGHT, True): 'jump_right'
-                    },
-                'idle_jump_right': {
-                    (Controls.GROUND, True): 'idle_right',
-                    (Controls.RIGHT, True): 'jump_right',
-                    (Controls.LEFT, True): 'jump_left'
-                    },
-                'jump_left': {
-                    (Controls.GROUND, True): 'walk_left',
-                    (Controls.LEFT, False): 'idle_jump_left'
-                    },
-                'jump_right': {
-                    (Controls.GROUND, True): 'walk_right',
-                    (Controls.RIGHT, False): 'idle_jump_right'
-                    },
-                'attack_left': {
-                    (Controls.END, True): 'idle_left'
-                    },
-                'attack_right': {
-                    (Controls.END, True): 'idle_right'
-                    }
+    __slots__ = ('physics', 'animation', 'state_id', 'active_id', 'visible')
+
+    size = config['size']
+    initial_states = ('idle_left', 'idle_right')
+    machine = StateMachine(states={
+            'idle_left': AnimatedState('idle_left'),
+            'idle_right': AnimatedState('idle_right'),
+            'walk_left': MoveState('walk_left', -config['speeds']['walk']),
+            'walk_right': MoveState('walk_right', config['speeds']['walk']),
+            'idle_jump_left': JumpState('jump_left', config['accelerations']['jump']),
+            'idle_jump_right': JumpState('jump_right', config['accelerations']['jump']),
+            'jump_left': JumpMoveState('jump_left', -config['speeds']['walk'], config['accelerations']['jump']),
+            'jump_right': JumpMoveState('jump_right', config['speeds']['walk'], config['accelerations']['jump']),
+            'attack_left': AttackState('vomit_left'),
+            'attack_right': AttackState('vomit_right'),
+            },
+        transitions={
+            'idle_left': {
+                (Controls.LEFT, True): 'walk_left',
+                (Controls.RIGHT, True): 'walk_right',
+                (Controls.JUMP, True): 'idle_jump_left',
+                (Controls.ATTACK, True): 'attack_left'
+                },
+            'idle_right': {
+                (Controls.LEFT, True): 'walk_left',
+                (Controls.RIGHT, True): 'walk_right',
+                (Controls.JUMP, True): 'idle_jump_right',
+                (Controls.ATTACK, True): 'attack_right'
+                },
+            'walk_left': {
+                (Controls.LEFT, False): 'idle_left',
+                (Controls.RIGHT, True): 'walk_right',
+                (Controls.JUMP, True): 'jump_left',
+                (Controls.ATTACK, True): 'attack_left'
+                },
+            'walk_right': {
+                (Controls.LEFT, True): 'walk_left',
+                (Controls.RIGHT, False): 'idle_right',
+                (Controls.JUMP, True): 'jump_right',
+                (Controls.ATTACK, True): 'attack_right'
+                },
+            'idle_jump_left': {
+                (Controls.GROUND, True): 'idle_left',
+                (Controls.LEFT, True): 'jump_left',
+                (Controls.RIGHT, True): 'jump_right'
+                },
+            'idle_jump_right': {
+                (Controls.GROUND, True): 'idle_right',
+                (Controls.RIGHT, True): 'jump_right',
+                (Controls.LEFT, True): 'jump_left'
+                },
+            'jump_left': {
+                (Controls.GROUND, True): 'walk_left',
+                (Controls.LEFT, False): 'idle_jump_left'
+                },
+            'jump_right': {
+                (Controls.GROUND, True): 'walk_right',
+                (Controls.RIGHT, False): 'idle_jump_right'
+                },
+            'attack_left': {
+                (Controls.END, True): 'idle_left'
+                },
+            'attack_right': {
+                (Controls.END, True): 'idle_right'
                 }
+            },
+        controls=Controls.COUNT)
+
+    def __init__(self, world=None):
+        self.physics = PhysicsComponent(self.size, world=world)
+        self.machine.load()
         self.animation = None
-        self.saved_state_key = self.state_key = 'idle_' \
-                + random.choice(['left', 'right'])
-        self.state = self.states[self.state_key]
-        self.state.on_start()
+        self.visible = True
+        initial = rng.choice(self.initial_states)
+        self.active_id = self.state_id = self.machine.ids[initial]
+        self.machine.states[self.state_id].on_start(self)
 
-    def update(self):
+    @property
+    def state_key(self):
+        return self.machine.names[self.state_id]
+
+    def update(self, dt=TICK):
         self.physics.update()
-        if self.state:
-            self.state.update()
-        if self.state_key != self.saved_state_key:
-            self.saved_state_key = self.state_key
-            self.state.on_end()
-            self.state = self.states[self.state_key]
-            self.state.on_start()
-        self.animation.advance()
+        self.machine.states[self.active_id].update(self)
+        self.update_transition(dt)
+
+    def update_transition(self, dt=TICK):
+        if self.state_id != self.active_id:
+            states = self.machine.states
+            states[self.active_id].on_end(self)
+            self.active_id = self.state_id
+            states[self.active_id].on_start(self)
+        # offscreen, looping animations are left alone, but one-shots still
+        # run since their end drives the state machine
+        if self.visible or not self.animation.loop:
+            self.animation.advance(dt)
 
     def control(self, control, pred=True):
-        try:
-            self.state_key = self.transitions[self.state_key][(control, pred)]
-        except KeyError:
-            pass
+        self.state_id = self.machine.next(self.state_id, control, pred)
+
+    def mask(self):
+        """Collision mask of the frame shown, at `physics.position`."""
+        return self.machine.states[self.active_id].mask(self)
+
+    def hitbox(self):
+        """Mask of the active hit area, at `physics.position`, if any."""
+        return self.machine.states[self.active_id].hitbox(self)
+
+    def hits(self, other):
+        """Whether the active hit area overlaps what's shown of `other`."""
+        hit = self.hitbox()
+        if hit is None:
+            return False
+        x, y = self.physics.position
+        ox, oy = other.physics.position
+        return _hitbox.overlap(hit, x, y, other.mask(), ox, oy)
+
+    def remove(self):
+        """End the current state and remove the body from its world."""
+        self.machine.states[self.active_id].on_end(self)
+        self.physics.world.remove(self.physics)
+
+    def bounds(self):
+        """World rectangle (x, y, w, h) of the model."""
+        x, y = self.physics.position
+        return x, y, self.size[0], self.size[1]
 
     def render(self, graphics):
+        if not self.visible:
+            return
         graphics.push_state()
-        x, y = self.physics.position
+        x, y = self.physics.interpolate(graphics.alpha)
         graphics.translate(x, y)
         graphics.draw(self.animation)
         graphics.pop_state()
+
+class Bot(Model):
+    """Computer controlled walker, using the botB animations."""
+    __slots__ = ()
+
+    size = _config.Bot['size']
+    initial_states = ('walk_left', 'walk_right')
+    machine = StateMachine(states={
+            'walk_left': MoveState('botB_left', -_config.Bot['speeds']['walk']),
+            'walk_right': MoveState('botB_right', _config.Bot['speeds']['walk']),
+            },
+        transitions={
+            'walk_left': {
+                (Controls.RIGHT, True): 'walk_right',
+                },
+            'walk_right': {
+                (Controls.LEFT, True): 'walk_left',
+                },
+            },
+        controls=Controls.COUNT)
+
+def update_all(models, world=_world, dt=TICK):
+    """Update many models (of the same physics world) at once: bodies are
+    integrated in one step, and models are updated state by state. `dt` is
+    the tick duration of the app running them."""
+    world.update()
+    by_state = {}
+    for model in models:
+        by_state.setdefault(model.machine.states[model.active_id],
+                []).append(model)
+    for state, group in by_state.items():
+        state.update_all(group)
+    for model in models:
+        model.update_transition(dt)
+
+class Group(app.Drawable):
+    """Models of one physics world, indexed by position so that only the
+    ones in view of the camera are drawn. The others are flagged as not
+    `visible`, which also spares them their animation."""
+    def __init__(self, world=_world, cell_size=256):
+        self.world = world
+        self.models = []
+        self.index = app.SpatialIndex(cell_size)
+        self._shown = set()
+
+    def __len__(self):
+        return len(self.models)
+
+    def add(self, model):
+        self.models.append(model)
+        self.index.insert(model, model.bounds())
+        # as if shown, to be flagged on the next render if out of view
+        self._shown.add(model)
+
+    def remove(self, model):
+        self.models.remove(model)
+        self.index.remove(model)
+        self._shown.discard(model)
+
+    def update(self, dt=TICK):
+        update_all(self.models, self.world, dt)
+        move = self.index.move
+        for model in self.models:
+            move(model, model.bounds())
+
+    def render(self, graphics):
+        shown = self.index.query(graphics.view)
+        for model in self._shown.difference(shown):
+            model.visible = False
+        for model in shown:
+            model.visible = True
+            graphics.draw(model)
+        self._shown = set(shown)
+        graphics.drawn += len(shown)
+        graphics.culled += len(self.models) - len(shown)
@@ -0,0 +1,104 @@
+"""PNG decoder, for the pixels of images the backends only upload.
+
+Only what the animations use is supported: 8 bits a sample, greyscale,
+RGB or RGBA, without interlacing. Images are returned as (height, width,
+4) RGBA arrays.
+"""
+import struct
+import zlib
+import numpy as np
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# bytes a pixel, by color type
+_channels = {0: 1, 2: 3, 4: 2, 6: 4}
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return decode(f.read())
+
+def decode(data):
+    """RGBA pixels of the PNG image in the buffer `data`."""
+    data = bytes(data)
+    if data[:8] != SIGNATURE:
+        raise IOError("Not a PNG image")
+    pos = 8
+    header = None
+    compressed = []
+    while pos < len(data):
+        length, kind = struct.unpack_from('>I4s', data, pos)
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', body)
+        elif kind == b'IDAT':
+            compressed.append(body)
+        elif kind == b'IEND':
+            break
+    if header is None:
+        raise IOError("PNG image without header")
+    width, height, depth, color, _, _, interlace = header
+    if depth != 8 or color not in _channels or interlace:
+        raise IOError("Unsupported PNG image (depth %d, color type %d,"
+                " interlace %d)" % (depth, color, interlace))
+    bpp = _channels[color]
+    raw = zlib.decompress(b''.join(compressed))
+    pixels = _unfilter(raw, height, width * bpp, bpp).reshape(height, width,
+            bpp)
+    if bpp == 4:
+        return pixels
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    rgba[..., 3] = 255
+    if bpp <= 2:
+        rgba[..., :3] = pixels[..., :1]
+        if bpp == 2:
+            rgba[..., 3] = pixels[..., 1]
+    else:
+        rgba[..., :3] = pixels
+    return rgba
+
+def _unfilter(raw, height, stride, bpp):
+    rows = np.frombuffer(raw, np.uint8, height * (stride + 1)).reshape(
+            height, stride + 1)
+    out = np.empty((height, stride), dtype=np.uint8)
+    prior = np.zeros(stride, dtype=np.uint8)
+    for y in range(height):
+        kind, line = rows[y, 0], rows[y, 1:]
+        if kind == 0:
+            current = line
+        elif kind == 1:
+            # sums of bytes a pixel apart, wrapping like uint8 does
+            current = line.reshape(-1, bpp).cumsum(axis=0,
+                    dtype=np.uint8).ravel()
+        elif kind == 2:
+            current = line + prior
+        elif kind == 3:
+            current = _average(line.tolist(), prior.tolist(), bpp)
+        elif kind == 4:
+            current = _paeth(line.tolist(), prior.tolist(), bpp)
+        else:
+            raise IOError("Invalid PNG filter %d" % kind)
+        out[y] = current
+        prior = out[y]
+    return out
+
+def _average(line, prior, bpp):
+    for i in range(len(line)):
+        left = line[i - bpp] if i >= bpp else 0
+        line[i] = (line[i] + ((left + prior[i]) >> 1)) & 0xff
+    return line
+
+def _paeth(line, prior, bpp):
+    for i in range(bpp):
+        line[i] = (line[i] + prior[i]) & 0xff
+    for i in range(bpp, len(line)):
+        a, b, c = line[i - bpp], prior[i], prior[i - bpp]
+        p = a + b - c
+        pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+        if pa <= pb and pa <= pc:
+            line[i] = (line[i] + a) & 0xff
+        elif pb <= pc:
+            line[i] = (line[i] + b) & 0xff
+        else:
+            line[i] = (line[i] + c) & 0xff
+    return line
@@ -0,0 +1,212 @@
+"""Frame profiler.
+
+`App.run` times its phases (`events` polling, `keys` dispatch, `hooks`,
+`update`, `render`, `display` and the whole `frame`) when the app has an
+enabled profiler, and user code adds its own scopes::
+
+    with profiler.scope('collisions'):
+        ...
+
+    @profiler.profile('Model.update')
+    def update(self): ...
+
+Phase and scope times are summed per frame, and the last `history` frames
+are kept to compute percentiles. While tracing, every timed span is also
+kept, to be saved as a Chrome trace (chrome://tracing, Perfetto).
+"""
+from __future__ import print_function
+import json
+from collections import deque
+from functools import wraps
+import app
+
+_clock = app._clock
+
+class _NullScope(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_scope = _NullScope()
+
+class _Scope(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, _clock())
+        return False
+
+class Profiler(object):
+    def __init__(self, history=240, enabled=False):
+        self.enabled = enabled
+        self.history = history
+        # name: durations of the last frames, in seconds
+        self.samples = {}
+        self.tracing = False
+        self.events = []
+        self._frame = {}
+        self._origin = _clock()
+
+    def record(self, name, start, end):
+        """Add the span [start, end] to the `name` total of the frame."""
+        self._frame[name] = self._frame.get(name, 0.) + (end - start)
+        if self.tracing:
+            self.events.append((name, start, end))
+
+    def lap(self, name, start):
+        """Record `name` from `start` to now, and return now."""
+        end = _clock()
+        self.record(name, start, end)
+        return end
+
+    def end_frame(self):
+        """Push the totals of the frame to the history."""
+        samples = self.samples
+        for name, total in self._frame.items():
+            if name not in samples:
+                samples[name] = deque(maxlen=self.history)
+            samples[name].append(total)
+        self._frame.clear()
+
+    def scope(self, name):
+        """Context manager timing its block as `name`."""
+        if not self.enabled:
+            return _null_scope
+        return _Scope(self, name)
+
+    def profile(self, name=None):
+        """Decorator timing every call of the function as `name` (its
+        qualified name by default)."""
+        def decorator(f):
+            key = name or getattr(f, '__qualname__', f.__name__)
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                start = _clock()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.record(key, start, _clock())
+            return wrapper
+        return decorator
+
+    def percentiles(self, name, ps=(50, 95, 99)):
+        """Durations of `name` (in seconds) at the percentiles `ps` of the
+        last frames."""
+        samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return tuple(0. for _ in ps)
+        last = len(samples) - 1
+        return tuple(samples[int(round(p / 100. * last))] for p in ps)
+
+    def report(self):
+        """Percentiles of every phase and scope, one line each."""
+        lines = []
+        for name in sorted(self.samples):
+            p50, p95, p99 = self.percentiles(name)
+            lines.append('%-16s p50 %7.3fms  p95 %7.3fms  p99 %7.3fms'
+                    % (name, p50 * 1e3, p95 * 1e3, p99 * 1e3))
+        return '\n'.join(lines)
+
+    def reset(self):
+        self.samples.clear()
+        self._frame.clear()
+
+    def start_trace(self):
+        del self.events[:]
+        self.tracing = True
+
+    def stop_trace(self):
+        self.tracing = False
+
+    def save_trace(self, filename):
+        """Write the traced spans as Chrome trace events."""
+        origin = self._origin
+        events = [{'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+            'ts': (start - origin) * 1e6, 'dur': (end - start) * 1e6}
+            for name, start, end in self.events]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+    def attach(self, application, key='p'):
+        """Profile `application`, showing the overlay while `key` toggles
+        it on."""
+        self.overlay = Overlay(self)
+        application.profiler = self
+        application.overlays.append(self.overlay)
+        application.bind_key_event(self.overlay.toggle, key)
+        return self.overlay
+
+# profiler of the user scopes set up at import time
+default = Profiler()
+scope = default.scope
+profile = default.profile
+
+class Overlay(app.Drawable):
+    """Bars of the p50 (colored), p95 and p99 (grays) durations of the
+    phases, `width` pixels being a frame of `budget` seconds."""
+    colors = {
+            'events': 'cyan',
+            'keys': 'blue',
+            'hooks': 'magenta',
+            'update': 'green',
+            'render': 'yellow',
+            'display': 'red',
+            'frame': 'white',
+            }
+    phases = ('events', 'keys', 'hooks', 'update', 'render', 'display',
+            'frame')
+
+    def __init__(self, profiler, budget=1. / 60, width=200, height=6,
+            position=(8, 8)):
+        self.profiler = profiler
+        self.budget = budget
+        self.width = width
+        self.height = height
+        self.position = position
+        self.shown = False
+        self._bars = {}
+
+    def toggle(self):
+        self.shown = not self.shown
+        self.profiler.enabled = self.shown
+
+    def _bar(self, duration, color):
+        width = max(1, min(self.width, int(duration / self.budget
+            * self.width)))
+        key = width, color
+        bar = self._bars.get(key)
+        if bar is None:
+            bar = self._bars[key] = app.Rectangle((width, self.height), color)
+        return bar
+
+    def render(self, graphics):
+        if not self.shown:
+            return
+        profiler = self.profiler
+        names = [n for n in self.phases if n in profiler.samples]
+        names += sorted(n for n in profiler.samples if n not in self.colors)
+        graphics.push_state()
+        # screen space, whatever the camera
+        graphics.graphic_states[-1] = self.position + (1.,)
+        for name in names:
+            p50, p95, p99 = profiler.percentiles(name)
+            graphics.draw(self._bar(p99, 0x404040))
+            graphics.draw(self._bar(p95, 0x808080))
+            graphics.draw(self._bar(p50, self.colors.get(name, 'white')))
+            graphics.translate(0, self.height + 2)
+        graphics.pop_state()
@@ -0,0 +1,107 @@
+"""Deterministic recording and replay of demo sessions.
+
+A recording holds the seed of `player.rng` and, for every simulation tick,
+the controls sent to the model before its update along with a checksum of
+its state after it. Replaying feeds the same controls to a `demo.Game`
+and checks the state against the recorded checksums.
+
+Layout (little endian)::
+
+    header  magic 'EUSR', version (H), seed (I)
+    ticks   per tick: control count (B), state checksum (I), then one byte
+            per control, control << 1 | pred
+
+Record with `EUSDAB_RECORD=session.rec python .`, replay headless (and as
+fast as possible) with `python replay.py session.rec`.
+"""
+from __future__ import print_function
+import struct
+import sys
+import zlib
+import app
+
+MAGIC = b'EUSR'
+VERSION = 1
+
+_header = struct.Struct('<4sHI')
+_tick = struct.Struct('<BI')
+_model = struct.Struct('<hhd?')
+
+def checksum(model):
+    """CRC-32 of the simulation state of `model`."""
+    physics = model.physics
+    world, i = physics.world, physics.index
+    crc = zlib.crc32(_model.pack(model.state_id, model.active_id,
+        model.animation.time, bool(world.contacts[i])))
+    for array in (world.positions, world.velocities, world.accelerations):
+        crc = zlib.crc32(array[i].tobytes(), crc)
+    return crc & 0xffffffff
+
+class Recorder(object):
+    """Writes the controls and checksum of every tick to `filename`."""
+    def __init__(self, filename, seed):
+        self.file = open(filename, 'wb')
+        self.file.write(_header.pack(MAGIC, VERSION, seed))
+        self.seed = seed
+        self.ticks = 0
+        self._controls = bytearray()
+
+    def control(self, control, pred=True):
+        self._controls.append(control << 1 | bool(pred))
+
+    def end_tick(self, crc):
+        self.file.write(_tick.pack(len(self._controls), crc))
+        self.file.write(bytes(self._controls))
+        del self._controls[:]
+        self.ticks += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Replay(object):
+    """Recorded session, as (controls, checksum) per tick. A truncated
+    last tick (the recording was interrupted) is ignored."""
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        magic, version, self.seed = _header.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise IOError("Invalid recording '%s'" % filename)
+        self.ticks = []
+        pos = _header.size
+        while pos + _tick.size <= len(data):
+            count, crc = _tick.unpack_from(data, pos)
+            pos += _tick.size
+            if pos + count > len(data):
+                break
+            self.ticks.append((bytearray(data[pos:pos + count]), crc))
+            pos += count
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __iter__(self):
+        return iter(self.ticks)
+
+def run(filename, verify=True):
+    """Replay `filename` headless, one tick per frame. Return the number of
+    ticks and the time it took; raise ValueError if the state diverges
+    from the recording (with `verify`)."""
+    app.use_backend('null')
+    import demo
+    recording = Replay(filename)
+    game = demo.Game(replay=recording, verify=verify)
+    start = app._clock()
+    game.run(realtime=False)
+    return len(recording), app._clock() - start
+
+if __name__ == '__main__':
+    ticks, elapsed = run(sys.argv[1])
+    print('%s: %d ticks replayed in %.3fs (%.0f ticks/s), no divergence'
+            % (sys.argv[1], ticks, elapsed, ticks / max(elapsed, 1e-9)))
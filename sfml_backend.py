@@ -0,0 +1,260 @@
+import numpy as np
+import sfml as _sf
+
+# Mapping to readable key
+key_mapping = {
+        _sf.Keyboard.A        : 'a',
+        _sf.Keyboard.B        : 'b',
+        _sf.Keyboard.C        : 'c',
+        _sf.Keyboard.D        : 'd',
+        _sf.Keyboard.E        : 'e',
+        _sf.Keyboard.F        : 'f',
+        _sf.Keyboard.G        : 'g',
+        _sf.Keyboard.H        : 'h',
+        _sf.Keyboard.I        : 'i',
+        _sf.Keyboard.J        : 'j',
+        _sf.Keyboard.K        : 'k',
+        _sf.Keyboard.L        : 'l',
+        _sf.Keyboard.M        : 'm',
+        _sf.Keyboard.N        : 'n',
+        _sf.Keyboard.O        : 'o',
+        _sf.Keyboard.P        : 'p',
+        _sf.Keyboard.Q        : 'q',
+        _sf.Keyboard.R        : 'r',
+        _sf.Keyboard.S        : 's',
+        _sf.Keyboard.T        : 't',
+        _sf.Keyboard.U        : 'u',
+        _sf.Keyboard.V        : 'v',
+        _sf.Keyboard.W        : 'w',
+        _sf.Keyboard.X        : 'x',
+        _sf.Keyboard.Y        : 'y',
+        _sf.Keyboard.Z        : 'z',
+        _sf.Keyboard.UP       : 'up',
+        _sf.Keyboard.DOWN     : 'down',
+        _sf.Keyboard.LEFT     : 'left',
+        _sf.Keyboard.RIGHT    : 'right',
+        _sf.Keyboard.SPACE    : 'space',
+        _sf.Keyboard.RETURN   : 'enter',
+        _sf.Keyboard.ESCAPE   : 'escape',
+        _sf.Keyboard.L_ALT     : 'alt',
+        _sf.Keyboard.R_ALT     : 'alt',
+        _sf.Keyboard.L_CONTROL : 'ctrl',
+        _sf.Keyboard.R_CONTROL : 'ctrl',
+        _sf.Keyboard.L_SHIFT   : 'shift',
+        _sf.Keyboard.R_SHIFT   : 'shift',
+        }
+
+def is_key_pressed(code):
+    return _sf.Keyboard.is_key_pressed(code)
+
+def pressed_keys():
+    return [code for code in key_mapping if _sf.Keyboard.is_key_pressed(code)]
+
+def read_joystick(joystick):
+    """Pressed buttons and (x, y) stick position, in [-100, 100], or None
+    when disconnected."""
+    _sf.Joystick.update()
+    if not _sf.Joystick.is_connected(joystick):
+        return None
+    buttons = [button for button
+            in range(_sf.Joystick.get_button_count(joystick))
+            if _sf.Joystick.is_button_pressed(joystick, button)]
+    return buttons, (_sf.Joystick.get_axis_position(joystick, _sf.Joystick.X),
+            _sf.Joystick.get_axis_position(joystick, _sf.Joystick.Y))
+
+def color(r, g, b, a=255):
+    return _sf.Color(r, g, b, a)
+
+class Window(object):
+    def __init__(self, size, title, fps, icon, closable, resizable, mouse,
+            vsync, fullscreen, enable_key_repeat):
+        style = 0
+        if closable: style |= _sf.Style.CLOSE
+        if resizable: style |= _sf.Style.RESIZE
+        if fullscreen: style |= _sf.Style.FULLSCREEN
+        self._impl = _sf.RenderWindow(_sf.VideoMode(*size), title, style)
+        self._impl.key_repeat_enabled = enable_key_repeat
+        self._impl.framerate_limit = fps
+        self._impl.vertical_synchronization = vsync
+        self._impl.mouse_cursor_visible = mouse
+        if icon is not None:
+            icon_image = _sf.Image.from_file(icon)
+            self._impl.icon = icon_image.pixels
+
+    def events(self):
+        for event in self._impl.events:
+            if type(event) is _sf.CloseEvent:
+                yield 'closed', None
+            elif type(event) is _sf.KeyEvent:
+                if event.pressed:
+                    yield 'key_pressed', event.code
+                else:
+                    yield 'key_released', event.code
+            elif type(event) is _sf.FocusEvent:
+                yield 'focus_gained' if event.gained else 'focus_lost', None
+
+    def set_framerate_limit(self, fps):
+        self._impl.framerate_limit = fps
+
+    def set_vsync(self, vsync):
+        self._impl.vertical_synchronization = vsync
+
+    def mouse_position(self):
+        return _sf.Mouse.get_position(self._impl)
+
+    def set_active(self, active):
+        self._impl.active = active
+
+    def display(self):
+        self._impl.display()
+
+    def clear(self):
+        self._impl.clear()
+
+    def close(self):
+        self._impl.close()
+
+    def is_opened(self):
+        return self._impl.is_open
+
+    def draw(self, drawable, x, y, scale=1.):
+        # drawables are transformable, no need for a RenderStates
+        drawable.position = (x, y)
+        drawable.ratio = (scale, scale)
+        self._impl.draw(drawable)
+
+    def get_width(self):
+        return self._impl.width
+
+    def set_width(self, w):
+        self._impl.width = w
+
+    def get_height(self):
+        return self._impl.height
+
+    def set_height(self, h):
+        self._impl.height = h
+
+class RenderTexture(object):
+    def __init__(self, size):
+        self._impl = _sf.RenderTexture(*size)
+        self.size = size
+
+    @property
+    def texture(self):
+        return self._impl.texture
+
+    def draw(self, drawable, x, y, scale=1.):
+        drawable.position = (x, y)
+        drawable.ratio = (scale, scale)
+        self._impl.draw(drawable)
+
+    def clear(self):
+        self._impl.clear(_sf.Color.TRANSPARENT)
+
+    def clear_rect(self, rect):
+        x, y, w, h = rect
+        shape = _sf.RectangleShape((w, h))
+        shape.position = (x, y)
+        shape.fill_color = _sf.Color.TRANSPARENT
+        states = _sf.RenderStates()
+        states.blend_mode = _sf.BLEND_NONE
+        self._impl.draw(shape, states)
+
+    def clip(self, rect):
+        """Restrict drawing to `rect`, until `unclip`."""
+        x, y, w, h = rect
+        width, height = self.size
+        view = _sf.View(_sf.Rectangle((x, y), (w, h)))
+        view.viewport = _sf.Rectangle((float(x) / width, float(y) / height),
+                (float(w) / width, float(h) / height))
+        self._impl.view = view
+
+    def unclip(self):
+        self._impl.view = self._impl.default_view
+
+    def display(self):
+        self._impl.display()
+
+class SpriteBatch(object):
+    """Quads collected in one vertex array per texture, each drawn with a
+    single call on `flush`."""
+    def __init__(self):
+        self.textures = []
+        self.vertices = {}
+
+    def add(self, texture, rect, x, y, scale=1.):
+        key = id(texture)
+        vertices = self.vertices.get(key)
+        if vertices is None:
+            vertices = _sf.VertexArray(_sf.PrimitiveType.QUADS)
+            self.vertices[key] = vertices
+            self.textures.append(texture)
+        # texture coordinates from right to left when mirrored
+        u, v, tw, th = rect
+        w, h = abs(tw) * scale, th * scale
+        white = _sf.Color.WHITE
+        vertices.append(_sf.Vertex((x, y), white, (u, v)))
+        vertices.append(_sf.Vertex((x + w, y), white, (u + tw, v)))
+        vertices.append(_sf.Vertex((x + w, y + h), white, (u + tw, v + th)))
+        vertices.append(_sf.Vertex((x, y + h), white, (u, v + th)))
+
+    def flush(self, window):
+        for texture in self.textures:
+            vertices = self.vertices[id(texture)]
+            states = _sf.RenderStates()
+            states.texture = texture
+            window._impl.draw(vertices, states)
+            vertices.clear()
+        del self.textures[:]
+        self.vertices.clear()
+
+def load_texture(filename):
+    return _sf.Texture.from_file(filename)
+
+def decode_image(filename):
+    """Image in main memory, to be uploaded with `texture_from_image`."""
+    return _sf.Image.from_file(filename)
+
+def decode_image_memory(data):
+    """Image from an encoded image (PNG...) in a buffer."""
+    return _sf.Image.from_memory(bytes(data))
+
+def texture_size(texture):
+    return texture.width, texture.height
+
+def create_sprite(texture, rect=None):
+    # a negative width flips the sprite
+    if rect is None:
+        return _sf.Sprite(texture)
+    x, y, w, h = rect
+    return _sf.Sprite(texture, _sf.Rectangle((x, y), (w, h)))
+
+def create_rectangle(size, color):
+    shape = _sf.RectangleShape(size)
+    shape.fill_color = color
+    return shape
+
+def image_size(filename):
+    image = _sf.Image.from_file(filename)
+    return image.width, image.height
+
+def image_pixels(filename):
+    """RGBA pixels of an image file, as a (height, width, 4) array."""
+    image = _sf.Image.from_file(filename)
+    return np.frombuffer(image.pixels.data, np.uint8).reshape(image.height,
+            image.width, 4)
+
+def compose_image(size, blits):
+    """Image of `size` with the images of `blits`, (filename, (x, y))
+    pairs, copied at their position."""
+    image = _sf.Image.create(size[0], size[1], _sf.Color.TRANSPARENT)
+    for filename, position in blits:
+        image.blit(_sf.Image.from_file(filename), position)
+    return image
+
+def texture_from_image(image):
+    return _sf.Texture.from_image(image)
+
+def save_image(image, filename):
+    image.to_file(filename)
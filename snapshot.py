@@ -0,0 +1,88 @@
+"""Snapshots of the simulation, for rollbacks and save states.
+
+A `Snapshot` owns one flat buffer, sized once for a world and its models,
+holding the bodies (as copies of the world arrays) and the models (state
+ids and animation time). `save` and `restore` copy from and to the live
+objects in place, and the buffer can be written to and read from files.
+
+The population must not change between `save` and `restore`.
+"""
+import numpy as np
+
+_body_fields = (('positions', 2), ('previous', 2), ('velocities', 2),
+        ('accelerations', 2))
+
+class Snapshot(object):
+    def __init__(self, world, models):
+        self.world = world
+        self.models = list(models)
+        self.count = n = world.count
+        m = len(self.models)
+        layout = [(name, np.float64, (n, width))
+                for name, width in _body_fields]
+        layout += [('times', np.float64, (m,)), ('state_ids', np.int16, (m,)),
+                ('active_ids', np.int16, (m,)), ('contacts', np.bool_, (n,))]
+        size = sum(np.dtype(t).itemsize * int(np.prod(s))
+                for _, t, s in layout)
+        self.buffer = bytearray(size)
+        self.fields = {}
+        offset = 0
+        for name, dtype, shape in layout:
+            count = int(np.prod(shape))
+            view = np.frombuffer(self.buffer, dtype, count, offset)
+            self.fields[name] = view.reshape(shape)
+            offset += view.nbytes
+        # flat views of the model fields, read and written item by item
+        # without intermediate lists
+        self._models = [memoryview(self.fields[name])
+                for name in ('state_ids', 'active_ids', 'times')]
+        self.pairs = None
+
+    def save(self):
+        world, n = self.world, self.count
+        if world.count != n:
+            raise ValueError("World has %d bodies, snapshot %d"
+                    % (world.count, n))
+        fields = self.fields
+        for name, _ in _body_fields:
+            np.copyto(fields[name], getattr(world, name)[:n])
+        np.copyto(fields['contacts'], world.contacts[:n])
+        state_ids, active_ids, times = self._models
+        for i, model in enumerate(self.models):
+            state_ids[i] = model.state_id
+            active_ids[i] = model.active_id
+            times[i] = model.animation.time
+        # pair contacts arrays are replaced, never modified
+        collisions = world.collisions
+        self.pairs = collisions.contacts if collisions is not None else None
+
+    def restore(self):
+        world, n = self.world, self.count
+        if world.count != n:
+            raise ValueError("World has %d bodies, snapshot %d"
+                    % (world.count, n))
+        fields = self.fields
+        for name, _ in _body_fields:
+            np.copyto(getattr(world, name)[:n], fields[name])
+        np.copyto(world.contacts[:n], fields['contacts'])
+        state_ids, active_ids, times = self._models
+        for model, state_id, active_id, time in zip(self.models, state_ids,
+                active_ids, times):
+            model.state_id = state_id
+            if model.active_id != active_id:
+                states = model.machine.states
+                states[model.active_id].on_end(model)
+                model.active_id = active_id
+                states[active_id].play(model)
+            model.animation.time = time
+        if world.collisions is not None and self.pairs is not None:
+            world.collisions.contacts = self.pairs
+
+    def write(self, f):
+        f.write(self.buffer)
+
+    def read(self, f):
+        """Read a buffer written by `write`, then `restore` it."""
+        if f.readinto(self.buffer) != len(self.buffer):
+            raise IOError("Truncated snapshot")
+        self.restore()
@@ -0,0 +1,36 @@
+from array import array
+
+class StateMachine(object):
+    """Declarative state machine, compiled once into integer state ids and a
+    dense transition table.
+
+    `states` maps state names to (shared) state objects, and `transitions`
+    maps state names to `{(control, pred): target name}` dicts, controls
+    being integers below `controls`. Instances using the machine only keep
+    the id of their current state.
+    """
+    def __init__(self, states, transitions, controls):
+        self.names = sorted(states)
+        self.ids = dict((name, i) for i, name in enumerate(self.names))
+        self.states = [states[name] for name in self.names]
+        self.width = 2 * controls
+        self.table = array('h', [-1]) * (len(self.names) * self.width)
+        for name, edges in transitions.items():
+            base = self.ids[name] * self.width
+            for (control, pred), target in edges.items():
+                if not 0 <= control < controls:
+                    raise ValueError("Invalid control '%s'" % control)
+                self.table[base + 2 * control + bool(pred)] = self.ids[target]
+        self.loaded = False
+
+    def load(self):
+        """Load the resources of every state, once."""
+        if not self.loaded:
+            for state in self.states:
+                state.load()
+            self.loaded = True
+
+    def next(self, state_id, control, pred=True):
+        """Id of the state reached from `state_id` by `(control, pred)`."""
+        target = self.table[state_id * self.width + 2 * control + bool(pred)]
+        return state_id if target < 0 else target
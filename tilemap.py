@@ -0,0 +1,358 @@
+"""Tile based levels, streamed by chunks.
+
+A level file starts with a `<width> <height> <tile size>` line, followed by
+`height` rows of exactly `width` characters, '#' being a solid tile, lines
+ending like the header's. Rows having a fixed width, the tiles of any chunk (a square of `chunk_size`
+tiles) are read with one seek per row, so that only the chunks around the
+camera or the players are kept in memory, whatever the size of the level.
+
+Every chunk covers its solid tiles with a few merged rectangles, and the
+bodies of a `physics.World` are only tested against the rectangles of the
+chunks their AABB overlaps during their move.
+"""
+import numpy as np
+import app
+from physics import cell_key, grid_cells
+
+SOLID = b'#'
+
+class Level(object):
+    """Level file, opened again for reading each chunk."""
+    def __init__(self, filename, chunk_size=16):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.readline()
+        try:
+            self.width, self.height, self.tile_size = map(int, header.split())
+        except ValueError:
+            raise ValueError("Invalid level header in '%s'" % filename)
+        self._offset = len(header)
+        # rows end like the header, '\r\n' in a CRLF checkout
+        newline = b'\r\n' if header.endswith(b'\r\n') else b'\n'
+        self._stride = self.width + len(newline)
+        with open(filename, 'rb') as f:
+            f.seek(self._offset + self.width)
+            end = f.read(len(newline))
+            f.seek(0, 2)
+            length = f.tell()
+        if end != newline or length != self._offset \
+                + self.height * self._stride:
+            raise ValueError("Level '%s' isn't %d rows of %d tiles"
+                    % (filename, self.height, self.width))
+        self.chunk_size = chunk_size
+        self.chunk_pixels = chunk_size * self.tile_size
+
+    @property
+    def size(self):
+        """Size of the level, in pixels."""
+        return (self.width * self.tile_size, self.height * self.tile_size)
+
+    @property
+    def chunks(self):
+        """Number of chunks along x and y."""
+        n = self.chunk_size
+        return (-(-self.width // n), -(-self.height // n))
+
+    def read(self, cx, cy):
+        """Solid tiles of chunk (cx, cy), a (rows, columns) bool array,
+        empty outside of the level."""
+        n = self.chunk_size
+        x0, y0 = cx * n, cy * n
+        x1, y1 = min(x0 + n, self.width), min(y0 + n, self.height)
+        if x0 < 0 or y0 < 0 or x0 >= x1 or y0 >= y1:
+            return np.zeros((0, 0), dtype=bool)
+        solid = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        with open(self.filename, 'rb') as f:
+            for row in range(y0, y1):
+                f.seek(self._offset + row * self._stride + x0)
+                line = f.read(x1 - x0)
+                if len(line) != x1 - x0:
+                    raise ValueError("Truncated level '%s' at row %d"
+                            % (self.filename, row))
+                solid[row - y0] = np.frombuffer(line, np.uint8) == ord(SOLID)
+        return solid
+
+def write(filename, width, height, tile_size, rows):
+    """Write a level of `height` `rows` (strings of `width` characters,
+    possibly generated one by one)."""
+    with open(filename, 'wb') as f:
+        f.write(('%d %d %d\n' % (width, height, tile_size)).encode('ascii'))
+        count = 0
+        for row in rows:
+            if len(row) != width:
+                raise ValueError("Row %d is %d tiles wide, not %d"
+                        % (count, len(row), width))
+            f.write(row.encode('ascii') + b'\n')
+            count += 1
+    if count != height:
+        raise ValueError("%d rows written, not %d" % (count, height))
+
+def merge(solid):
+    """Cover the solid tiles of `solid` with rectangles (x, y, w, h), in
+    tiles: runs of solid tiles of every row, extended down while the next
+    row has the same run."""
+    rects = []
+    extending = {}
+    for y, row in enumerate(solid):
+        padded = np.concatenate(([0], row.astype(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(padded))
+        runs = {}
+        for run in zip(edges[::2].tolist(), edges[1::2].tolist()):
+            rect = extending.pop(run, None)
+            if rect is None:
+                rect = [run[0], y, run[1] - run[0], 0]
+            rect[3] += 1
+            runs[run] = rect
+        rects.extend(extending.values())
+        extending = runs
+    rects.extend(extending.values())
+    return np.array(rects, dtype=float).reshape(-1, 4)
+
+class _Placed(app.Drawable):
+    """Drawable drawn at (x, y)."""
+    __slots__ = ('x', 'y', 'drawable')
+
+    def __init__(self, x, y, drawable):
+        self.x, self.y = x, y
+        self.drawable = drawable
+
+    def render(self, graphics):
+        graphics.push_state()
+        graphics.translate(self.x, self.y)
+        graphics.draw(self.drawable)
+        graphics.pop_state()
+
+class Chunk(object):
+    def __init__(self, level, cx, cy):
+        self.key = (cx, cy)
+        n = level.chunk_pixels
+        self.bounds = (cx * n, cy * n, n, n)
+        local = merge(level.read(cx, cy)) * level.tile_size
+        # solid rectangles (x, y, w, h), in pixels
+        self.rects = local + (cx * n, cy * n, 0, 0)
+        self.rect_list = self.rects.tolist()
+        self.local = local.tolist()
+        self.layer = None
+
+    def drawable(self, color):
+        """Static layer of the rectangles, drawn once in a texture."""
+        if self.layer is None:
+            n = self.bounds[2]
+            self.layer = app.Layer((n, n), static=True)
+            for x, y, w, h in self.local:
+                self.layer.add(_Placed(x, y, app.Rectangle((w, h), color)),
+                        (x, y, w, h))
+        return self.layer
+
+class TileMap(app.Drawable):
+    """Chunks of a `Level` loaded around points of interest, colliding with
+    the bodies of the worlds it is attached to."""
+    def __init__(self, level, radius=1, color='white'):
+        self.level = level
+        self.radius = radius
+        self.color = color
+        self.chunks = {}
+        self.loads = 0
+        self._index = None
+        # chunks of the points of the last `stream`
+        self._centers = None
+
+    def chunk_of(self, x, y):
+        n = float(self.level.chunk_pixels)
+        return int(x // n), int(y // n)
+
+    def stream(self, points):
+        """Keep the chunks within `radius` chunks of `points` (x, y) in
+        pixels loaded, unload the others."""
+        centers = [self.chunk_of(x, y) for x, y in points]
+        if centers == self._centers:
+            return
+        self._centers = centers
+        r = self.radius
+        cols, rows = self.level.chunks
+        wanted = set()
+        for cx, cy in centers:
+            for i in range(max(cx - r, 0), min(cx + r + 1, cols)):
+                for j in range(max(cy - r, 0), min(cy + r + 1, rows)):
+                    wanted.add((i, j))
+        if wanted == set(self.chunks):
+            return
+        for key in set(self.chunks) - wanted:
+            del self.chunks[key]
+        for key in wanted - set(self.chunks):
+            self.chunks[key] = Chunk(self.level, *key)
+            self.loads += 1
+        self._index = None
+
+    def index(self):
+        """(chunk keys, first rectangle, rectangles) of the loaded chunks,
+        chunk keys sorted; rebuilt when chunks are streamed."""
+        if self._index is None:
+            chunks = sorted(self.chunks.values(), key=lambda c: c.key)
+            keys = np.array([cell_key(*c.key) for c in chunks],
+                    dtype=np.int64)
+            counts = [len(c.rects) for c in chunks]
+            starts = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            rects = np.concatenate([c.rects for c in chunks]) if chunks \
+                    else np.zeros((0, 4))
+            self._index = keys, starts, rects
+        return self._index
+
+    def candidates(self, p, s, previous=None):
+        """Body and rectangle index arrays of the rectangles of the chunks
+        overlapped by the AABBs of positions `p` and sizes `s`, swept from
+        the `previous` positions if given."""
+        keys, starts, rects = self.index()
+        empty = np.zeros(0, dtype=np.int64)
+        if not len(keys) or not len(p):
+            return empty, empty
+        if previous is not None:
+            p, s = np.minimum(p, previous), np.abs(p - previous) + s
+        bodies, cells = grid_cells(p, s, float(self.level.chunk_pixels))
+        found = np.minimum(np.searchsorted(keys, cells), len(keys) - 1)
+        loaded = keys[found] == cells
+        bodies, found = bodies[loaded], found[loaded]
+        first, count = starts[found], starts[found + 1] - starts[found]
+        pairs = np.repeat(bodies, count)
+        offsets = np.arange(len(pairs)) - np.repeat(np.cumsum(count) - count,
+                count)
+        return pairs, np.repeat(first, count) + offsets
+
+    def collide(self, world):
+        """Push the bodies of `world` out of the solid rectangles they
+        reached since their previous position: onto them (in contact, as on
+        the world's floor), under them, or beside them. A rectangle is
+        reached when the body crosses its side, overlapping it along that
+        side either then or at the end of the move, so that fast bodies
+        don't go through rectangles thinner than their move."""
+        n = world.count
+        p, s = world.positions[:n], world.sizes[:n]
+        before = world.previous[:n]
+        a, r = self.candidates(p, s, before)
+        if not len(a):
+            return
+        rects = self.index()[2][r]
+        x, y = rects[:, 0], rects[:, 1]
+        right, bottom = x + rects[:, 2], y + rects[:, 3]
+        (px, py), (bx, by) = p[a].T, before[a].T
+        w, h = s[a].T
+        dx, dy = px - bx, py - by
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # x when crossing the top or bottom, y when crossing a side
+            x_top = bx + dx * ((y - h - by) / dy)
+            x_bottom = bx + dx * ((bottom - by) / dy)
+            y_left = by + dy * ((x - w - bx) / dx)
+            y_right = by + dy * ((right - bx) / dx)
+        over_x = (px < right) & (x < px + w)
+        over_y = (py < bottom) & (y < py + h)
+        was_above = by + h <= y
+        was_below = ~was_above & (by >= bottom)
+        beside = ~was_above & ~was_below
+        above = was_above & (py + h > y) & (over_x
+                | ((x_top < right) & (x < x_top + w)))
+        below = was_below & (py < bottom) & (over_x
+                | ((x_bottom < right) & (x < x_bottom + w)))
+        left_of = beside & (bx + w <= x) & (px + w > x) & (over_y
+                | ((y_left < bottom) & (y < y_left + h)))
+        right_of = beside & ~left_of & (bx >= right) & (px < right) & (over_y
+                | ((y_right < bottom) & (y < y_right + h)))
+        v = world.velocities[:n]
+        landing = np.full(n, np.inf)
+        np.minimum.at(landing, a[above], y[above] - h[above])
+        landed = np.isfinite(landing)
+        p[landed, 1] = landing[landed]
+        v[landed, 1] = 0
+        world.accelerations[:n][landed] = world.gravity.x, world.gravity.y
+        world.contacts[:n][landed] = True
+        ceiling = np.full(n, -np.inf)
+        np.maximum.at(ceiling, a[below], bottom[below])
+        bumped = np.isfinite(ceiling)
+        p[bumped, 1] = ceiling[bumped]
+        v[bumped, 1] = np.maximum(v[bumped, 1], 0)
+        wall = np.full(n, -np.inf)
+        np.maximum.at(wall, a[right_of], right[right_of])
+        pushed = np.full(n, np.inf)
+        np.minimum.at(pushed, a[left_of], x[left_of] - w[left_of])
+        wall = np.where(np.isfinite(pushed), pushed, wall)
+        blocked = np.isfinite(wall)
+        p[blocked, 0] = wall[blocked]
+        v[blocked, 0] = 0
+
+    def collide_body(self, world, i):
+        """`collide` for the body at index `i` only, with scalar
+        arithmetic."""
+        px, py = world.positions[i].tolist()
+        w, h = world.sizes[i].tolist()
+        bx, by = world.previous[i].tolist()
+        dx, dy = px - bx, py - by
+        n = float(self.level.chunk_pixels)
+        inf = float('inf')
+        landing, ceiling, pushed, wall = inf, -inf, inf, -inf
+        x0, y0 = min(px, bx), min(py, by)
+        x1, y1 = max(px, bx) + w, max(py, by) + h
+        for cx in range(int(x0 // n), int(x1 // n) + 1):
+            for cy in range(int(y0 // n), int(y1 // n) + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    continue
+                for x, y, rw, rh in chunk.rect_list:
+                    right, bottom = x + rw, y + rh
+                    if by + h <= y:
+                        if py + h <= y:
+                            continue
+                        if not (px < right and x < px + w):
+                            xt = bx + dx * (y - h - by) / dy
+                            if not (xt < right and x < xt + w):
+                                continue
+                        landing = min(landing, y - h)
+                    elif by >= bottom:
+                        if py >= bottom:
+                            continue
+                        if not (px < right and x < px + w):
+                            xt = bx + dx * (bottom - by) / dy
+                            if not (xt < right and x < xt + w):
+                                continue
+                        ceiling = max(ceiling, bottom)
+                    elif bx + w <= x:
+                        if px + w <= x:
+                            continue
+                        if not (py < bottom and y < py + h):
+                            yt = by + dy * (x - w - bx) / dx
+                            if not (yt < bottom and y < yt + h):
+                                continue
+                        pushed = min(pushed, x - w)
+                    elif bx >= right:
+                        if px >= right:
+                            continue
+                        if not (py < bottom and y < py + h):
+                            yt = by + dy * (right - bx) / dx
+                            if not (yt < bottom and y < yt + h):
+                                continue
+                        wall = max(wall, right)
+        if landing < inf:
+            world.positions[i, 1] = landing
+            world.velocities[i, 1] = 0
+            world.accelerations[i] = world.gravity.x, world.gravity.y
+            world.contacts[i] = True
+        if ceiling > -inf:
+            world.positions[i, 1] = ceiling
+            world.velocities[i, 1] = max(world.velocities[i, 1], 0)
+        if pushed < inf or wall > -inf:
+            world.positions[i, 0] = pushed if pushed < inf else wall
+            world.velocities[i, 0] = 0
+
+    def render(self, graphics):
+        """Draw the chunks in view, every one a single image."""
+        vx, vy, vw, vh = graphics.view
+        for chunk in self.chunks.values():
+            if not chunk.rect_list:
+                continue
+            x, y, w, h = chunk.bounds
+            if x < vx + vw and vx < x + w and y < vy + vh and vy < y + h:
+                graphics.push_state()
+                graphics.translate(x, y)
+                graphics.draw(chunk.drawable(self.color))
+                graphics.pop_state()
+                graphics.drawn += 1
+            else:
+                graphics.culled += 1